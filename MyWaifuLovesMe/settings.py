@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -78,11 +79,58 @@ WSGI_APPLICATION = "MyWaifuLovesMe.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
+# SQLite is used unless MWL_DATABASE_ENGINE is set to postgresql
+# PostgreSQL lets several import workers write at the same time, it needs psycopg2 installed
+if os.environ.get("MWL_DATABASE_ENGINE") == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("MWL_DATABASE_NAME", "mwl"),
+            "USER": os.environ.get("MWL_DATABASE_USER", ""),
+            "PASSWORD": os.environ.get("MWL_DATABASE_PASSWORD", ""),
+            "HOST": os.environ.get("MWL_DATABASE_HOST", ""),
+            "PORT": os.environ.get("MWL_DATABASE_PORT", ""),
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+
+# Web processes read through a separate read only connection, see common/database_router.py
+DATABASES["readonly"] = {**DATABASES["default"], "SQLITE_PROFILE": {"query_only": "on"}, "TEST": {"MIRROR": "default"}}
+
+# Optional, web processes read a snapshot of the database that the importer publishes every READ_SNAPSHOT_INTERVAL seconds
+# Reads never wait on imports but can be that many seconds out of date, see common/read_snapshot.py
+READ_SNAPSHOT = os.environ.get("MWL_READ_SNAPSHOT") == "1" and DATABASES["default"]["ENGINE"].endswith("sqlite3")
+READ_SNAPSHOT_PATH = BASE_DIR / "db.snapshot.sqlite3"
+READ_SNAPSHOT_INTERVAL = 300
+if READ_SNAPSHOT:
+    DATABASES["readonly"] = {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        # immutable means SQLite takes no locks, this is safe because the file is replaced instead of being changed
+        "NAME": f"file:{READ_SNAPSHOT_PATH}?mode=ro&immutable=1",
+        "OPTIONS": {"uri": True},
+        # The journal mode and syncing can't be changed on a read only file
+        "SQLITE_PROFILE": {"journal_mode": None, "synchronous": None, "query_only": "on"},
+        "TEST": {"MIRROR": "default"},
     }
+DATABASE_ROUTERS = ["common.database_router.DatabaseRoleRouter"]
+# Set to "web" by the WSGI and ASGI entry points, everything else reads and writes the default database
+DATABASE_ROLE = os.environ.get("MWL_DATABASE_ROLE", "importer")
+
+# PRAGMA values applied to every new SQLite connection by common/sqlite_profile.py
+# WAL lets web requests read while the importer is writing, busy_timeout makes writers wait for each other
+SQLITE_PROFILE = {
+    "journal_mode": "wal",
+    "busy_timeout": 30_000,  # Milliseconds
+    "synchronous": "normal",  # Safe with WAL, a power loss can only lose the last transactions
+    "mmap_size": 268_435_456,  # 256 MiB
+    "cache_size": -65_536,  # Negative values are KiB, 64 MiB
+    "temp_store": "memory",
 }
 
 
@@ -128,3 +176,13 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Maximum number of scheduled background media updates per day, counted in import queue entries not HTTP requests
+# New updates are moved to the first day under the budget when they are queued, rebalance_refresh_schedule does the
+# same for updates that are already queued
+IMPORTER_DAILY_UPDATE_BUDGET = 2000
+
+# Number of threads the async views use for database work, per process
+VIEW_EXECUTOR_WORKERS = 8
+# Number of requests a single process handles at once before returning 503 responses
+VIEW_MAX_CONCURRENT_REQUESTS = 64
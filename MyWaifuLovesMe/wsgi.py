@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MyWaifuLovesMe.settings')
+# Web requests read from the read only database connection
+os.environ.setdefault('MWL_DATABASE_ROLE', 'web')
 
 application = get_wsgi_application()
@@ -5,7 +5,10 @@ import os
 
 # Django
 import django
+from django.apps import apps
 
 # Patches in values so Django functions can be accessed outside of the Django server
-os.environ["DJANGO_SETTINGS_MODULE"] = "MyWaifuLovesMe.settings"
-django.setup()
+# The web server and management commands have already set up Django by the time this is imported, so only do it once
+if not apps.ready and not apps.loading:
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "MyWaifuLovesMe.settings")
+    django.setup()
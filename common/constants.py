@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import os
+
 # Common
 from common.extended_path import ExtendedPath
+from common.file_inventory import FileInventory, register_inventory
 
 # Unaknown
 # Unknown
@@ -11,3 +14,9 @@ from MyWaifuLovesMe.settings import BASE_DIR as _BASE_DIR
 BASE_DIR = ExtendedPath(_BASE_DIR)
 
 DOWNLOADED_FILES_DIR = BASE_DIR / "downloaded_files"
+
+# Files written to the download folder are recorded here so checking if they are up to date doesn't need a stat call
+FILE_INVENTORY = register_inventory(FileInventory(DOWNLOADED_FILES_DIR, BASE_DIR / "file_inventory.sqlite3"))
+
+# Can be pointed at a local server to test imports without using the real API
+MAL_API_DOMAIN = os.environ.get("MAL_API_DOMAIN", "https://api.myanimelist.net")
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Iterator, Optional
+
+    from django.db.models import Model
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+READONLY_DATABASE = "readonly"
+
+# Set by read_from_primary for reads that can't be out of date
+_read_from_primary: ContextVar[bool] = ContextVar("read_from_primary", default=False)
+
+
+@contextmanager
+def read_from_primary() -> Iterator[None]:
+    """Send reads to the default database, the read only database can be a snapshot that is a few minutes old"""
+    token = _read_from_primary.set(True)
+    try:
+        yield
+    finally:
+        _read_from_primary.reset(token)
+
+
+class DatabaseRoleRouter:
+    """Web processes read through their own read only connection so they never wait behind the importer's writes\n
+    Every other process, like the importer and management commands, uses the default database for everything\n
+    Writes always use the default database so a web request still sees its own writes"""
+
+    def db_for_read(self, model: type[Model], **hints: Any) -> Optional[str]:
+        if settings.DATABASE_ROLE == "web" and not _read_from_primary.get():
+            return READONLY_DATABASE
+        return None
+
+    def db_for_write(self, model: type[Model], **hints: Any) -> Optional[str]:
+        return "default"
+
+    def allow_relation(self, obj1: Model, obj2: Model, **hints: Any) -> Optional[bool]:
+        # Both aliases are the same database
+        return True
+
+    def allow_migrate(self, db: str, app_label: str, model_name: Optional[str] = None, **hints: Any) -> Optional[bool]:
+        return db != READONLY_DATABASE
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+# Standard Library
+import os
+import threading
+from collections import OrderedDict
+
+
+class DocumentCache:
+    """Parsed files shared by every ExtendedPath in the process, least recently used entries are dropped first\n
+    Entries are keyed by the file's modification time and size so a changed file is always parsed again\n
+    Sizes are counted using the size of the file, the parsed objects take up a few times more memory than that\n
+    Parsed documents are shared so they must not be modified by the code that uses them"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # (kind, path) -> (mtime_ns, size, parsed document)
+        self.entries: OrderedDict[tuple[str, str], tuple[int, int, Any]] = OrderedDict()
+        self.bytes = 0
+        # Every kind of document that has been cached, used to find all of the entries for a path
+        self.kinds: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path: os.PathLike[str], kind: str, parse: Callable[[bytes], Any], update: bool = False) -> Any:
+        """Get the parsed version of a file, parsing it if it is not cached or changed since it was parsed\n
+        update parses the file again even if the cached version looks up to date"""
+        key = (kind, os.path.abspath(path))
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.entries.get(key)
+            if not update and cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached[2]
+            self.misses += 1
+
+        # Parse outside of the lock so threads can parse different files at the same time
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            document = parse(file.read())
+
+        with self.lock:
+            self._remove(key)
+            # Files bigger than the whole cache are returned without being cached
+            if stat.st_size <= self.max_bytes:
+                self.kinds.add(kind)
+                self.entries[key] = (stat.st_mtime_ns, stat.st_size, document)
+                self.bytes += stat.st_size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return document
+
+    def invalidate(self, path: os.PathLike[str]) -> None:
+        """Drop every parsed version of a file, used when a file is written or deleted"""
+        path_string = os.path.abspath(path)
+        with self.lock:
+            for kind in self.kinds:
+                self._remove((kind, path_string))
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        if (entry := self.entries.pop(key, None)) is not None:
+            self.bytes -= entry[1]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
+
+
+# Can be changed with an environment variable because ExtendedPath is used without Django settings
+DOCUMENT_CACHE = DocumentCache(int(os.environ.get("MWL_DOCUMENT_CACHE_BYTES", 64 * 1024 * 1024)))
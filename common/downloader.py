@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+# Standard Library
+import urllib.request
+from urllib.error import HTTPError
+
+# Common
+from common.metrics import HTTP_BYTES, HTTP_RESPONSES, STAGE_SECONDS
+
+
+def download(url: str, headers: Optional[dict[str, str]] = None, kind: str = "json") -> tuple[int, bytes]:
+    """Download a URL and return the status code and the body\n
+    Error responses are returned instead of raised because the body of an error from the API is still JSON"""
+    print(f"Downloading: {url}")
+    request = urllib.request.Request(url, headers=headers or {})
+    with STAGE_SECONDS.time(stage="download"):
+        try:
+            with urllib.request.urlopen(request) as response:
+                status = response.status
+                content = response.read()
+        except HTTPError as error_msg:
+            status = error_msg.code
+            content = error_msg.read()
+
+    HTTP_RESPONSES.inc(status=str(status))
+    HTTP_BYTES.inc(len(content), kind=kind)
+    return status, content
@@ -18,6 +18,10 @@ import string
 from datetime import date, datetime
 from pathlib import Path
 
+# Common
+from common import file_inventory
+from common.document_cache import DOCUMENT_CACHE
+
 
 # There's a weird issue where with Path when you try to make a subclass of it
 # It's impossible to subclass Path and instead need to subclass the concrete implementation
@@ -52,8 +56,11 @@ class ExtendedPath((type(Path()))):
 
     def up_to_date(self, timestamp: Optional[datetime] = None) -> bool:
         """Check if a file exists and is up to date"""
+        # Files in a folder with an inventory are checked without touching the file system
+        entry = file_inventory.lookup(self)
+
         # If file does not exist it can't be up to date
-        if not self.exists():
+        if entry is None:
             return False
 
         # If no timestamp is given and the file exists it is up to date
@@ -64,7 +71,7 @@ class ExtendedPath((type(Path()))):
         timestamp = timestamp.astimezone()
 
         # If file is older it is not up to date
-        if datetime.fromtimestamp(self.stat().st_mtime).astimezone() < timestamp:
+        if entry.aware_mtime() < timestamp:
             return False
 
         # File exists and is newer
@@ -76,13 +83,15 @@ class ExtendedPath((type(Path()))):
 
     def file_count(self: ExtendedPath) -> int:
         """Count the number of files in a folder"""
-        return len(list(self.glob("*")))
+        with os.scandir(self) as entries:
+            return sum(1 for _ in entries)
 
     def write(self, content: bytes | str):
         """Write a bytes or a str object to a file, and will automatically create the directory if needed
 
         This is useful because str and byte objects need to be written to files with different parameters"""
         ExtendedPath(self.parent).mkdir(parents=True, exist_ok=True)
+        DOCUMENT_CACHE.invalidate(self)
 
         if isinstance(content, bytes):
             f = io.open(self, "wb")
@@ -91,6 +100,7 @@ class ExtendedPath((type(Path()))):
             f = io.open(self, "w", encoding="utf-8")
             f.write(content)
         f.close()
+        file_inventory.record(self, content)
 
     def write_json(self, content: bytes | str):
         """Write json to a file"""
@@ -100,41 +110,43 @@ class ExtendedPath((type(Path()))):
         """Move a file and automatically create the directory for the file if needed"""
         destination.parent.mkdir(parents=True, exist_ok=True)
         shutil.move(self, destination)
+        file_inventory.forget(self)
+        file_inventory.sync(destination)
 
     def copy(self, destination: ExtendedPath):
         """Copy a file and automatically create the directory for the file if needed"""
         destination.parent.mkdir(parents=True, exist_ok=True)
         shutil.copy(self, destination)
+        file_inventory.sync(destination)
 
     def copy_dir(self, destination: ExtendedPath):
         """Copy a file and automatically create the directory for the file if needed"""
         destination.parent.mkdir(parents=True, exist_ok=True)
         shutil.copytree(self, destination)
+        file_inventory.sync(destination)
 
     def parsed_html(self, update: bool = False) -> BeautifulSoup:
-        """Read and parse an html file"""
+        """Read and parse an html file, the result is shared with every other ExtendedPath for the same file"""
         # Import bs4 here so there are no required external dependencies for ExtendedPath
         # Common
         from common.extended_bs4 import BeautifulSoup
 
-        if not hasattr(self, "_parsed_json") or update:
-            self._parsed_html = BeautifulSoup(self.read_bytes(), "lxml")
-        return self._parsed_html
+        return DOCUMENT_CACHE.get(self, "html", lambda x: BeautifulSoup(x, "lxml"), update)
 
     def parsed_json(self, update: bool = False) -> Any:
-        """Read and parse a json file"""
-        if not hasattr(self, "_parsed_json") or update:
-            self._parsed_json = json.loads(self.read_bytes())
-        return self._parsed_json
+        """Read and parse a json file, the result is shared with every other ExtendedPath for the same file"""
+        return DOCUMENT_CACHE.get(self, "json", json.loads, update)
 
     def delete(self):
         """Delete a folder or a file without having to worry about which it is\n
         This is useful because normally files and folders need to be deleted differently"""
         if self.exists():
             if self.is_file():
+                DOCUMENT_CACHE.invalidate(self)
                 os.remove(self)
             else:
                 shutil.rmtree(self)
+            file_inventory.forget(self)
 
     @classmethod
     def convert_to_path(
@@ -225,7 +237,9 @@ class ExtendedPath((type(Path()))):
 
     def aware_mtime(self) -> datetime:
         """Create an aware timestamp from the file's mtime"""
-        return datetime.fromtimestamp(self.stat().st_mtime).astimezone()
+        if (entry := file_inventory.lookup(self)) is None:
+            raise FileNotFoundError(f"No such file: '{self}'")
+        return entry.aware_mtime()
 
     def depth(self) -> int:
         """Get the depth of the path"""
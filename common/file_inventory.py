@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Iterator, Optional
+
+# Standard Library
+import hashlib
+import os
+import sqlite3
+import stat
+import threading
+from datetime import datetime
+from typing import NamedTuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_mtime_ns ON files (mtime_ns);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+class FileEntry(NamedTuple):
+    mtime_ns: int
+    size: int
+    # Files that were found with stat instead of being written or scanned have no hash
+    hash: Optional[str]
+
+    def aware_mtime(self) -> datetime:
+        return datetime.fromtimestamp(self.mtime_ns / 1_000_000_000).astimezone()
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def stat_entry(path: os.PathLike[str] | str) -> Optional[FileEntry]:
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return FileEntry(stat_result.st_mtime_ns, stat_result.st_size, None)
+
+
+class FileInventory:
+    """SQLite index of every file in a folder with its modification time, size and hash\n
+    ExtendedPath keeps it up to date when it writes or deletes files so freshness checks are a query instead of a stat\n
+    Until the first rebuild files that are not in the index are looked up with stat and added to the index\n
+    After a rebuild the index is trusted completely, files changed without ExtendedPath need another rebuild"""
+
+    def __init__(self, root: os.PathLike[str] | str, database: os.PathLike[str] | str):
+        self.root = os.path.abspath(root)
+        self.database = os.fspath(database)
+        # sqlite3 connections can't be shared between threads, the import pipeline writes files from several threads
+        self.local = threading.local()
+        self._complete = False
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+            # Web processes read the index while the importer writes to it
+            connection.execute("PRAGMA journal_mode = wal")
+            connection.execute("PRAGMA synchronous = normal")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+        return connection
+
+    def key(self, path: os.PathLike[str] | str) -> Optional[str]:
+        """Path relative to the root using forward slashes, None for paths outside of the root"""
+        path_string = os.path.abspath(path)
+        if not path_string.startswith(self.root + os.sep):
+            return None
+        return path_string[len(self.root) + 1 :].replace(os.sep, "/")
+
+    def complete(self) -> bool:
+        """If every file in the folder is in the index, only changes from False to True so it is cached once True"""
+        if not self._complete:
+            row = self.connection().execute("SELECT value FROM state WHERE key = 'complete'").fetchone()
+            self._complete = row is not None and row[0] == "1"
+        return self._complete
+
+    def entry(self, key: str) -> Optional[FileEntry]:
+        row = self.connection().execute("SELECT mtime_ns, size, hash FROM files WHERE path = ?", (key,)).fetchone()
+        if row is not None:
+            return FileEntry(*row)
+        if self.complete():
+            return None
+
+        # Files from before the index existed are added the first time they are checked
+        try:
+            stat_result = os.stat(os.path.join(self.root, key))
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+        entry = FileEntry(stat_result.st_mtime_ns, stat_result.st_size, None)
+        self.record(key, entry)
+        return entry
+
+    def record(self, key: str, entry: FileEntry) -> None:
+        self.connection().execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (key, *entry))
+
+    def forget(self, key: str) -> None:
+        """Remove a file, or every file in a folder, from the index"""
+        # Every path in a folder sorts between "folder/" and "folder0" because "0" comes right after "/"
+        self.connection().execute(
+            "DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)", (key, f"{key}/", f"{key}0")
+        )
+
+    def count_modified_since(self, folder: os.PathLike[str] | str, since: datetime, suffix: str = "") -> int:
+        """Number of files directly in a folder that were modified at or after since"""
+        if (folder_key := self.key(folder)) is None:
+            raise ValueError(f"{folder} is not inside {self.root}")
+        prefix = f"{folder_key}/"
+        return (
+            self.connection()
+            .execute(
+                """SELECT COUNT(*) FROM files
+            WHERE path >= ? AND path < ? AND instr(substr(path, ?), '/') = 0 AND path LIKE ? AND mtime_ns >= ?""",
+                (prefix, f"{folder_key}0", len(prefix) + 1, f"%{suffix}", int(since.timestamp() * 1_000_000_000)),
+            )
+            .fetchone()[0]
+        )
+
+    def scan(self, folder: str) -> Iterator[tuple[str, os.stat_result]]:
+        """Every file in a folder and its subfolders"""
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.scan(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat(follow_symlinks=False)
+
+    def rebuild(self, key: str = "") -> tuple[int, int, int]:
+        """Scan the whole folder, or one file or folder in it, and make the index match it\n
+        Only new or changed files are read to hash them\n
+        Returns the number of files that are indexed, hashed and removed"""
+        connection = self.connection()
+        path = os.path.join(self.root, key) if key else self.root
+        if key:
+            where, parameters = "WHERE path = ? OR (path >= ? AND path < ?)", (key, f"{key}/", f"{key}0")
+        else:
+            where, parameters = "", ()
+        existing = {
+            row[0]: FileEntry(*row[1:])
+            for row in connection.execute(f"SELECT path, mtime_ns, size, hash FROM files {where}", parameters)
+        }
+
+        rows: list[tuple[str, int, int, Optional[str]]] = []
+        hashed = 0
+        if os.path.isdir(path):
+            found = self.scan(path)
+        else:
+            found = iter([(path, os.stat(path))] if os.path.isfile(path) else [])
+        for file_path, stat_result in found:
+            file_key = file_path[len(self.root) + 1 :].replace(os.sep, "/")
+            old = existing.pop(file_key, None)
+            if old and old.hash and (old.mtime_ns, old.size) == (stat_result.st_mtime_ns, stat_result.st_size):
+                continue
+            with open(file_path, "rb") as file:
+                rows.append((file_key, stat_result.st_mtime_ns, stat_result.st_size, content_hash(file.read())))
+            hashed += 1
+
+        connection.execute("BEGIN")
+        try:
+            connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", rows)
+            connection.executemany("DELETE FROM files WHERE path = ?", ((x,) for x in existing))
+            if not key:
+                connection.execute("INSERT OR REPLACE INTO state VALUES ('complete', '1')")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        indexed = connection.execute(f"SELECT COUNT(*) FROM files {where}", parameters).fetchone()[0]
+        return indexed, hashed, len(existing)
+
+
+# Folders with an inventory, registered by common.constants because ExtendedPath is used without Django settings
+INVENTORIES: list[FileInventory] = []
+
+
+def register_inventory(inventory: FileInventory) -> FileInventory:
+    INVENTORIES.append(inventory)
+    return inventory
+
+
+def find_inventory(path: os.PathLike[str] | str) -> tuple[Optional[FileInventory], str]:
+    for inventory in INVENTORIES:
+        if (key := inventory.key(path)) is not None:
+            return inventory, key
+    return None, ""
+
+
+def lookup(path: os.PathLike[str] | str) -> Optional[FileEntry]:
+    """Modification time, size and hash of a file, None if the file does not exist"""
+    inventory, key = find_inventory(path)
+    return inventory.entry(key) if inventory else stat_entry(path)
+
+
+def record(path: os.PathLike[str] | str, content: bytes | str) -> None:
+    """Add a file that was just written to its inventory"""
+    inventory, key = find_inventory(path)
+    if inventory:
+        stat_result = os.stat(path)
+        content = content.encode("utf-8") if isinstance(content, str) else content
+        inventory.record(key, FileEntry(stat_result.st_mtime_ns, stat_result.st_size, content_hash(content)))
+
+
+def forget(path: os.PathLike[str] | str) -> None:
+    """Remove a file or folder that was just deleted from its inventory"""
+    inventory, key = find_inventory(path)
+    if inventory:
+        inventory.forget(key)
+
+
+def sync(path: os.PathLike[str] | str) -> None:
+    """Make the inventory match a file or folder that was changed by copying or moving it"""
+    inventory, key = find_inventory(path)
+    if inventory:
+        inventory.rebuild(key)
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Iterable, Optional
+
+    from common.myanimelist_media import MyAnimeListMedia
+
+import queue
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.db import connections, transaction
+
+from common.refresh_scheduler import bulk_upsert
+
+
+@dataclass
+class ImportJob:
+    media: MyAnimeListMedia
+    minimum_info_timestamp: Optional[datetime] = None
+    minimum_modified_timestamp: Optional[datetime] = None
+    # Sparse entries downloaded along with the media, their download results are saved by the apply stage
+    dependents: list[MyAnimeListMedia] = field(default_factory=list)
+
+
+class ImportPipeline:
+    """Imports media in three stages that are connected by bounded queues\n
+    fetch: Downloads every file needed for an entry, this is where all network access and sleeping happens\n
+    parse: Parses the downloaded files so the parsed values are cached on the MyAnimeListMedia object\n
+    apply: A single writer that updates the database in batches, with one transaction per batch\n
+    Because the fetch stage never holds a transaction network latency never holds the SQLite write lock\n
+    The fetch stage only reads from the database, errors and avoided downloads are saved by the apply stage"""
+
+    # Put on a queue to tell the next stage there are no more jobs
+    _STOP = object()
+
+    def __init__(self, batch_size: int = 25, queue_size: int = 50) -> None:
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.stopped = threading.Event()
+        self.errors: list[BaseException] = []
+
+    def run(self, jobs: Iterable[ImportJob]) -> None:
+        fetched: queue.Queue[Any] = queue.Queue(maxsize=self.queue_size)
+        parsed: queue.Queue[Any] = queue.Queue(maxsize=self.queue_size)
+
+        threads = [
+            threading.Thread(target=self.stage, args=(self.fetch_stage, jobs, fetched), daemon=True),
+            threading.Thread(target=self.stage, args=(self.parse_stage, fetched, parsed), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        # The apply stage runs in the calling thread so the database writes use the caller's connection
+        try:
+            self.apply_stage(parsed)
+        except BaseException as error:
+            self.errors.append(error)
+            self.stopped.set()
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def stage(self, function: Callable[[Any, queue.Queue[Any]], None], source: Any, output: queue.Queue[Any]) -> None:
+        """Run a stage in a background thread, making sure the next stage is always told when to stop"""
+        try:
+            function(source, output)
+        except BaseException as error:
+            self.errors.append(error)
+            self.stopped.set()
+        finally:
+            self.put(output, self._STOP)
+            # Each thread gets its own database connection that needs to be closed manually
+            connections.close_all()
+
+    def put(self, output: queue.Queue[Any], item: Any) -> None:
+        """Put an item on a queue, giving up if another stage failed so a full queue can't deadlock the pipeline"""
+        while True:
+            try:
+                output.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.stopped.is_set():
+                    return
+
+    def get(self, source: queue.Queue[Any]) -> Any:
+        """Get an item from a queue, returning _STOP if another stage failed"""
+        while True:
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                if self.stopped.is_set():
+                    return self._STOP
+
+    def fetch_stage(self, jobs: Iterable[ImportJob], output: queue.Queue[Any]) -> None:
+        for job in jobs:
+            if self.stopped.is_set():
+                return
+            if job.media.needs_import(job.minimum_info_timestamp, job.minimum_modified_timestamp):
+                print(f"Fetching {job.media.MEDIA_TYPE}: {job.media.media_id}")
+                job.dependents = job.media.prefetch(job.minimum_info_timestamp)
+            self.put(output, job)
+
+    def parse_stage(self, source: queue.Queue[Any], output: queue.Queue[Any]) -> None:
+        while (job := self.get(source)) is not self._STOP:
+            if job.media.needs_import(job.minimum_info_timestamp, job.minimum_modified_timestamp):
+                # All of these values are cached on the object so the apply stage does not parse anything
+                if job.media.json_file_is_valid():
+                    job.media.json_file_parsed()
+                    if not job.media.sparse_import and job.media.userrecs_on_html():
+                        job.media.userrecs_from_html()
+            self.put(output, job)
+
+    def apply_stage(self, source: queue.Queue[Any]) -> None:
+        batch: list[ImportJob] = []
+        while (job := self.get(source)) is not self._STOP:
+            batch.append(job)
+            if len(batch) >= self.batch_size:
+                self.apply_batch(batch)
+                batch = []
+
+        if batch and not self.stopped.is_set():
+            self.apply_batch(batch)
+
+    @transaction.atomic
+    def apply_batch(self, batch: list[ImportJob]) -> None:
+        print(f"Applying {len(batch)} entries")
+        for job in batch:
+            for dependent in job.dependents:
+                dependent.save_download_results()
+            job.media.apply(job.minimum_info_timestamp, job.minimum_modified_timestamp, schedule=False)
+
+        # Schedule the next update for every entry in the batch at once
+        entries = [job.media.import_que_entry() for job in batch if not job.media.negative_cache_entry()]
+        bulk_upsert(entry for entry in entries if entry is not None)
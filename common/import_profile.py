@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Run from the project folder so the project modules can be imported
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# Every way a process starts, each is timed in a new interpreter so nothing is already imported
+STATEMENTS = {
+    "django.setup": "import os; os.environ['DJANGO_SETTINGS_MODULE'] = 'MyWaifuLovesMe.settings'; import django; django.setup()",
+    "importer": "import common.configure_django",
+    "web": "import os; os.environ['DJANGO_SETTINGS_MODULE'] = 'MyWaifuLovesMe.settings'; "
+    "from django.core.wsgi import get_wsgi_application; get_wsgi_application(); import main.urls",
+}
+
+TIMER = "import time; start = time.perf_counter(); exec({statement!r}); print(time.perf_counter() - start)"
+
+
+def time_statement(statement: str, runs: int = 5) -> list[float]:
+    """Seconds it takes to run statement in a new Python process, once per run"""
+    times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMER.format(statement=statement)],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return times
+
+
+def imported_modules(statement: str) -> set[str]:
+    """Every module that is imported by running statement in a new Python process"""
+    code = f"import sys; before = set(sys.modules); exec({statement!r}); print(*sorted(set(sys.modules) - before))"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return set(output.split())
+
+
+def import_times(statement: str) -> list[tuple[int, int, int, str]]:
+    """Rows of (depth, self, cumulative, module) from python -X importtime, times are in microseconds"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], cwd=PROJECT_DIR, capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        # import time:       262 |        399 |   main.models.functions
+        parts = line.removeprefix("import time:").split("|")
+        if len(parts) == 3 and parts[0].strip().isdigit():
+            # Nested imports are indented by 2 extra spaces for each level
+            depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+            rows.append((depth, int(parts[0]), int(parts[1]), parts[2].strip()))
+    return rows
+
+
+def total_import_time(statement: str) -> float:
+    """Seconds spent importing modules, the cumulative times of the top level imports added together"""
+    return sum(cumulative for depth, _, cumulative, _ in import_times(statement) if depth == 0) / 1_000_000
+
+
+def slowest_imports(statement: str, limit: int = 15) -> list[tuple[int, str]]:
+    """Modules with the largest self import time in microseconds"""
+    return sorted(((x[1], x[3]) for x in import_times(statement)), reverse=True)[:limit]
+
+
+def main(names: Iterable[str], runs: int, top: int) -> None:
+    for name in names:
+        times = time_statement(STATEMENTS[name], runs)
+        print(
+            f"{name}: median {statistics.median(times) * 1000:.0f}ms, min {min(times) * 1000:.0f}ms ({runs} runs), "
+            f"{total_import_time(STATEMENTS[name]) * 1000:.0f}ms importing"
+        )
+        for microseconds, module in slowest_imports(STATEMENTS[name], top):
+            print(f"    {microseconds / 1000:8.1f}ms {module}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time how long each kind of process takes to start")
+    parser.add_argument("names", nargs="*", default=list(STATEMENTS), help=f"Any of {', '.join(STATEMENTS)}")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to show")
+    arguments = parser.parse_args()
+    if unknown := set(arguments.names) - set(STATEMENTS):
+        parser.error(f"Unknown names: {', '.join(sorted(unknown))}")
+    main(arguments.names, arguments.runs, arguments.top)
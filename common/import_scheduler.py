@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+    from django.db.models import QuerySet
+
+from datetime import datetime
+
+from django.db.models import Q
+
+from common.metrics import LANE_BATCHES
+from main.models import ImportQue
+
+# Share of the importer each lane gets when every lane has work waiting
+# With these weights a user waiting on recommendations gets 8 turns for every background turn
+LANE_WEIGHTS = {
+    ImportQue.LANE_INTERACTIVE: 8,
+    ImportQue.LANE_USER_MEDIA: 4,
+    ImportQue.LANE_BACKGROUND: 1,
+}
+
+# Number of media entries imported per turn
+# Background batches are kept small so a new user never waits long for the current batch to finish
+LANE_BATCH_SIZES = {
+    ImportQue.LANE_INTERACTIVE: 25,
+    ImportQue.LANE_USER_MEDIA: 50,
+    ImportQue.LANE_BACKGROUND: 25,
+}
+
+
+def due_entries() -> QuerySet[ImportQue]:
+    """Entries in the queue that have outdated information"""
+    now = datetime.now().astimezone()
+    return (
+        ImportQue.objects.filter(Q(minimum_info_timestamp__lt=now) | Q(minimum_modified_timestamp__lt=now))
+        # Modified timestamp is used when brand new information is being imported which should always get priority over updating old information
+        # Yes this looks backwards, but the results are correct
+        .order_by("minimum_info_timestamp", "minimum_modified_timestamp")
+    )
+
+
+class WeightedFairScheduler:
+    """Pick which lane gets the next turn using weighted fair queuing\n
+    Every turn costs a lane 1 / weight, and the lane with work that has spent the least goes next\n
+    Lanes without work do not save up turns, otherwise a lane that was empty for a day could take over the importer"""
+
+    def __init__(self, weights: dict[int, int] = LANE_WEIGHTS) -> None:
+        self.weights = weights
+        self.spent = {lane: 0.0 for lane in weights}
+
+    def next_lane(self, ready: set[int]) -> Optional[int]:
+        if not ready:
+            return None
+
+        lane = min(ready, key=lambda x: (self.spent[x], x))
+        for idle_lane in self.weights.keys() - ready:
+            self.spent[idle_lane] = max(self.spent[idle_lane], self.spent[lane])
+        self.spent[lane] += 1 / self.weights[lane]
+        return lane
+
+    def next_batch(self) -> list[ImportQue]:
+        """Get the entries to import next, either a single user or a batch of media from the same lane"""
+        due = due_entries()
+        ready = set(due.order_by().values_list("lane", flat=True).distinct())
+        lane = self.next_lane(ready & self.weights.keys())
+        if lane is None:
+            return []
+        LANE_BATCHES.inc(lane=str(lane))
+
+        lane_entries = due.filter(lane=lane)
+        first = lane_entries.first()
+        if first is None:
+            return []
+        if first.type == "user":
+            return [first]
+        return list(lane_entries.filter(type__in=["anime", "manga"])[: LANE_BATCH_SIZES[lane]])
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, TypeVar
+
+    FUNCTION = TypeVar("FUNCTION", bound=Callable[..., Any])
+
+# Standard Library
+from functools import wraps
+
+
+def instance_cache(function: FUNCTION) -> FUNCTION:
+    """Like functools.cache for methods, but the results are stored on the instance and are freed with it\n
+    functools.cache keeps every instance it was called with, and everything they reference, for the life of the process"""
+    attribute = f"_instance_cache_{function.__name__}"
+
+    @wraps(function)
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        # Arguments are the key like they are for functools.cache, keyword arguments are kept separate
+        key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+        results = self.__dict__.setdefault(attribute, {})
+        try:
+            return results[key]
+        except KeyError:
+            result = results[key] = function(self, *args, **kwargs)
+            return result
+
+    return wrapper  # type: ignore - The signature is the same as the wrapped function
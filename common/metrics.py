@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Iterator
+
+    from common.extended_path import ExtendedPath
+
+# Standard Library
+import bisect
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Default histogram buckets in seconds, from a fast database write to a slow HTML download with sleeps
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric(ABC):
+    """Base class for a metric that is exported in the Prometheus text format"""
+
+    TYPE: str
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def label_key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} requires the labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[x]) for x in self.labels)
+
+    def format_labels(self, key: tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"] + self.render_samples()
+
+    @abstractmethod
+    def render_samples(self) -> list[str]:
+        ...
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render_samples(self) -> list[str]:
+        with self.lock:
+            return [f"{self.name}{self.format_labels(key)} {value}" for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def replace(self, values: dict[tuple[str, ...], float]) -> None:
+        """Replace every value at once so labels that no longer exist are removed"""
+        with self.lock:
+            self.values = dict(values)
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # Every label combination has one counter per bucket, the +Inf counter, the sum, and the count
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.label_key(labels)
+        with self.lock:
+            counts, total = self.values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe how long the body of a with statement takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render_samples(self) -> list[str]:
+        lines: list[str] = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bucket, count in zip([*self.buckets, "+Inf"], counts):
+                    cumulative += count
+                    bucket_label = f'le="{bucket}"'
+                    lines.append(f"{self.name}_bucket{self.format_labels(key, bucket_label)} {cumulative}")
+                lines.append(f"{self.name}_sum{self.format_labels(key)} {total[0]}")
+                lines.append(f"{self.name}_count{self.format_labels(key)} {cumulative}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+STAGE_SECONDS = Histogram(
+    "mwl_importer_stage_seconds",
+    "Time spent in each importer stage (download, parse, apply, schedule, sparse_import)",
+    ("stage",),
+)
+QUEUE_DEPTH = Gauge("mwl_importer_queue_depth", "Number of due entries in the import queue", ("category",))
+HTTP_RESPONSES = Counter("mwl_importer_http_responses_total", "Number of HTTP responses by status code", ("status",))
+HTTP_BYTES = Counter("mwl_importer_http_bytes_total", "Number of bytes downloaded", ("kind",))
+FETCHES_AVOIDED = Counter("mwl_importer_fetches_avoided_total", "Number of downloads skipped by the negative cache")
+LANE_BATCHES = Counter("mwl_importer_lane_batches_total", "Number of turns each import queue lane was given", ("lane",))
+DOCUMENT_CACHE = Gauge(
+    "mwl_importer_document_cache",
+    "Parsed document cache statistics (hits, misses, hit_rate, evictions, entries, bytes)",
+    ("stat",),
+)
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format"""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def write_textfile(path: ExtendedPath) -> None:
+    """Write every metric to a file that can be picked up by the node_exporter textfile collector\n
+    The file is written to a temporary path first so the collector never reads a partial file"""
+    temporary_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temporary_path.write(render())
+    os.replace(temporary_path, path)
@@ -3,7 +3,7 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from typing import Literal, Optional, Type, TypeVar, Union
+    from typing import Any, Literal, Optional, Type, TypeVar, Union
 
     GENRE_TYPEVAR = TypeVar("GENRE_TYPEVAR", bound=Union["AnimeGenres", "MangaGenres"])
     PICTURES_TYPEVAR = TypeVar("PICTURES_TYPEVAR", bound=Union["AnimePictures", "MangaPictures"])
@@ -12,21 +12,25 @@ if TYPE_CHECKING:
     IMAGE_TYPEVAR = TypeVar("IMAGE_TYPEVAR", bound=Union[str, None])
     from typing_extensions import Self
 
-import random
+import hashlib
+import json
 import time
-import urllib.request
 from abc import abstractmethod
 from datetime import date, datetime, timedelta
-from functools import cache
-from urllib.error import HTTPError
 
 from django.db import transaction
+from django.db.models import F
 
 import common.extended_re as re
+from common import file_inventory
 from common.anime_typed_dict import AnimeDataClass
-from common.constants import DOWNLOADED_FILES_DIR
+from common.constants import DOWNLOADED_FILES_DIR, MAL_API_DOMAIN
+from common.downloader import download
 from common.extended_path import ExtendedPath
+from common.instance_cache import instance_cache
 from common.manga_typed_dict import MangaDataClass
+from common.metrics import FETCHES_AVOIDED, STAGE_SECONDS
+from common.refresh_scheduler import bulk_upsert, next_due
 from common.shared_type_dict import (
     AlternativeTitle,
     GenericEntry,
@@ -54,6 +58,7 @@ from main.models import (
     MangaRelatedAnime,
     MangaRelatedManga,
     MangaSynonyms,
+    NegativeCache,
     Studio,
 )
 
@@ -76,14 +81,28 @@ class MyAnimeListMedia:
     media_id: int
     db_object: Anime | Manga
     sparse_import: bool
+    # Negative cache changes from downloading, written by apply so downloading never writes to the database
+    download_errors: list[tuple[int, str, datetime]]
+    fetches_avoided: int
 
     # Actual constants
     DOMAIN = "https://myanimelist.net"
-    API_DOMAIN = "https://api.myanimelist.net"
+    API_DOMAIN = MAL_API_DOMAIN
     HEADERS = {"X-MAL-CLIENT-ID": MyAnimeListSecrets.CLIENT_ID}
     URL_REGEX = re.compile(
         r"^(?:https:\/\/myanimelist\.net)?\/?(?P<media_type>anime|manga)\/(?P<media_id>\d+?)(?:\/|$)"
     )
+    # Bump this when the userrecs.html parsing changes so old sidecar files are ignored
+    USERRECS_SIDECAR_VERSION = 1
+    # Entries that do not exist are cached longer than other errors which are probably temporary
+    NOT_FOUND_TTL = timedelta(days=30)
+    ERROR_TTL = timedelta(days=1)
+    # Fields that change on almost every download but are not worth a full import on their own
+    VOLATILE_FIELDS = ("mean", "rank", "popularity", "num_list_users", "num_scoring_users", "statistics")
+    # Every download that does not change anything makes the time until the next update this much longer
+    REFRESH_GROWTH = 1.5
+    REFRESH_MIN_DAYS = 14
+    REFRESH_MAX_DAYS = 730
 
     @classmethod
     def from_url(cls, url: str, sparse_import: bool) -> Self:
@@ -120,40 +139,86 @@ class MyAnimeListMedia:
     def json_file_parsed(self) -> AnimeDataClass | MangaDataClass:
         ...
 
-    @cache
+    @instance_cache
     def html_url(self) -> str:
         return f"{self.MEDIA_TYPE}/{self.media_id}"
 
-    @cache
+    @instance_cache
     def partial_userrecs_html_url(self) -> str:
         return f"{self.html_url()}/userrecs/userrecs"
 
-    @cache
+    @instance_cache
     def userrecs_html_url(self) -> str:
         return f"{self.DOMAIN}/{self.partial_userrecs_html_url()}"
 
-    @cache
+    @instance_cache
     def userrecs_html_file_path(self) -> ExtendedPath:
         return DOWNLOADED_FILES_DIR / self.MEDIA_TYPE / str(self.media_id) / "userrecs.html"
 
-    @cache
+    @classmethod
+    def parse_userrecs_html(cls, html_path: ExtendedPath) -> list[tuple[int, int]]:
+        """Get a list of (recommended_id, count) pairs from a userrecs.html file\n
+        Parsing the HTML is slow so the results are stored in a sidecar file next to the HTML file\n
+        The sidecar is only used if the mtime and size of the HTML file still match what was parsed"""
+        sidecar_path = html_path.with_suffix(".json")
+        html_stat = html_path.stat()
+
+        if sidecar_path.exists():
+            sidecar = sidecar_path.parsed_json(update=True)
+            if (
+                sidecar.get("version") == cls.USERRECS_SIDECAR_VERSION
+                and sidecar.get("mtime_ns") == html_stat.st_mtime_ns
+                and sidecar.get("size") == html_stat.st_size
+            ):
+                return [(media_id, rec_count) for media_id, rec_count in sidecar["recommendations"]]
+
+        recommendations: list[tuple[int, int]] = []
+        with STAGE_SECONDS.time(stage="parse"):
+            parsed_html = html_path.parsed_html(update=True)
+            for related in parsed_html.select("div[class='picSurround']"):
+                url = related.strict_select_one("a").attrs["href"]
+                media_id = int(re.strict_search(cls.URL_REGEX, url).group("media_id"))
+
+                parent = related.strict_parent().strict_parent()
+                rec_count = len(parent.strict_select("div[class='spaceit_pad detail-user-recs-text']"))
+
+                recommendations.append((media_id, rec_count))
+
+        sidecar_path.write_json(
+            {
+                "version": cls.USERRECS_SIDECAR_VERSION,
+                "mtime_ns": html_stat.st_mtime_ns,
+                "size": html_stat.st_size,
+                "recommendations": recommendations,
+            }
+        )
+        return recommendations
+
+    @instance_cache
+    def userrecs_from_html(self) -> list[tuple[int, int]]:
+        return self.parse_userrecs_html(self.userrecs_html_file_path())
+
+    @instance_cache
     def partial_json_url(self) -> str:
         return f"v2/{self.MEDIA_TYPE}/{self.media_id}"
 
-    @cache
+    @instance_cache
     def json_url(self) -> str:
         return f"{self.API_DOMAIN}/{self.partial_json_url()}?fields={self.JSON_FIELDS}"
 
-    @cache
+    @instance_cache
     def json_file_is_valid(self) -> bool:
+        # Error responses are not written to the file so it will not exist if every download failed
+        if not self.json_file_path().exists():
+            return False
         # not_found is the only error message I have seen so just check for that
         return not self.json_file_path().parsed_json().get("error") == "not_found"
 
-    @cache
+    @instance_cache
     def json_file_path(self) -> ExtendedPath:
         return (DOWNLOADED_FILES_DIR / self.partial_json_url()).with_suffix(".json")
 
-    @cache
+    @instance_cache
     def userrecs_on_html(self) -> bool:
         return len(self.json_file_path().parsed_json()["recommendations"]) == 10
 
@@ -162,39 +227,105 @@ class MyAnimeListMedia:
         if self.db_object.information_oudated(minimum_timestamp):
             # Check if file needs downloading according to file information
             if self.json_file_path().outdated(minimum_timestamp):
-                print(f"Downloading: {self.json_url()}")
-                request = urllib.request.Request(self.json_url(), headers=self.HEADERS)
-                try:
-                    content = urllib.request.urlopen(request).read()
-                except HTTPError as error_msg:
-                    content = error_msg.read()
-                self.json_file_path().write(content)
-
-                time.sleep(1)  # No listed API limits but trying to keep myself safe
+                # Entries that recently returned an error are not downloaded again until the error expires
+                if self.negative_cache_entry():
+                    self.fetches_avoided += 1
+                    FETCHES_AVOIDED.inc()
+                else:
+                    status, content = download(self.json_url(), self.HEADERS)
+                    if status >= 400:
+                        self.record_download_error(status, content, self.json_file_path())
+                    else:
+                        self.json_file_path().write(content)
+
+                    time.sleep(1)  # No listed API limits but trying to keep myself safe
         # Check if the file needs downloading according to database information
         # self.db_object.sparse may be None or False
         if self.db_object.information_oudated(minimum_timestamp) or self.db_object.sparse:
             # Check if file needs downloading according to file information
             if (
                 not self.sparse_import
+                and self.json_file_is_valid()
                 and self.userrecs_on_html()
                 and self.userrecs_html_file_path().outdated(minimum_timestamp)
+                and not self.download_errors
+                and not self.negative_cache_entry()
             ):
-                print(f"Downloading: {self.userrecs_html_url()}")
-                request = urllib.request.Request(self.userrecs_html_url())
-                content = urllib.request.urlopen(request).read()
-                self.userrecs_html_file_path().write(content)
+                status, content = download(self.userrecs_html_url(), kind="html")
+                # Failed pages are handled the same way as failed API requests
+                if status >= 400:
+                    self.record_download_error(status, content, self.userrecs_html_file_path())
+                else:
+                    self.userrecs_html_file_path().write(content)
                 time.sleep(5)  # HTML scraping is sketchy so sleep for 5 seconds
 
+    def negative_cache_entry(self) -> Optional[NegativeCache]:
+        return NegativeCache.objects.filter(
+            type=self.MEDIA_TYPE, key=self.media_id, expires_at__gt=datetime.now().astimezone()
+        ).first()
+
+    def record_download_error(self, status: int, content: bytes, path: ExtendedPath) -> None:
+        """Stop downloading an entry until the error expires, path is the file that failed to download\n
+        The negative cache entry is saved by save_download_results"""
+        # The API returns errors as JSON, but other errors may be HTML pages
+        try:
+            reason = str(json.loads(content).get("error", f"HTTP {status}"))
+        except (ValueError, AttributeError):
+            reason = f"HTTP {status}"
+
+        expires_at = datetime.now().astimezone() + (self.NOT_FOUND_TTL if status == 404 else self.ERROR_TTL)
+        self.download_errors.append((status, reason[:255], expires_at))
+
+        # If the entry no longer exists the old file no longer matches MyAnimeList
+        if status == 404:
+            path.delete()
+
+    def save_download_results(self) -> None:
+        """Write the negative cache changes from downloading\n
+        The import pipeline downloads in another thread, keeping the writes for the apply stage means that thread never
+        waits on the apply stage's transaction"""
+        if self.fetches_avoided:
+            NegativeCache.objects.filter(type=self.MEDIA_TYPE, key=self.media_id).update(
+                fetches_avoided=F("fetches_avoided") + self.fetches_avoided
+            )
+            self.fetches_avoided = 0
+
+        for status, reason, expires_at in self.download_errors:
+            NegativeCache.objects.update_or_create(
+                type=self.MEDIA_TYPE,
+                key=self.media_id,
+                defaults={"status": status, "reason": reason, "expires_at": expires_at},
+            )
+        self.download_errors = []
+
     def get_oldest_file(self) -> ExtendedPath:
-        # These are all the files used for importing information
-        files = [self.json_file_path(), self.userrecs_html_file_path()]
+        # These are all the files used for importing information, an old userrecs.html that is not used anymore is left out
+        files = [self.json_file_path()]
+        if not self.sparse_import and self.userrecs_on_html():
+            files.append(self.userrecs_html_file_path())
 
-        # Remove files that do not exist from list
-        files = [file for file in files if file.exists()]
+        # Remove files that do not exist from list, each file is only looked up once
+        entries = {file: entry for file in files if (entry := file_inventory.lookup(file)) is not None}
 
         # Find the oldest file
-        return min(files, key=lambda file: file.aware_mtime())
+        return min(entries, key=lambda file: entries[file].mtime_ns)
+
+    @classmethod
+    def content_fingerprint(cls, raw_json: dict[str, Any], userrecs: Optional[list[tuple[int, int]]] = None) -> str:
+        """Hash the downloaded information without the volatile fields\n
+        The same information always gives the same hash no matter the order of the keys in the file"""
+        content = {key: value for key, value in raw_json.items() if key not in cls.VOLATILE_FIELDS}
+        if userrecs is not None:
+            content["userrecs"] = userrecs
+        canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def downloaded_fingerprint(self) -> str:
+        """Fingerprint of the downloaded files using the same information an import with these settings would use"""
+        userrecs = None
+        if not self.sparse_import and self.userrecs_on_html():
+            userrecs = self.userrecs_from_html()
+        return self.content_fingerprint(self.json_file_path().parsed_json(), userrecs)
 
     @transaction.atomic
     def update(
@@ -208,74 +339,125 @@ class MyAnimeListMedia:
         ):
             # Only attempt to import information on valid JSON files
             if self.json_file_is_valid():
-                # Add timestamps first for easier comparisons later on
-                self.db_object.add_timestamps(self.get_oldest_file())
-
-                self.simple_import()
-                self.db_object.sparse = self.sparse_import
+                with STAGE_SECONDS.time(stage="apply"):
+                    fingerprint = self.downloaded_fingerprint()
+                    # If nothing changed only the timestamps need to be updated
+                    if (
+                        self.db_object.content_fingerprint == fingerprint
+                        and self.db_object.sparse == self.sparse_import
+                    ):
+                        self.mark_unchanged()
+                        return
+
+                    # Add timestamps first for easier comparisons later on
+                    self.db_object.add_timestamps(self.get_oldest_file())
+
+                    self.simple_import()
+                    self.db_object.sparse = self.sparse_import
+                    self.db_object.content_fingerprint = fingerprint
+                    self.db_object.unchanged_fetches = 0
+
+                    # Save information now so all of the child information has a foriegn key
+                    self.db_object.save()
+
+    def mark_unchanged(self) -> None:
+        """Update an entry whose downloaded information did not change without importing anything\n
+        Only the timestamps and the fields left out of the fingerprint are written"""
+        # The same timestamps as a full import so both ways of updating schedule the next update the same way
+        self.db_object.add_timestamps(self.get_oldest_file())
+        self.db_object.unchanged_fetches += 1
+        volatile = self.volatile_values(self.json_file_parsed())
+        for field, value in volatile.items():
+            setattr(self.db_object, field, value)
+        self.MODEL.objects.filter(id=self.media_id).update(
+            info_timestamp=self.db_object.info_timestamp,
+            info_modified_timestamp=self.db_object.info_modified_timestamp,
+            unchanged_fetches=F("unchanged_fetches") + 1,
+            **volatile,
+        )
 
-                # Save information now so all of the child information has a foriegn key
-                self.db_object.add_timestamps_and_save(self.json_file_path())
+    def volatile_values(self, json: AnimeDataClass | MangaDataClass) -> dict[str, Any]:
+        """Database values of the VOLATILE_FIELDS, these are kept up to date even when the fingerprint matches"""
+        values: dict[str, Any] = {
+            "mean": json.mean,
+            "rank": json.rank,
+            "popularity": json.popularity,
+            "num_list_users": json.num_list_users,
+            "num_scoring_users": json.num_scoring_users,
+        }
+        if isinstance(json, AnimeDataClass):
+            values.update(
+                statistics_status_watching=json.statistics.status.watching,
+                statistics_status_completed=json.statistics.status.completed,
+                statistics_status_on_hold=json.statistics.status.on_hold,
+                statistics_status_dropped=json.statistics.status.dropped,
+                statistics_status_plan_to_watch=json.statistics.status.plan_to_watch,
+                statistics_num_list_users=json.statistics.num_list_users,
+            )
+        return values
 
     def date_within(self, date: Optional[datetime], delta: timedelta) -> bool:
         if date is None:
             return False
         return date + delta > datetime.now()
 
-    def add_to_import_quees(self) -> None:
-        note = "Yearly update"
-        # Using the media_id as the seed randomly pick a datetime that will be specifically used for this anime to update information
-        random.seed(self.media_id)
-        offset = random.randrange(31_536_000)  # There are 31,536,00 seconds in a year
-
+    def update_frequency(self) -> tuple[int, str]:
+        """Get the number of days between updates for this entry and a note explaining why"""
         # If there is no airing date do a best guess based on other information
         if self.db_object.start_date is None:
             # If the information was changed on the website within the last 6 months update it on a monthly schedule
             if (self.db_object.updated_at + timedelta(days=180)) > self.db_object.info_timestamp:
-                update_frequency = 30
-                note = "Monthly update, unknown start date"
+                return 30, "Monthly update, unknown start date"
             # If the information hasn't changed in the last 6 months just go back to yearly
             else:
-                update_frequency = 365
-                note = "Yearly update, unknown start date"
+                return 365, "Yearly update, unknown start date"
         # If there is an airing date use that to determine the update frequency
         else:
             # If the date was before 1971 only update it yearly
             # This is done to make sure every datetime created is valid because dates before 1970 are invalid
             if self.db_object.start_date < date(1971, 1, 1):
-                update_frequency = 365
-                note = "Yearly update, unknown start date"
+                return 365, "Yearly update, unknown start date"
             else:
                 start_as_datetime = datetime.combine(self.db_object.start_date, datetime.min.time()).astimezone()
                 # If the show started airing within the lasy 6 months update the value monthly
                 if start_as_datetime + timedelta(days=180) > self.db_object.info_timestamp:
-                    update_frequency = 30
-                    note = "Monthly update, recently aired"
+                    return 30, "Monthly update, recently aired"
                 # All other shows update once per year
                 else:
-                    update_frequency = 365
-                    note = "Yearly update, not recently aired"
-
-        # Grab the first date of the year from a year ago
-        update_date = datetime(datetime.now().year - 1, 1, 1).astimezone()
-
-        # Apply the offset
-        update_date += timedelta(seconds=offset)
+                    return 365, "Yearly update, not recently aired"
+
+    def adaptive_update_frequency(self, update_frequency: int) -> float:
+        """Stretch the normal update frequency for every download in a row that did not change anything\n
+        Any change resets unchanged_fetches so the entry goes straight back to the normal update frequency"""
+        days = update_frequency * self.REFRESH_GROWTH**self.db_object.unchanged_fetches
+        return min(max(days, self.REFRESH_MIN_DAYS), self.REFRESH_MAX_DAYS)
+
+    def import_que_entry(self) -> Optional[ImportQue]:
+        """Get an unsaved import queue entry for the next scheduled update of this entry"""
+        # Sparse entries are not updated on a schedule and entries that were never imported can't be scheduled
+        if self.sparse_import or self.db_object.info_timestamp is None:
+            return None
 
-        # Increment date until it is after the current file's timestamp
-        while update_date < self.db_object.info_timestamp:
-            update_date += timedelta(days=update_frequency)
+        update_frequency, note = self.update_frequency()
+        earliest = self.db_object.info_timestamp
+        if self.db_object.unchanged_fetches:
+            days = self.adaptive_update_frequency(update_frequency)
+            # Stay on the normal schedule so updates remain spread out, but use the scheduled update closest to the
+            # stretched update time
+            earliest += timedelta(days=max(days - update_frequency / 2, 0))
+            note = f"{note}, unchanged {self.db_object.unchanged_fetches} times"
+
+        return ImportQue(
+            type=self.MEDIA_TYPE,
+            key=self.media_id,
+            minimum_info_timestamp=next_due(self.media_id, earliest, update_frequency),
+            minimum_modified_timestamp=None,  # Information was just imported, this value was used
+            note=note,
+        )
 
-        if not self.sparse_import:
-            ImportQue.objects.update_or_create(
-                type=self.MEDIA_TYPE,
-                key=self.media_id,
-                defaults={
-                    "minimum_info_timestamp": update_date,
-                    "minimum_modified_timestamp": None,  # Information was just imported, this value was used
-                    "note": note,
-                },
-            )
+    def add_to_import_quees(self) -> None:
+        if entry := self.import_que_entry():
+            bulk_upsert([entry])
 
     def parse_date(self, date_string: Optional[str]) -> Optional[date]:
         if date_string is None:
@@ -296,7 +478,28 @@ class MyAnimeListMedia:
 
     def simple_import(self) -> None:
         json = self.json_file_parsed()
+        self.assign_fields(json)
+
+        if json.alternative_titles:
+            self.import_alternative_titles_synonyms(json.alternative_titles)
+        self.import_genres(json.genres)
+        self.import_pictures(json.pictures)
+
+        if not self.sparse_import:
+            self.import_recommendations(json.recommendations)
+
+        if isinstance(json, AnimeDataClass):
+            self.import_studios(json.studios)
+            if not self.sparse_import:
+                self.update_relationships("anime", AnimeRelatedAnime, json.related_anime)
+        elif isinstance(json, MangaDataClass):
+            # TODO: json.authors
+            if not self.sparse_import:
+                self.update_relationships("manga", MangaRelatedManga, json.related_manga)
+            # TODO: json.serialization
 
+    def assign_fields(self, json: AnimeDataClass | MangaDataClass) -> None:
+        """Copy the values from the JSON file onto the database object without touching the database"""
         # I could hand wave all this away with setattr and getattr
         # Doing it this way garuntees more type safety
         self.db_object.id = json.id_
@@ -304,8 +507,6 @@ class MyAnimeListMedia:
         if json.main_picture:
             self.db_object.main_picture_medium = self.image_cleaner(json.main_picture.medium)
             self.db_object.main_picture_large = self.image_cleaner(json.main_picture.large)
-        if json.alternative_titles:
-            self.import_alternative_titles_synonyms(json.alternative_titles)
 
         self.db_object.start_date = self.parse_date(json.start_date)
         self.db_object.end_date = self.parse_date(json.end_date)
@@ -316,17 +517,12 @@ class MyAnimeListMedia:
         self.db_object.num_list_users = json.num_list_users
         self.db_object.num_scoring_users = json.num_scoring_users
         self.db_object.nsfw = json.nsfw
-        self.import_genres(json.genres)
         self.db_object.created_at = json.created_at
         self.db_object.updated_at = json.updated_at
         self.db_object.media_type = json.media_type
         self.db_object.status = json.status
-        self.import_pictures(json.pictures)
         self.db_object.background = json.background
 
-        if not self.sparse_import:
-            self.import_recommendations(json.recommendations)
-
         if isinstance(self.db_object, Anime) and isinstance(json, AnimeDataClass):
             self.db_object.num_episodes = json.num_episodes
             if json.start_season:
@@ -338,7 +534,6 @@ class MyAnimeListMedia:
             self.db_object.source = json.source
             self.db_object.average_episode_duration = json.average_episode_duration
             self.db_object.rating = json.rating
-            self.import_studios(json.studios)
 
             self.db_object.statistics_status_watching = json.statistics.status.watching
             self.db_object.statistics_status_completed = json.statistics.status.completed
@@ -346,16 +541,9 @@ class MyAnimeListMedia:
             self.db_object.statistics_status_dropped = json.statistics.status.dropped
             self.db_object.statistics_status_plan_to_watch = json.statistics.status.plan_to_watch
             self.db_object.statistics_num_list_users = json.statistics.num_list_users
-
-            if not self.sparse_import:
-                self.update_relationships("anime", AnimeRelatedAnime, json.related_anime)
         elif isinstance(self.db_object, Manga) and isinstance(json, MangaDataClass):
             self.db_object.num_volumes = json.num_volumes
             self.db_object.num_chapters = json.num_chapters
-            # TODO: json.authors
-            if not self.sparse_import:
-                self.update_relationships("manga", MangaRelatedManga, json.related_manga)
-            # TODO: json.serialization
 
     def image_cleaner(self, url: IMAGE_TYPEVAR) -> IMAGE_TYPEVAR:
         if isinstance(url, str):
@@ -424,23 +612,13 @@ class MyAnimeListMedia:
             related_media = MyAnimeListMedia.from_simple(
                 media_type=type, media_id=related_entry.node.id_, sparse_import=True
             )
-            related_media.import_info()
+            with STAGE_SECONDS.time(stage="sparse_import"):
+                related_media.import_info()
+            # Entries that returned an error do not have anything to link to
+            if related_media.negative_cache_entry():
+                continue
 
-            # If the information is fully updated, but the information on this page is newer
-            if (
-                related_media.db_object.sparse == False
-                and related_media.db_object.info_timestamp
-                and related_media.db_object.info_timestamp < self.db_object.info_timestamp
-            ):
-                # Check if this reference is on the other page
-                if not model.objects.filter(media=related_media.db_object, related_media=self.db_object).exists():
-                    # Some entries on MAL only show relationships in one direction for some reason
-                    # Backdate the import queue by one hour to avoid forever downloading 2 pages
-                    # Technically this can cause missing information but the likelyhood is very low
-                    ImportQue.objects.filter(key=related_media.db_object.id, type=self.MEDIA_TYPE).update(
-                        minimum_info_timestamp=self.db_object.info_timestamp - timedelta(hours=1),
-                        note=f"Relationships: {self.db_object}",
-                    )
+            # Relationships that only exist in one direction are found by the reconcile_media command
 
             # Import the relationship
             relationships_to_import.append(
@@ -456,15 +634,13 @@ class MyAnimeListMedia:
         bulk: list[AnimeRecs | MangaRecs] = []
 
         if self.userrecs_on_html():
-            parsed_html = self.userrecs_html_file_path().parsed_html()
-            for related in parsed_html.select("div[class='picSurround']"):
+            for media_id, rec_count in self.userrecs_from_html():
                 # Sparsely import recommended entries
-                url = related.strict_select_one("a").attrs["href"]
-                recommended_media = MyAnimeListMedia.from_url(url, sparse_import=True)
-                recommended_media.import_info()
-
-                parent = related.strict_parent().strict_parent()
-                rec_count = len(parent.strict_select("div[class='spaceit_pad detail-user-recs-text']"))
+                recommended_media = MyAnimeListMedia.from_simple(self.MEDIA_TYPE, media_id, sparse_import=True)
+                with STAGE_SECONDS.time(stage="sparse_import"):
+                    recommended_media.import_info()
+                if recommended_media.negative_cache_entry():
+                    continue
 
                 bulk += self.compile_rec_info(recommended_media, rec_count)
 
@@ -473,7 +649,10 @@ class MyAnimeListMedia:
                 # Sparsely import recommended entries
                 # Just ignore the type because I am passing a dictinary straight from the json file
                 recommended_media = MyAnimeListMedia.from_simple(self.MEDIA_TYPE, rec.node.id_, sparse_import=True)
-                recommended_media.import_info()
+                with STAGE_SECONDS.time(stage="sparse_import"):
+                    recommended_media.import_info()
+                if recommended_media.negative_cache_entry():
+                    continue
 
                 # Just ignore the type because I am passing a dictinary straight from the json file
                 bulk += self.compile_rec_info(recommended_media, rec.num_recommendations)
@@ -481,54 +660,118 @@ class MyAnimeListMedia:
         self.REC_MODEL.objects.bulk_create(bulk, ignore_conflicts=True)  # type: ignore - This is type safe
 
     def compile_rec_info(self, rec: MyAnimeListMedia, recommendations: int) -> list[AnimeRecs | MangaRecs]:
-        bulk: list[AnimeRecs | MangaRecs] = []
-        bulk.append(
-            self.REC_MODEL(media=self.db_object, recommended_media=rec.db_object, recommendations=recommendations)
-        )
+        # Recommendation counts that do not match on both entries are found by the reconcile_media command
+        return [self.REC_MODEL(media=self.db_object, recommended_media=rec.db_object, recommendations=recommendations)]
 
-        # If the information is fully updated, but the information on this page is newer
-        if rec.db_object.sparse == False and rec.db_object.info_timestamp < self.db_object.info_timestamp:
-            # If the data does not match update the other value
-            if not self.REC_MODEL.objects.filter(
-                media=rec.db_object, recommended_media=self.db_object, recommendations=recommendations
-            ).exists():
-
-                # This information probably does not need to be backdated one hour because it seems like it is always in sync
-                # Just in case though, backdate it one hour to match the strategy used for relationships
-                ImportQue.objects.filter(key=rec.db_object.id, type=self.MEDIA_TYPE).update(
-                    minimum_info_timestamp=self.db_object.info_timestamp - timedelta(hours=1),
-                    note=f"Recommendations: {self.db_object}",
-                )
+    def needs_import(
+        self,
+        minimum_info_timestamp: Optional[datetime] = None,
+        minimum_modified_timestamp: Optional[datetime] = None,
+    ) -> bool:
+        # If the value is outdated it needs to be updated
+        if self.db_object.information_oudated(minimum_info_timestamp, minimum_modified_timestamp):
+            return True
+        # If a full import is being run on a sparse entry do it needs to be updated
+        return not self.sparse_import and bool(self.db_object.sparse)
+
+    def dependent_medias(self) -> list[MyAnimeListMedia]:
+        """Get sparse versions of every entry that importing this entry will also import"""
+        # Sparse imports do not import recommendations or relationships
+        if self.sparse_import or not self.json_file_is_valid():
+            return []
+
+        json = self.json_file_parsed()
+        if self.userrecs_on_html():
+            recommended_ids = [media_id for media_id, _ in self.userrecs_from_html()]
+        else:
+            recommended_ids = [rec.node.id_ for rec in json.recommendations]
+        dependents = [MyAnimeListMedia.from_simple(self.MEDIA_TYPE, x, sparse_import=True) for x in recommended_ids]
+
+        if isinstance(json, AnimeDataClass):
+            dependents += [MyAnimeListMedia.from_simple("anime", x.node.id_, True) for x in json.related_anime]
+        elif isinstance(json, MangaDataClass):
+            dependents += [MyAnimeListMedia.from_simple("manga", x.node.id_, True) for x in json.related_manga]
 
-        return bulk
+        return dependents
+
+    def prefetch(self, minimum_info_timestamp: Optional[datetime] = None) -> list[MyAnimeListMedia]:
+        """Download every file needed to import this entry, including the files for the sparse entries it imports\n
+        After this has been run update can be run without touching the network"""
+        self.full_download(minimum_info_timestamp)
+
+        dependents = self.dependent_medias()
+        for dependent in dependents:
+            if dependent.needs_import():
+                dependent.full_download()
+        return dependents
 
     def import_info(
         self,
         minimum_info_timestamp: Optional[datetime] = None,
         minimum_modified_timestamp: Optional[datetime] = None,
     ) -> None:
-        # If the value is outdated it needs to be updated
-        if self.db_object.information_oudated(minimum_info_timestamp, minimum_modified_timestamp):
+        if self.needs_import(minimum_info_timestamp, minimum_modified_timestamp):
             self.full_download(minimum_info_timestamp)
-            self.update(minimum_info_timestamp, minimum_modified_timestamp)
-        # If a full import is being run on a sparse entry do it needs to be updated
-        elif not self.sparse_import and self.db_object.sparse:
-            self.full_download(minimum_info_timestamp)
-            self.update(minimum_info_timestamp, minimum_modified_timestamp)
-        self.add_to_import_quees()
+        self.apply(minimum_info_timestamp, minimum_modified_timestamp)
+
+    def retry_after_error(self, negative_cache: NegativeCache) -> None:
+        """Move the entry's queue row to when the error expires so it is tried again\n
+        Entries that were never imported and do not exist on MyAnimeList are taken out of the queue instead"""
+        # Sparse entries are imported again by whatever depends on them, the queue always does full imports
+        if self.sparse_import:
+            return
+
+        if self.db_object.info_timestamp is None and negative_cache.status == 404:
+            ImportQue.objects.filter(type=self.MEDIA_TYPE, key=self.media_id).delete()
+            return
+
+        # Nobody is waiting on the entry anymore so it goes back to the background lane
+        ImportQue.objects.update_or_create(
+            type=self.MEDIA_TYPE,
+            key=self.media_id,
+            defaults={
+                "minimum_info_timestamp": negative_cache.expires_at,
+                "minimum_modified_timestamp": None,
+                "note": f"Retry after error: {negative_cache.status} {negative_cache.reason}"[:255],
+                "lane": ImportQue.LANE_BACKGROUND,
+            },
+        )
+
+    def apply(
+        self,
+        minimum_info_timestamp: Optional[datetime] = None,
+        minimum_modified_timestamp: Optional[datetime] = None,
+        schedule: bool = True,
+    ) -> None:
+        """Update the database from the downloaded files and schedule the next update\n
+        schedule can be set to False when the caller schedules the updates for many entries at once"""
+        self.save_download_results()
+        # Entries that returned an error are not imported until the error expires
+        if negative_cache := self.negative_cache_entry():
+            self.retry_after_error(negative_cache)
+            return
+
+        self.update(minimum_info_timestamp, minimum_modified_timestamp)
+        if schedule:
+            self.add_to_import_quees()
 
 
 class MyAnimeListAnime(MyAnimeListMedia):
-    def __init__(self, media_id: int, sparse_import: bool):
+    def __init__(self, media_id: int, sparse_import: bool, db_object: Optional[Anime] = None):
         self.media_id = media_id
-        self.db_object = Anime().get_or_new(id=self.media_id)[0]
+        # The database object can be passed in when it has already been loaded or is being built in bulk
+        self.db_object = db_object if db_object is not None else Anime().get_or_new(id=self.media_id)[0]
         self.sparse_import = sparse_import
+        self.download_errors = []
+        self.fetches_avoided = 0
 
-    @cache  # type: ignore
+    @instance_cache  # type: ignore
     def json_file_parsed(self) -> AnimeDataClass:
-        return AnimeDataClass(**self.json_file_path().parsed_json())
+        with STAGE_SECONDS.time(stage="parse"):
+            return AnimeDataClass(**self.json_file_path().parsed_json())
 
     FIELDS = [f.name for f in Anime._meta.get_fields()]
+    MODEL = Anime
     JSON_FIELDS = "id,title,main_picture,alternative_titles,start_date,end_date,synopsis,mean,rank,popularity,num_list_users,num_scoring_users,nsfw,created_at,updated_at,media_type,status,genres,my_list_status,num_episodes,start_season,broadcast,source,average_episode_duration,rating,pictures,background,related_anime,related_manga,recommendations,studios,statistics"
     RELATED_ANIME_MODEL = AnimeRelatedAnime
     RELATED_MANGA_MODEL = AnimeRelatedManga
@@ -541,16 +784,21 @@ class MyAnimeListAnime(MyAnimeListMedia):
 
 
 class MyAnimeListManga(MyAnimeListMedia):
-    def __init__(self, media_id: int, sparse_import: bool):
+    def __init__(self, media_id: int, sparse_import: bool, db_object: Optional[Manga] = None):
         self.media_id = media_id
-        self.db_object = Manga().get_or_new(id=self.media_id)[0]
+        # The database object can be passed in when it has already been loaded or is being built in bulk
+        self.db_object = db_object if db_object is not None else Manga().get_or_new(id=self.media_id)[0]
         self.sparse_import = sparse_import
+        self.download_errors = []
+        self.fetches_avoided = 0
 
-    @cache  # type: ignore - Caching abstract functions causes issues
+    @instance_cache  # type: ignore - Caching abstract functions causes issues
     def json_file_parsed(self) -> MangaDataClass:
-        return MangaDataClass(**self.json_file_path().parsed_json())
+        with STAGE_SECONDS.time(stage="parse"):
+            return MangaDataClass(**self.json_file_path().parsed_json())
 
     FIELDS = [f.name for f in Manga._meta.get_fields()]
+    MODEL = Manga
     JSON_FIELDS = "id,title,main_picture,alternative_titles,start_date,end_date,synopsis,mean,rank,popularity,num_list_users,num_scoring_users,nsfw,created_at,updated_at,media_type,status,genres,my_list_status,num_volumes,num_chapters,authors{first_name,last_name},pictures,background,related_anime,related_manga,recommendations,serialization{name}"
     RELATED_ANIME_MODEL = MangaRelatedAnime
     RELATED_MANGA_MODEL = MangaRelatedManga
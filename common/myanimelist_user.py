@@ -3,28 +3,65 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from typing import Callable, Literal, Optional, Type, TypeVar
+    from typing import Any, Callable, Iterator, Literal, Optional, Type, TypeVar
 
     MEDIA_TYPES = Literal["anime", "manga"]
     USER_MEDIA_TYPES = TypeVar("USER_MEDIA_TYPES", "UserManga", "UserAnime")
 
-import urllib.request
-from datetime import datetime
-from functools import cache
-from urllib.error import HTTPError
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 
 from django.db import transaction
+from django.db.models import Avg, Count, F, Q
 
 import common.configure_django  # type: ignore # noqa: F401 - Modified global values
-from common.constants import DOWNLOADED_FILES_DIR
+from common.constants import DOWNLOADED_FILES_DIR, FILE_INVENTORY, MAL_API_DOMAIN
 from common.extended_path import ExtendedPath
+from common.instance_cache import instance_cache
+from common.metrics import STAGE_SECONDS
 from config.config import MyAnimeListSecrets
-from main.models import Anime, ImportQue, Manga, User, UserAnime, UserManga
+from main.models import (
+    Anime,
+    ImportQue,
+    Manga,
+    NegativeCache,
+    User,
+    UserAnime,
+    UserManga,
+)
+
+
+@dataclass
+class UserListColumns:
+    """Every entry on a user's list with each value stored in its own array\n
+    Keeping the values in columns means statistics can be computed without looping over every entry in Python"""
+
+    media_ids: array[int] = field(default_factory=lambda: array("I"))
+    statuses: array[int] = field(default_factory=lambda: array("B"))
+    scores: array[int] = field(default_factory=lambda: array("B"))
+    # Episodes watched for anime and chapters read for manga
+    progress: array[int] = field(default_factory=lambda: array("I"))
+    list_statuses: list[dict[str, Any]] = field(default_factory=list)
+    # Number of entries that could not be saved because the anime or manga has not been imported yet
+    unsaved_entries: int = 0
+    # Number of saved rows that were inserted, updated, or deleted when this list was imported
+    changed_rows: int = 0
+
+    def __len__(self) -> int:
+        return len(self.media_ids)
+
+    def average_score(self) -> Optional[float]:
+        """Average of the scored entries, entries with a score of 0 have not been scored"""
+        scored = len(self.scores) - self.scores.count(0)
+        return sum(self.scores) / scored if scored else None
 
 
 class MyAnimeListUser:
     DOMAIN = "https://myanimelist.net"
-    API_DOMAIN = "https://api.myanimelist.net"
+    API_DOMAIN = MAL_API_DOMAIN
     HEADERS = {"X-MAL-CLIENT-ID": MyAnimeListSecrets.CLIENT_ID}
     STATUS_VALUES = {
         "reading": 1,
@@ -35,6 +72,10 @@ class MyAnimeListUser:
         "plan_to_read": 5,
         "plan_to_watch": 5,
     }
+    # Number of list pages that are downloaded at the same time, this is kept low to stay within the rate limit
+    LIST_PAGE_CONCURRENCY = 4
+    # Incremental imports can't see entries that were removed from a list so do a full import this often
+    FULL_IMPORT_INTERVAL = timedelta(days=7)
 
     def __init__(self, identifier: Optional[str]):
         if isinstance(identifier, str):
@@ -43,34 +84,34 @@ class MyAnimeListUser:
         get_or_new_model = User().get_or_new(name=self.username)
         self.model_exists = not get_or_new_model[1]
         self.model = get_or_new_model[0]
-        self.anime_scores: list[int] = []
-        self.manga_scores: list[int] = []
+        # Number of list rows inserted, updated, or deleted by the last update, 0 means cached results are still valid
+        self.changed_rows = 0
 
-    @cache
+    @instance_cache
     def partial_anime_json_url(self, offset: int = 0) -> str:
         return f"v2/users/{self.username}/animelist?offset={offset}"
 
-    @cache
+    @instance_cache
     def partial_manga_json_url(self, offset: int = 0) -> str:
         return f"v2/users/{self.username}/mangalist?offset={offset}"
 
-    @cache
+    @instance_cache
     def anime_json_url(self, offset: int = 0) -> str:
         return f"{self.API_DOMAIN}/{self.partial_anime_json_url(offset)}&fields=list_status&limit=1000&nsfw=true"
 
-    @cache
+    @instance_cache
     def manga_json_url(self, offset: int = 0) -> str:
         return f"{self.API_DOMAIN}/{self.partial_manga_json_url(offset)}&fields=list_status&limit=1000&nsfw=true"
 
-    @cache
+    @instance_cache
     def manga_json_path(self, offset: int = 0) -> ExtendedPath:
         return (DOWNLOADED_FILES_DIR / self.partial_manga_json_url(offset).replace("?", "-")).with_suffix(".json")
 
-    @cache
+    @instance_cache
     def anime_json_path(self, offset: int = 0) -> ExtendedPath:
         return (DOWNLOADED_FILES_DIR / self.partial_anime_json_url(offset).replace("?", "-")).with_suffix(".json")
 
-    @cache
+    @instance_cache
     def lazy_json_path(self, type: MEDIA_TYPES, offset: int = 0) -> ExtendedPath:
         if type == "anime":
             return (DOWNLOADED_FILES_DIR / self.partial_anime_json_url(offset).replace("?", "-")).with_suffix(".json")
@@ -78,30 +119,62 @@ class MyAnimeListUser:
             return (DOWNLOADED_FILES_DIR / self.partial_manga_json_url(offset).replace("?", "-")).with_suffix(".json")
 
     def download_all(self, minimum_timestamp: Optional[datetime] = None) -> None:
-        self.download_list(self.anime_json_path, self.anime_json_url, 0, minimum_timestamp)
-        self.download_list(self.manga_json_path, self.manga_json_url, 0, minimum_timestamp)
+        self.download_list(self.anime_json_path, self.anime_json_url, minimum_timestamp)
+        self.download_list(self.manga_json_path, self.manga_json_url, minimum_timestamp)
 
     def download_list(
         self,
         path: Callable[[int], ExtendedPath],
         url: Callable[[int], str],
-        offset: int = 0,
         minimum_timestamp: Optional[datetime] = None,
     ) -> None:
-        if path(offset).outdated(minimum_timestamp):
-            print(f"Downloading: {url(offset)}")
-            request = urllib.request.Request(url(offset), headers=self.HEADERS)
-            try:
-                content = urllib.request.urlopen(request).read()
-            except HTTPError as error_msg:
-                content = error_msg.read()
+        """Download every page of a list\n
+        Once the first page shows there are more pages the following pages are downloaded at the same time"""
+        last_offset = 0
+        if self.download_page(path, url, 0, minimum_timestamp):
+            with ThreadPoolExecutor(max_workers=self.LIST_PAGE_CONCURRENCY) as executor:
+                pending: deque[tuple[int, Future[bool]]] = deque()
+                next_offset = 1000
+                while True:
+                    # Keep a few pages downloading ahead of the page that is being checked
+                    while len(pending) < self.LIST_PAGE_CONCURRENCY:
+                        future = executor.submit(self.download_page, path, url, next_offset, minimum_timestamp)
+                        pending.append((next_offset, future))
+                        next_offset += 1000
+
+                    last_offset, future = pending.popleft()
+                    if not future.result():
+                        break
+
+                # Pages after the last page may have been downloaded ahead of time, these are deleted below
+                for _, future in pending:
+                    future.cancel()
+
+        # Remove pages after the last page, they are either empty or left over from when the list was longer
+        offset = last_offset + 1000
+        while path(offset).exists():
+            path(offset).delete()
+            offset += 1000
+
+    def download_page(
+        self,
+        path: Callable[[int], ExtendedPath],
+        url: Callable[[int], str],
+        offset: int,
+        minimum_timestamp: Optional[datetime] = None,
+    ) -> bool:
+        """Download a single page of a list if it is outdated and check if there is another page after it"""
+        # Imported here so web processes that never download do not import urllib
+        from common.downloader import download
 
+        downloaded = False
+        if path(offset).outdated(minimum_timestamp):
+            content = download(url(offset), self.HEADERS, kind="user_list")[1]
             path(offset).write(content)
+            downloaded = True
             # No sleep here because I want users to be able to get instant results as fast as possible
 
-        # Recursively download every page
-        if path(offset).parsed_json().get("paging", {}).get("next"):
-            self.download_list(path, url, offset + 1000, minimum_timestamp)
+        return bool(path(offset).parsed_json(update=downloaded).get("paging", {}).get("next"))
 
     # Make this a transaction to avoid partially imported lists
     @transaction.atomic
@@ -109,113 +182,328 @@ class MyAnimeListUser:
         self, minimum_info_timestamp: Optional[datetime] = None, minimum_modified_timestamp: Optional[datetime] = None
     ) -> None:
         if self.model.information_oudated(minimum_info_timestamp, minimum_modified_timestamp):
-            # By default assume lists are private for simplicity
-            self.model.anime_list_private = True
-            self.model.manga_list_private = True
-            self.model.add_timestamps_and_save(self.anime_json_path())
-
-            # If there are no errors downloading the anime list use the information
-            if not self.anime_json_path().parsed_json().get("error"):
-                UserAnime.objects.filter(user=self.model).delete()
-                self.update_single_user_list("anime", UserAnime)
-
-                self.model.anime_list_private = False
-                self.model.anime_count = len(self.anime_scores)
-                scored_anime = len([x for x in self.anime_scores if x])
-                if scored_anime:
-                    self.model.average_anime_score = sum(self.anime_scores) / scored_anime
-                self.model.last_successful_anime_list_import = self.anime_json_path().aware_mtime()
-
-            # If there are no errors downloading the manga list use the information
-            if not self.manga_json_path().parsed_json().get("error"):
-                UserManga.objects.filter(user=self.model).delete()
-                self.update_single_user_list("manga", UserManga)
-
-                self.model.manga_list_private = False
-                self.model.manga_count = len(self.manga_scores)
-                scored_manga = len([x for x in self.manga_scores if x])
-                if scored_manga:
-                    self.model.average_manga_score = sum(self.manga_scores) / scored_manga
-                self.model.last_successful_manga_list_import = self.manga_json_path().aware_mtime()
-
-            # TODO: Get timestamp from paginated and manga and find a timestmap between them
-            self.model.add_timestamps_and_save(self.anime_json_path())
-
-    def json_media_ids(self, type: MEDIA_TYPES, media_ids: list[int], offset: int = 0) -> list[int]:
-        parsed_json = self.lazy_json_path(type, offset).parsed_json()
-        for media in parsed_json.get("data", []):
-            media_ids.append(media["node"]["id"])
-
-        # Recursively scrape every page
-        if parsed_json.get("paging", {}).get("next"):
-            self.json_media_ids(type, media_ids, offset + 1000)
-        return media_ids
-
-    @cache
-    def existing_medias(self, type: MEDIA_TYPES, sparse: bool):
-        # Use one query to get all the anime/manga
-        media_ids = self.json_media_ids(type, [])
-        if type == "anime":
-            return Anime.objects.filter(id__in=media_ids, sparse=sparse).values_list("id", flat=True)
-        else:
-            return Manga.objects.filter(id__in=media_ids, sparse=sparse).values_list("id", flat=True)
-
-    def update_single_user_list(self, type: MEDIA_TYPES, the_class2: Type[USER_MEDIA_TYPES]) -> None:
+            with STAGE_SECONDS.time(stage="apply"):
+                # By default assume lists are private for simplicity
+                self.model.anime_list_private = True
+                self.model.manga_list_private = True
+                self.changed_rows = 0
+                self.model.add_timestamps_and_save(self.anime_json_path())
+
+                # If there are no errors downloading the anime list use the information
+                if not self.anime_json_path().parsed_json().get("error"):
+                    anime_list = self.update_single_user_list("anime", UserAnime)
+
+                    self.changed_rows += anime_list.changed_rows
+                    self.model.anime_list_private = False
+                    self.model.anime_count = len(anime_list)
+                    if (average_score := anime_list.average_score()) is not None:
+                        self.model.average_anime_score = average_score
+                    self.model.last_successful_anime_list_import = self.anime_json_path().aware_mtime()
+                    self.model.last_full_anime_list_import = self.model.last_successful_anime_list_import
+
+                # If there are no errors downloading the manga list use the information
+                if not self.manga_json_path().parsed_json().get("error"):
+                    manga_list = self.update_single_user_list("manga", UserManga)
+
+                    self.changed_rows += manga_list.changed_rows
+                    self.model.manga_list_private = False
+                    self.model.manga_count = len(manga_list)
+                    if (average_score := manga_list.average_score()) is not None:
+                        self.model.average_manga_score = average_score
+                    self.model.last_successful_manga_list_import = self.manga_json_path().aware_mtime()
+                    self.model.last_full_manga_list_import = self.model.last_successful_manga_list_import
+
+                # TODO: Get timestamp from paginated and manga and find a timestmap between them
+                self.model.add_timestamps_and_save(self.anime_json_path())
+
+    def list_pages(self, type: MEDIA_TYPES) -> Iterator[dict[str, Any]]:
+        """Parsed JSON for every downloaded page of a user's list"""
         offset = 0
-        json_path = self.lazy_json_path(type, offset)
+        while (json_path := self.lazy_json_path(type, offset)).exists():
+            parsed_json = json_path.parsed_json()
+            yield parsed_json
+            # Stop at the last page so old pages from a list that used to be longer are not used
+            if not parsed_json.get("paging", {}).get("next"):
+                break
+            offset += 1000
+
+    def read_user_list(self, type: MEDIA_TYPES) -> UserListColumns:
+        columns = UserListColumns()
+        for parsed_json in self.list_pages(type):
+            self.add_to_columns(columns, type, parsed_json.get("data", []))
+        return columns
+
+    def add_to_columns(self, columns: UserListColumns, type: MEDIA_TYPES, entries: list[dict[str, Any]]) -> None:
+        progress_key = "num_episodes_watched" if type == "anime" else "num_chapters_read"
+        for media in entries:
+            list_status = media["list_status"]
+            columns.media_ids.append(media["node"]["id"])
+            # Convert status to an integer so it takes up less space
+            columns.statuses.append(self.STATUS_VALUES[list_status["status"]])
+            columns.scores.append(list_status["score"])
+            columns.progress.append(list_status.get(progress_key) or 0)
+            columns.list_statuses.append(list_status)
+
+    def existing_medias(self, type: MEDIA_TYPES, media_ids: array[int]) -> tuple[set[int], set[int]]:
+        """Get the ids of the fully imported and sparse entries as sets so every lookup is O(1)"""
+        model = Anime if type == "anime" else Manga
+        full: set[int] = set()
+        sparse: set[int] = set()
+        unique_ids = list(set(media_ids))
+        # Query in chunks to stay under SQLite's limit on the number of variables in a query
+        for i in range(0, len(unique_ids), 900):
+            for media_id, is_sparse in model.objects.filter(id__in=unique_ids[i : i + 900]).values_list("id", "sparse"):
+                (sparse if is_sparse else full).add(media_id)
+        return full, sparse
+
+    def update_single_user_list(
+        self,
+        type: MEDIA_TYPES,
+        the_class2: Type[USER_MEDIA_TYPES],
+        columns: Optional[UserListColumns] = None,
+    ) -> UserListColumns:
+        """Save a user's list\n
+        When columns is given only those entries are merged into the saved list and nothing is removed"""
+        merge = columns is not None
+        columns = columns if columns is not None else self.read_user_list(type)
+        full, sparse = self.existing_medias(type, columns.media_ids)
+        progress_key = "num_episodes_watched" if type == "anime" else "num_chapters_read"
+        # Only copy values that are fields on the model, the API returns other values like start_date
+        fields = {x.name for x in the_class2._meta.concrete_fields} - {"id", "user", "media", "status", progress_key}
+        now = datetime.now().astimezone()
+
         bulk_media: list[USER_MEDIA_TYPES] = []
         bulk_que: list[ImportQue] = []
-
-        while json_path.exists():
-            parsed_json = json_path.parsed_json()
-            for media in parsed_json["data"]:
-                media_id = media["node"]["id"]
-
-                # Update the score counter
-                # This does some extra dynamic nonsense just so I don't have to check the media type
-                attribute_name = f"{type}_scores"
-
-                # The ugliest way you have every seen to append a list
-                getattr(self, attribute_name).append(media["list_status"]["score"])
-                setattr(self, attribute_name, getattr(self, attribute_name))
-
-                # If the media already exists in some way use that information
-                if media_id in self.existing_medias(type, False) or media_id in self.existing_medias(type, True):
-                    bulk_media.append(the_class2(user=self.model, media_id=media["node"]["id"]))
-
-                    # Save the user's list information
-                    for key, value in media["list_status"].items():
-                        # Convert status to an integer so it takes up less space
-                        if key == "status":
-                            setattr(bulk_media[-1], key, self.STATUS_VALUES[value])
-                        # Leave other values as they are
-                        else:
-                            setattr(bulk_media[-1], key, value)
-                # If the information for an entry on the user's list is not fully imported add it to the queue
-                if not media_id in self.existing_medias(type, False):
-                    bulk_que.append(
-                        ImportQue(
-                            type=type,
-                            key=media_id,
-                            minimum_modified_timestamp=datetime.now().astimezone(),
-                            note=f"User list: {self.model}",
-                        )
+        for media_id, status, progress, list_status in zip(
+            columns.media_ids, columns.statuses, columns.progress, columns.list_statuses
+        ):
+            # If the media already exists in some way use that information
+            if media_id in full or media_id in sparse:
+                values = {key: value for key, value in list_status.items() if key in fields}
+                bulk_media.append(
+                    the_class2(user=self.model, media_id=media_id, status=status, **{progress_key: progress}, **values)
+                )
+
+            # If the information for an entry on the user's list is not fully imported add it to the queue
+            if media_id not in full:
+                bulk_que.append(
+                    ImportQue(
+                        type=type,
+                        key=media_id,
+                        minimum_modified_timestamp=now,
+                        note=f"User list: {self.model}",
+                        lane=ImportQue.LANE_USER_MEDIA,
                     )
+                )
 
-            offset += 1000
-            json_path = self.lazy_json_path(type, offset)
+        columns.unsaved_entries = len(columns) - len(bulk_media)
+        columns.changed_rows = self.sync_rows(the_class2, bulk_media, remove_missing=not merge)
 
-        # TODO: Why does this create a type error?
-        the_class2.objects.bulk_create(bulk_media)  # type: ignore
+        # Entries that recently returned an error are not queued again until the error expires
+        negative_cache = NegativeCache.objects.filter(
+            type=type, key__in=[x.key for x in bulk_que], expires_at__gt=datetime.now().astimezone()
+        )
+        negative_keys = set(negative_cache.values_list("key", flat=True))
+        negative_cache.update(fetches_avoided=F("fetches_avoided") + 1)
+        bulk_que = [x for x in bulk_que if str(x.key) not in negative_keys]
 
         # Insert new values into the que
         ImportQue.objects.bulk_create(bulk_que, ignore_conflicts=True)
+        # Entries that were already queued as background updates are needed by this user now
+        keys = [str(x.key) for x in bulk_que]
+        for i in range(0, len(keys), 900):
+            ImportQue.objects.filter(type=type, key__in=keys[i : i + 900], lane__gt=ImportQue.LANE_USER_MEDIA).update(
+                lane=ImportQue.LANE_USER_MEDIA, minimum_modified_timestamp=now
+            )
+        return columns
+
+    def sync_rows(
+        self, the_class2: Type[USER_MEDIA_TYPES], rows: list[USER_MEDIA_TYPES], remove_missing: bool = True
+    ) -> int:
+        """Make the saved list match rows by only inserting, updating, and deleting the rows that changed\n
+        When remove_missing is False rows are only inserted and updated\n
+        Returns the number of rows that changed"""
+        compare_fields = [x for x in the_class2._meta.concrete_fields if x.name not in ("id", "user", "media")]
+        if remove_missing:
+            existing = {x.media_id: x for x in the_class2.objects.filter(user=self.model)}
+        else:
+            media_ids = [x.media_id for x in rows]  # type: ignore - media_id is added by the foreign key
+            existing = {}
+            for i in range(0, len(media_ids), 900):
+                chunk = the_class2.objects.filter(user=self.model, media_id__in=media_ids[i : i + 900])
+                existing.update({x.media_id: x for x in chunk})
+
+        to_create: list[USER_MEDIA_TYPES] = []
+        to_update: list[USER_MEDIA_TYPES] = []
+        for row in rows:
+            # Convert the values from the JSON file to the same types that are loaded from the database
+            for model_field in compare_fields:
+                setattr(row, model_field.attname, model_field.to_python(getattr(row, model_field.attname)))
+
+            old_row = existing.pop(row.media_id, None)  # type: ignore - media_id is added by the foreign key
+            if old_row is None:
+                to_create.append(row)
+            elif any(getattr(old_row, x.attname) != getattr(row, x.attname) for x in compare_fields):
+                row.id = old_row.id
+                to_update.append(row)
+
+        # Anything left was removed from the user's list
+        to_delete = [x.id for x in existing.values()] if remove_missing else []
+        for i in range(0, len(to_delete), 900):
+            the_class2.objects.filter(id__in=to_delete[i : i + 900]).delete()
+        # TODO: Why does this create a type error?
+        the_class2.objects.bulk_create(to_create)  # type: ignore
+        the_class2.objects.bulk_update(to_update, [x.name for x in compare_fields], batch_size=500)  # type: ignore
+
+        return len(to_create) + len(to_update) + len(to_delete)
+
+    @instance_cache
+    def partial_changes_json_url(self, type: MEDIA_TYPES, offset: int = 0) -> str:
+        return f"v2/users/{self.username}/{type}list?sort=list_updated_at&offset={offset}"
+
+    @instance_cache
+    def changes_json_url(self, type: MEDIA_TYPES, offset: int = 0) -> str:
+        return (
+            f"{self.API_DOMAIN}/{self.partial_changes_json_url(type, offset)}&fields=list_status&limit=1000&nsfw=true"
+        )
+
+    @instance_cache
+    def changes_json_path(self, type: MEDIA_TYPES, offset: int = 0) -> ExtendedPath:
+        partial_path = self.partial_changes_json_url(type, offset).replace("?", "-").replace("&", "-")
+        return (DOWNLOADED_FILES_DIR / partial_path).with_suffix(".json")
+
+    def incremental_import_possible(self) -> bool:
+        """Incremental imports need a recent full import of both lists to build on"""
+        cutoff = datetime.now().astimezone() - self.FULL_IMPORT_INTERVAL
+        for last_import, last_full_import in [
+            (self.model.last_successful_anime_list_import, self.model.last_full_anime_list_import),
+            (self.model.last_successful_manga_list_import, self.model.last_full_manga_list_import),
+        ]:
+            if last_import is None or last_full_import is None or last_full_import < cutoff:
+                return False
+        if not self.model_exists:
+            return False
+
+        # Entries whose media was not imported yet are only saved by a full import, incremental imports only see them
+        # again if the user changes them
+        for count, the_class2 in [(self.model.anime_count, UserAnime), (self.model.manga_count, UserManga)]:
+            if (count or 0) > the_class2.objects.filter(user=self.model).count():
+                return False
+        return True
+
+    def download_changes(self, type: MEDIA_TYPES, since: datetime) -> Optional[list[dict[str, Any]]]:
+        """Download the entries that were updated after since\n
+        The list is sorted by the last update so downloading stops at the first entry that is older than since\n
+        Returns None if the list could not be downloaded"""
+        from common.downloader import download
+
+        changes: list[dict[str, Any]] = []
+        offset = 0
+        while True:
+            content = download(self.changes_json_url(type, offset), self.HEADERS, kind="user_list")[1]
+            self.changes_json_path(type, offset).write(content)
+            parsed_json = self.changes_json_path(type, offset).parsed_json(update=True)
+            if parsed_json.get("error"):
+                return None
+
+            for media in parsed_json.get("data", []):
+                if datetime.fromisoformat(media["list_status"]["updated_at"]) <= since:
+                    return changes
+                changes.append(media)
+
+            if not parsed_json.get("paging", {}).get("next"):
+                return changes
+            offset += 1000
+
+    # Make this a transaction to avoid partially imported lists
+    @transaction.atomic
+    def merge_changes(self, started: datetime, changes: dict[MEDIA_TYPES, list[dict[str, Any]]]) -> None:
+        """Merge the changed entries into the saved lists and recompute the list statistics"""
+        with STAGE_SECONDS.time(stage="apply"):
+            self.changed_rows = 0
+            for type, the_class2 in [("anime", UserAnime), ("manga", UserManga)]:
+                columns = UserListColumns()
+                self.add_to_columns(columns, type, changes[type])
+                self.update_single_user_list(type, the_class2, columns)
+                self.changed_rows += columns.changed_rows
+
+                # Entries that could not be saved are downloaded again next time because the timestamp is not moved
+                if not columns.unsaved_entries:
+                    setattr(self.model, f"last_successful_{type}_list_import", started)
+
+                # Only the changed entries were downloaded so the statistics come from the saved list
+                statistics = the_class2.objects.filter(user=self.model).aggregate(
+                    count=Count("id"), average_score=Avg("score", filter=Q(score__gt=0))
+                )
+                # The count is the length of the list like a full import sets it, entries that could not be saved are
+                # included so render_recommendations still sees the missing media and queues the user again
+                # Incremental imports only run when every earlier entry was saved so these are all new entries
+                setattr(self.model, f"{type}_count", statistics["count"] + columns.unsaved_entries)
+                if statistics["average_score"] is not None:
+                    setattr(self.model, f"average_{type}_score", statistics["average_score"])
+
+            self.model.add_timestamps_and_save(started)
+
+    def incremental_import_all(
+        self, minimum_info_timestamp: Optional[datetime] = None, minimum_modified_timestamp: Optional[datetime] = None
+    ) -> bool:
+        """Import only the entries that changed since the last import\n
+        Returns False if the lists could not be downloaded and a full import is needed"""
+        if self.model.information_up_to_date(minimum_info_timestamp, minimum_modified_timestamp):
+            return True
+
+        started = datetime.now().astimezone()
+        changes: dict[MEDIA_TYPES, list[dict[str, Any]]] = {}
+        for type, since in [
+            ("anime", self.model.last_successful_anime_list_import),
+            ("manga", self.model.last_successful_manga_list_import),
+        ]:
+            downloaded = self.download_changes(type, since)  # type: ignore - checked by incremental_import_possible
+            # Lists that became private or returned another error are handled by a full import
+            if downloaded is None:
+                return False
+            changes[type] = downloaded
+
+        self.merge_changes(started, changes)
+        return True
+
+    def import_progress(self, since: datetime) -> dict[str, Any]:
+        """Progress of a refresh requested at since, this only reads information so it is cheap enough to poll"""
+        queue_entry = ImportQue.objects.filter(type="user", key=self.username).first()
+        queue_position = None
+        if queue_entry:
+            # Users waiting in the same lane that were queued first
+            queue_position = ImportQue.objects.filter(type="user", lane=queue_entry.lane, id__lt=queue_entry.id).count()
+
+        # Every page of the list that was written after the refresh was requested
+        # Pages are always written after the inventory was created so it has every page that counts
+        pages_downloaded = FILE_INVENTORY.count_modified_since(self.anime_json_path().parent, since, ".json")
+
+        list_imported = (
+            self.model_exists and self.model.info_timestamp is not None and self.model.info_timestamp >= since
+        )
+        media_pending = ImportQue.objects.filter(note=f"User list: {self.username}").count()
+        return {
+            "queued": queue_entry is not None,
+            "queue_position": queue_position,
+            "pages_downloaded": pages_downloaded,
+            "list_imported": list_imported,
+            "media_total": self.model.anime_count if self.model_exists else None,
+            "media_imported": self.model.user_anime().count() if self.model_exists else 0,
+            "media_pending": media_pending,
+            # An up to date user that was never queued is done, list_imported only shows progress while importing
+            "done": queue_entry is None and not media_pending,
+        }
 
     def import_all(
         self, minimum_info_timestamp: Optional[datetime] = None, minimum_modified_timestamp: Optional[datetime] = None
     ) -> None:
-        self.download_all(minimum_info_timestamp)
-        self.update_all(minimum_info_timestamp, minimum_modified_timestamp)
+        if not (
+            self.incremental_import_possible()
+            and self.incremental_import_all(minimum_info_timestamp, minimum_modified_timestamp)
+        ):
+            self.download_all(minimum_info_timestamp)
+            self.update_all(minimum_info_timestamp, minimum_modified_timestamp)
 
         # Once a user's information is update it can be remove from the queue
         ImportQue.objects.filter(type="user", key=self.username).delete()
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+import os
+import sqlite3
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+
+def publish_snapshot(path: Optional[Path] = None, source: Optional[Path] = None) -> Path:
+    """Copy the primary database into a new file and swap it in place of the current snapshot\n
+    The copy is a consistent view of the database using SQLite's online backup API, the importer is not blocked while it runs\n
+    Web connections that are already open keep reading the old file, new connections open the new one\n
+    source defaults to the default database"""
+    path = Path(path or settings.READ_SNAPSHOT_PATH)
+    primary = sqlite3.connect(source or connections["default"].settings_dict["NAME"])
+    temporary = path.with_name(f"{path.name}.tmp")
+    temporary.unlink(missing_ok=True)
+    snapshot = sqlite3.connect(temporary)
+    try:
+        primary.backup(snapshot)
+        # The snapshot is never written to, a rollback journal means readers don't need -wal or -shm files
+        snapshot.execute("PRAGMA journal_mode = delete")
+        snapshot.close()
+        os.replace(temporary, path)
+
+        # No web requests read the primary database so the checkpoint can finish and the WAL can shrink
+        primary.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        snapshot.close()
+        primary.close()
+    return path
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+
+import random
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+
+from main.models import ImportQue
+
+# There are 31,536,000 seconds in a year
+YEAR_SECONDS = 31_536_000
+
+# Notes used by add_to_import_quees, only these entries are moved around when rebalancing
+BACKGROUND_NOTE_PREFIXES = ("Yearly update", "Monthly update")
+
+
+def yearly_offset(media_id: int) -> int:
+    """Using the media_id as the seed randomly pick a number of seconds into the year that is used for this entry\n
+    A separate Random object is used so the global random state is left alone"""
+    return random.Random(media_id).randrange(YEAR_SECONDS)
+
+
+def next_due(
+    media_id: int, info_timestamp: datetime, update_frequency: int, now: Optional[datetime] = None
+) -> datetime:
+    """Get the first scheduled update for an entry that is not before info_timestamp\n
+    Updates are scheduled every update_frequency days starting from the entry's offset into last year"""
+    now = now or datetime.now()
+    # Grab the first date of the year from a year ago and apply the offset
+    start = datetime(now.year - 1, 1, 1).astimezone() + timedelta(seconds=yearly_offset(media_id))
+    if start >= info_timestamp:
+        return start
+
+    # Number of whole steps needed to reach info_timestamp, rounded up
+    step = timedelta(days=update_frequency)
+    steps = -((start - info_timestamp) // step)
+    return start + steps * step
+
+
+def group_by_type(
+    entries: Iterable[ImportQue],
+) -> tuple[dict[str, dict[str, ImportQue]], dict[int, Optional[datetime]]]:
+    """Group unsaved entries by type and key and fill in the id of the row that already exists for each one\n
+    Also returns the current minimum_info_timestamp of every row that already exists"""
+    entries_by_type: dict[str, dict[str, ImportQue]] = defaultdict(dict)
+    for entry in entries:
+        entries_by_type[entry.type][str(entry.key)] = entry
+
+    current: dict[int, Optional[datetime]] = {}
+    for type, by_key in entries_by_type.items():
+        keys = list(by_key)
+        # Read in chunks to stay under SQLite's variable limit
+        for i in range(0, len(keys), 900):
+            rows = ImportQue.objects.filter(type=type, key__in=keys[i : i + 900])
+            for key, id, minimum_info_timestamp in rows.values_list("key", "id", "minimum_info_timestamp"):
+                by_key[key].id = id
+                current[id] = minimum_info_timestamp
+    return entries_by_type, current
+
+
+def bulk_upsert(entries: Iterable[ImportQue]) -> None:
+    """Insert or update import queue entries using a few queries instead of one update_or_create per entry\n
+    Background updates are moved to the first day that is under IMPORTER_DAILY_UPDATE_BUDGET"""
+    entries_by_type = group_by_type(entries)[0]
+    fit_to_budget(
+        [x for by_key in entries_by_type.values() for x in by_key.values()], settings.IMPORTER_DAILY_UPDATE_BUDGET
+    )
+    for by_key in entries_by_type.values():
+        to_update = [x for x in by_key.values() if x.id is not None]
+        to_create = [x for x in by_key.values() if x.id is None]
+        ImportQue.objects.bulk_update(
+            to_update, ["minimum_info_timestamp", "minimum_modified_timestamp", "note", "lane"], batch_size=500
+        )
+        ImportQue.objects.bulk_create(to_create, ignore_conflicts=True)
+
+
+def bulk_queue_earlier(entries: Iterable[ImportQue]) -> int:
+    """Queue entries that need an update, rows that already exist are only ever moved earlier\n
+    The lane, note and minimum_modified_timestamp of existing rows are left alone so a pending import keeps its place\n
+    Returns the number of rows that were created or moved"""
+    entries_by_type, current = group_by_type(entries)
+    changed = 0
+    for by_key in entries_by_type.values():
+        to_update = [
+            x
+            for x in by_key.values()
+            if x.id is not None
+            and x.minimum_info_timestamp is not None
+            and (current[x.id] is None or x.minimum_info_timestamp < current[x.id])  # type: ignore - Checked above
+        ]
+        to_create = [x for x in by_key.values() if x.id is None]
+        ImportQue.objects.bulk_update(to_update, ["minimum_info_timestamp"], batch_size=500)
+        ImportQue.objects.bulk_create(to_create, ignore_conflicts=True)
+        changed += len(to_update) + len(to_create)
+    return changed
+
+
+def rebalance(entries: list[ImportQue], daily_budget: int, now: Optional[datetime] = None) -> list[ImportQue]:
+    """Move background updates forward so no day has more than daily_budget updates\n
+    Updates keep their time of day and are only ever moved later, so an entry is never updated early\n
+    Returns the entries that were changed"""
+    today = (now or datetime.now()).astimezone().date()
+
+    days: dict[date, list[ImportQue]] = defaultdict(list)
+    for entry in entries:
+        if entry.minimum_info_timestamp and local_date(entry.minimum_info_timestamp) >= today:
+            days[local_date(entry.minimum_info_timestamp)].append(entry)
+
+    changed: list[ImportQue] = []
+    carry: list[ImportQue] = []
+    day = min(days, default=today)
+    last_day = max(days, default=today)
+    while day <= last_day or carry:
+        # Entries carried over from earlier days go first so nothing is delayed forever
+        todays = carry + sorted(days.get(day, []), key=lambda x: x.minimum_info_timestamp)  # type: ignore
+        carry = todays[daily_budget:]
+        for entry in todays[:daily_budget]:
+            assert entry.minimum_info_timestamp is not None
+            if local_date(entry.minimum_info_timestamp) != day:
+                timestamp = entry.minimum_info_timestamp
+                entry.minimum_info_timestamp = timestamp + timedelta(days=(day - local_date(timestamp)).days)
+                changed.append(entry)
+        day += timedelta(days=1)
+
+    return changed
+
+
+def is_background_update(entry: ImportQue) -> bool:
+    return bool(entry.minimum_info_timestamp and entry.note and entry.note.startswith(BACKGROUND_NOTE_PREFIXES))
+
+
+def scheduled_on(day: date, ignore: set[int]) -> int:
+    """Number of background updates in the queue for a day, rows in ignore are about to be rescheduled"""
+    start = datetime.combine(day, time()).astimezone()
+    background = Q()
+    for prefix in BACKGROUND_NOTE_PREFIXES:
+        background |= Q(note__startswith=prefix)
+    rows = ImportQue.objects.filter(
+        background, minimum_info_timestamp__gte=start, minimum_info_timestamp__lt=start + timedelta(days=1)
+    )
+    return sum(1 for id in rows.values_list("id", flat=True) if id not in ignore)
+
+
+def fit_to_budget(entries: list[ImportQue], daily_budget: int, now: Optional[datetime] = None) -> None:
+    """Move background updates that are about to be saved later until they land on a day under daily_budget\n
+    Updates that are already queued count towards the budget, the same as rebalance the time of day is kept\n
+    Entries that already exist need their id set so their old schedule is not counted"""
+    today = (now or datetime.now()).astimezone().date()
+    ignore = {x.id for x in entries if x.id is not None}
+    load: dict[date, int] = {}
+    for entry in entries:
+        if not is_background_update(entry):
+            continue
+        timestamp: datetime = entry.minimum_info_timestamp  # type: ignore - Checked by is_background_update
+        # Updates that are already due are done as soon as possible like rebalance leaves them
+        if (day := local_date(timestamp)) < today:
+            continue
+        while True:
+            if day not in load:
+                load[day] = scheduled_on(day, ignore)
+            if load[day] < daily_budget:
+                break
+            day += timedelta(days=1)
+        load[day] += 1
+        entry.minimum_info_timestamp = timestamp + timedelta(days=(day - local_date(timestamp)).days)
+
+
+def local_date(timestamp: datetime) -> date:
+    """Timestamps from the database are in UTC so convert them before grouping them by day"""
+    return timestamp.astimezone().date()
+
+
+def daily_load(entries: Iterable[ImportQue]) -> dict[date, int]:
+    """Count the number of updates scheduled for each day"""
+    load: dict[date, int] = defaultdict(int)
+    for entry in entries:
+        if entry.minimum_info_timestamp:
+            load[local_date(entry.minimum_info_timestamp)] += 1
+    return dict(load)
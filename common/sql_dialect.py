@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+
+    from django.db.backends.base.base import BaseDatabaseWrapper
+
+from abc import ABC, abstractmethod
+
+from django.db import connection as default_connection
+
+
+class SqlDialect(ABC):
+    """Builds the few pieces of the hand written recommendation SQL that are different between databases\n
+    Everything else in the query is written so it works the same on every supported database"""
+
+    vendor = ""
+
+    def if_else(self, condition: str, true: str, false: str) -> str:
+        return f"CASE WHEN {condition} THEN {true} ELSE {false} END"
+
+    @abstractmethod
+    def group_concat(self, expression: str) -> str:
+        """Join the values of a group with the unit separator character, the order is not guaranteed"""
+
+    def in_list(self, column: str, values: Iterable[int]) -> str:
+        """Status columns are integers so the values are written as integers\n
+        Quoting them would turn them into identifiers on PostgreSQL"""
+        values = [int(x) for x in values]
+        if not values:
+            # IN () is a syntax error, this keeps the query valid and returns nothing
+            return "1 = 0"
+        return f"{column} IN ({', '.join(str(x) for x in values)})"
+
+    def not_in_list(self, column: str, values: Iterable[int]) -> str:
+        values = [int(x) for x in values]
+        if not values:
+            return "1 = 1"
+        return f"{column} NOT IN ({', '.join(str(x) for x in values)})"
+
+
+class SQLiteDialect(SqlDialect):
+    vendor = "sqlite"
+
+    def if_else(self, condition: str, true: str, false: str) -> str:
+        return f"IIF({condition}, {true}, {false})"
+
+    def group_concat(self, expression: str) -> str:
+        return f"GROUP_CONCAT({expression}, CHAR(0x1F))"
+
+
+class PostgreSQLDialect(SqlDialect):
+    vendor = "postgresql"
+
+    def group_concat(self, expression: str) -> str:
+        # string_agg only accepts text
+        return f"string_agg(({expression})::text, chr(31))"
+
+
+DIALECTS: dict[str, type[SqlDialect]] = {x.vendor: x for x in (SQLiteDialect, PostgreSQLDialect)}
+
+
+def dialect_for(connection: Optional[BaseDatabaseWrapper] = None) -> SqlDialect:
+    """Get the dialect for a connection, defaults to the default database"""
+    vendor = (connection or default_connection).vendor
+    if vendor not in DIALECTS:
+        raise NotImplementedError(f"The recommendation SQL does not support {vendor} databases")
+    return DIALECTS[vendor]()
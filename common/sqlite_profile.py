@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import sqlite3
+    from typing import Any, Mapping
+
+    from django.db.backends.base.base import BaseDatabaseWrapper
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Only these pragmas can be set, values are put straight into the SQL so the names have to be checked
+PROFILE_PRAGMAS = ("journal_mode", "busy_timeout", "synchronous", "mmap_size", "cache_size", "temp_store", "query_only")
+
+
+def connection_profile(settings_dict: Mapping[str, Any]) -> dict[str, Any]:
+    """The profile from the settings with the overrides of a single database alias on top"""
+    return {**settings.SQLITE_PROFILE, **settings_dict.get("SQLITE_PROFILE", {})}
+
+
+def apply_profile(connection: sqlite3.Connection, profile: Mapping[str, Any]) -> None:
+    """Run the PRAGMA statements of a profile on a sqlite3 connection\n
+    query_only always goes last because the other pragmas can need to write, pragmas set to None are skipped"""
+    for pragma in sorted(profile, key=lambda x: x == "query_only"):
+        if pragma not in PROFILE_PRAGMAS:
+            raise ValueError(f"Unknown SQLite pragma in profile: {pragma}")
+        if profile[pragma] is None:
+            continue
+        connection.execute(f"PRAGMA {pragma} = {profile[pragma]}")
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender: Any, connection: BaseDatabaseWrapper, **kwargs: Any) -> None:
+    if connection.vendor != "sqlite":
+        return
+    apply_profile(connection.connection, connection_profile(connection.settings_dict))
@@ -1,35 +1,73 @@
 from __future__ import annotations
 
 import time
-from datetime import datetime
+from collections import Counter
 
-from django.db.models import Q
+from django.conf import settings
+from django.db.models import Count
 
 import common.configure_django  # type: ignore - Modifies global values
+from common import metrics
+from common.constants import BASE_DIR
+from common.document_cache import DOCUMENT_CACHE
+from common.import_pipeline import ImportJob, ImportPipeline
+from common.import_scheduler import WeightedFairScheduler, due_entries
 from common.myanimelist_media import MyAnimeListMedia
 from common.myanimelist_user import MyAnimeListUser
-from main.models import ImportQue
+from common.read_snapshot import publish_snapshot
+
+# Metrics are written in the Prometheus text format so they can be scraped by the node_exporter textfile collector
+METRICS_FILE = BASE_DIR / "importer.prom"
+METRICS_INTERVAL = 15
+
+
+def export_metrics() -> None:
+    # Notes look like "User list: name" so only the part before the colon is used as the category
+    due = due_entries().order_by()
+    depths: Counter[tuple[str, ...]] = Counter()
+    for row in due.values("note").annotate(count=Count("id")):
+        depths[((row["note"] or "None").split(":")[0],)] += row["count"]
+    metrics.QUEUE_DEPTH.replace(depths)
+    metrics.DOCUMENT_CACHE.replace({(stat,): value for stat, value in DOCUMENT_CACHE.stats().items()})
+    metrics.write_textfile(METRICS_FILE)
+
 
 if __name__ == "__main__":
+    last_export = 0.0
+    last_snapshot = 0.0
+    scheduler = WeightedFairScheduler()
     while True:
-        # Get the highest priority entry that has outdated information
-        media = (
-            ImportQue.objects.filter(
-                Q(minimum_info_timestamp__lt=datetime.now().astimezone())
-                | Q(minimum_modified_timestamp__lt=datetime.now().astimezone())
-            )
-            # Modified timestamp is used when brand new information is being imported which should always get priority over updating old information
-            # Yes this looks backwards, but the results are correct
-            .order_by("minimum_info_timestamp", "minimum_modified_timestamp").first()
-        )
-        if media:
+        if time.monotonic() - last_export > METRICS_INTERVAL:
+            export_metrics()
+            last_export = time.monotonic()
+
+        # Web processes read from the snapshot so it has to be refreshed while the importer is running
+        if settings.READ_SNAPSHOT and time.monotonic() - last_snapshot > settings.READ_SNAPSHOT_INTERVAL:
+            with metrics.STAGE_SECONDS.time(stage="snapshot"):
+                publish_snapshot()
+            last_snapshot = time.monotonic()
+
+        # Get the next entries to import, lanes take turns so interactive users are not stuck behind background updates
+        with metrics.STAGE_SECONDS.time(stage="schedule"):
+            entries = scheduler.next_batch()
+        if entries:
+            media = entries[0]
             if media.type in ["anime", "manga"]:
-                print(f"Importing {media.type}: " + media.key)
-                # This is not actually required but it keeps Pylance in check
-                if media.type == "anime" or media.type == "manga":
-                    MyAnimeListMedia.from_simple(
-                        media_id=int(media.key), media_type=media.type, sparse_import=False
-                    ).import_info(media.minimum_info_timestamp, media.minimum_modified_timestamp)
+                # Import media in batches so downloading and writing to the database can happen at the same time
+                print(f"Importing {len(entries)} media entries from lane {media.lane}")
+                ImportPipeline().run(
+                    ImportJob(
+                        # This is not actually required but it keeps Pylance in check
+                        MyAnimeListMedia.from_simple(
+                            media_id=int(entry.key),
+                            media_type="anime" if entry.type == "anime" else "manga",
+                            sparse_import=False,
+                        ),
+                        entry.minimum_info_timestamp,
+                        entry.minimum_modified_timestamp,
+                    )
+                    for entry in entries
+                )
             elif media.type == "user":
                 username = media.key
                 print("Importing User: " + username)
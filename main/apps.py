@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        # Registers the connection_created receiver that applies settings.SQLITE_PROFILE
+        import common.sqlite_profile  # noqa: F401
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Mapping
+
+    from django.core.management.base import CommandParser
+
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from common.sqlite_profile import apply_profile
+
+# Django does not set any pragmas and sqlite3 waits 5 seconds on a locked database
+DEFAULT_PROFILE: dict[str, Any] = {"journal_mode": "delete"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure read latency while a writer runs long bulk insert transactions, with and without the SQLite profile\n"
+        "A scratch database in a temporary directory is used so the real database is left alone"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--batch", type=int, default=50_000, help="Rows inserted per write transaction")
+        parser.add_argument("--hold", type=float, default=0.5, help="Seconds a write transaction stays open")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            for name, profile in (("default", DEFAULT_PROFILE), ("profile", settings.SQLITE_PROFILE)):
+                path = Path(directory) / f"{name}.sqlite3"
+                self.report(name, *self.run(path, profile, options))
+
+    def run(self, path: Path, profile: Mapping[str, Any], options: dict[str, Any]) -> tuple[list[float], int, int]:
+        setup = self.connect(path, profile)
+        setup.execute("CREATE TABLE entries (id INTEGER PRIMARY KEY, user_id INTEGER, score INTEGER)")
+        setup.execute("CREATE INDEX entries_user ON entries (user_id)")
+        setup.close()
+
+        stop = threading.Event()
+        latencies: list[float] = []
+        errors = [0]
+        writes = [0]
+
+        def writer() -> None:
+            connection = self.connect(path, profile)
+            rows = [(x % 1_000, x % 10) for x in range(options["batch"])]
+            while not stop.is_set():
+                # Like an import, the transaction is opened, filled and held while other work happens
+                connection.execute("BEGIN")
+                connection.executemany("INSERT INTO entries (user_id, score) VALUES (?, ?)", rows)
+                time.sleep(options["hold"])
+                connection.execute("COMMIT")
+                writes[0] += 1
+            connection.close()
+
+        def reader(user_id: int) -> None:
+            connection = self.connect(path, profile)
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    connection.execute(
+                        "SELECT COUNT(*), AVG(score) FROM entries WHERE user_id = ?", (user_id,)
+                    ).fetchone()
+                    latencies.append(time.perf_counter() - start)
+                except sqlite3.OperationalError:
+                    # database is locked
+                    errors[0] += 1
+            connection.close()
+
+        threads = [threading.Thread(target=writer)]
+        threads += [threading.Thread(target=reader, args=(x,)) for x in range(options["readers"])]
+        for thread in threads:
+            thread.start()
+        time.sleep(options["seconds"])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return latencies, errors[0], writes[0]
+
+    def connect(self, path: Path, profile: Mapping[str, Any]) -> sqlite3.Connection:
+        # Autocommit like Django, transactions are opened explicitly by the writer
+        connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        apply_profile(connection, profile)
+        return connection
+
+    def report(self, name: str, latencies: list[float], errors: int, writes: int) -> None:
+        if len(latencies) < 2:
+            self.stdout.write(f"{name}: {len(latencies)} reads, {errors} locked errors, {writes} write transactions")
+            return
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f"{name}: {len(latencies)} reads, p50 {percentiles[49] * 1000:.2f}ms, p99 {percentiles[98] * 1000:.2f}ms, "
+            f"max {max(latencies) * 1000:.2f}ms, {errors} locked errors, {writes} write transactions"
+        )
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from django.core.management.base import CommandParser
+
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from common.constants import DOWNLOADED_FILES_DIR
+from common.myanimelist_user import MyAnimeListUser
+from main.models import Anime, UserAnime
+
+STATUSES = ["watching", "completed", "on_hold", "dropped", "plan_to_watch"]
+
+
+class Command(BaseCommand):
+    help = "Time importing synthetic anime lists of different sizes, nothing is saved to the database"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 30_000])
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        existing_ids = list(Anime.objects.values_list("id", flat=True))
+        for size in options["sizes"]:
+            username = f"benchmark-{size}"
+            self.write_list(username, size, existing_ids)
+            try:
+                user = MyAnimeListUser(username)
+                with transaction.atomic():
+                    # The user has to exist before the list can be imported
+                    user.model.anime_list_private = False
+                    user.model.manga_list_private = False
+                    user.model.add_timestamps_and_save(user.anime_json_path())
+
+                    start = time.perf_counter()
+                    columns = user.update_single_user_list("anime", UserAnime)
+                    elapsed = time.perf_counter() - start
+
+                    # Roll back so the benchmark does not leave anything behind
+                    transaction.set_rollback(True)
+            finally:
+                # Deleting through ExtendedPath also removes the pages from the file inventory
+                (DOWNLOADED_FILES_DIR / "v2" / "users" / username).delete()
+
+            self.stdout.write(
+                f"{size} entries: {elapsed:.3f}s, {size / elapsed:.0f} entries/sec, average score {columns.average_score()}"
+            )
+
+    def write_list(self, username: str, size: int, existing_ids: list[int]) -> None:
+        """Write a list in the same format as the API, about half of the entries exist in the database"""
+        rng = random.Random(size)
+        missing_ids = range(1_000_000, 1_000_000 + size)
+        media_ids = rng.sample(existing_ids, min(size // 2, len(existing_ids)))
+        media_ids += list(missing_ids[: size - len(media_ids)])
+
+        user = MyAnimeListUser(username)
+        for offset in range(0, size, 1000):
+            page = {
+                "data": [
+                    {
+                        "node": {"id": media_id, "title": f"Anime {media_id}"},
+                        "list_status": {
+                            "status": rng.choice(STATUSES),
+                            "score": rng.randrange(11),
+                            "num_episodes_watched": rng.randrange(50),
+                            "is_rewatching": False,
+                            "updated_at": "2022-01-01T00:00:00+00:00",
+                        },
+                    }
+                    for media_id in media_ids[offset : offset + 1000]
+                ],
+                "paging": {"next": "next page"} if offset + 1000 < size else {},
+            }
+            user.anime_json_path(offset).write(json.dumps(page))
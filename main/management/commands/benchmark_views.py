@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from django.core.management.base import CommandParser
+
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+
+class Command(BaseCommand):
+    help = "Compare how many requests per second the views handle through the WSGI and ASGI handlers"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--path", default="/import_status/benchmark", help="Path that is requested")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=32)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        path, requests, concurrency = options["path"], options["requests"], options["concurrency"]
+        # The test clients use "testserver" as the host
+        with override_settings(ALLOWED_HOSTS=["testserver"]):
+            self.report("WSGI", *self.wsgi(path, requests, concurrency))
+            self.report("ASGI", *asyncio.run(self.asgi(path, requests, concurrency)))
+
+    def wsgi(self, path: str, requests: int, concurrency: int) -> tuple[float, Counter[int]]:
+        """Every request uses a thread, like a threaded WSGI server with one thread per worker"""
+        client = Client()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            statuses = Counter(executor.map(lambda _: client.get(path).status_code, range(requests)))
+        return time.perf_counter() - start, statuses
+
+    async def asgi(self, path: str, requests: int, concurrency: int) -> tuple[float, Counter[int]]:
+        """Every request is a task on one event loop, like a single ASGI worker process"""
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request() -> int:
+            async with semaphore:
+                return (await client.get(path)).status_code
+
+        start = time.perf_counter()
+        statuses = Counter(await asyncio.gather(*(request() for _ in range(requests))))
+        return time.perf_counter() - start, statuses
+
+    def report(self, name: str, elapsed: float, statuses: Counter[int]) -> None:
+        total = sum(statuses.values())
+        self.stdout.write(f"{name}: {total / elapsed:.0f} requests/sec, statuses {dict(statuses)}")
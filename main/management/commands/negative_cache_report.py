@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from django.core.management.base import CommandParser
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from main.models import NegativeCache
+
+
+class Command(BaseCommand):
+    help = "Show the entries in the negative cache and how many downloads they have avoided"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--purge-expired", action="store_true", help="Delete entries that have expired")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        now = datetime.now().astimezone()
+        active = NegativeCache.objects.filter(expires_at__gt=now)
+        expired = NegativeCache.objects.filter(expires_at__lte=now)
+
+        self.stdout.write(f"Active entries: {active.count()}")
+        self.stdout.write(f"Expired entries: {expired.count()}")
+        total_avoided = NegativeCache.objects.aggregate(total=Sum("fetches_avoided"))["total"] or 0
+        self.stdout.write(f"Fetches avoided: {total_avoided}")
+
+        self.stdout.write("\nActive entries by reason:")
+        by_reason = (
+            active.values("type", "status", "reason")
+            .annotate(entries=Count("id"), avoided=Sum("fetches_avoided"))
+            .order_by("-entries")
+        )
+        for row in by_reason:
+            self.stdout.write(
+                f"  {row['type']} {row['status']} {row['reason']}: {row['entries']} entries, {row['avoided']} avoided"
+            )
+
+        if options["purge_expired"]:
+            deleted = expired.delete()[0]
+            self.stdout.write(f"\nDeleted {deleted} expired entries")
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from common.read_snapshot import publish_snapshot
+
+
+class Command(BaseCommand):
+    help = "Publish a read snapshot of the database for web processes, the importer also does this every few minutes"
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        start = time.perf_counter()
+        path = publish_snapshot()
+        self.stdout.write(f"Published {path} ({path.stat().st_size:,} bytes) in {time.perf_counter() - start:.2f}s")
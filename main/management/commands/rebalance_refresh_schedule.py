@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from django.core.management.base import CommandParser
+
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from common.refresh_scheduler import (
+    BACKGROUND_NOTE_PREFIXES,
+    YEAR_SECONDS,
+    daily_load,
+    next_due,
+    rebalance,
+    yearly_offset,
+)
+from main.models import ImportQue
+
+
+def loop_offset(media_id: int) -> int:
+    """The original way the offset was picked, this changes the global random state"""
+    random.seed(media_id)
+    return random.randrange(YEAR_SECONDS)
+
+
+def loop_next_due(media_id: int, info_timestamp: datetime, update_frequency: int, now: datetime) -> datetime:
+    """The original way the next update was found, kept to compare against next_due"""
+    timestamp = datetime(now.year - 1, 1, 1).astimezone() + timedelta(seconds=loop_offset(media_id))
+    while timestamp < info_timestamp:
+        timestamp += timedelta(days=update_frequency)
+    return timestamp
+
+
+class Command(BaseCommand):
+    help = "Spread scheduled background updates so no day goes over the daily update budget"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--daily-budget",
+            type=int,
+            default=settings.IMPORTER_DAILY_UPDATE_BUDGET,
+            help="Maximum number of background updates per day",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Show the changes without saving them")
+        parser.add_argument(
+            "--simulate",
+            type=int,
+            default=0,
+            help="Instead of using the import queue schedule this many synthetic entries and report the results",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options["simulate"]:
+            self.simulate(options["simulate"], options["daily_budget"])
+            return
+
+        background = Q()
+        for prefix in BACKGROUND_NOTE_PREFIXES:
+            background |= Q(note__startswith=prefix)
+        entries = list(ImportQue.objects.filter(background))
+
+        self.report("Before", daily_load(entries))
+        changed = rebalance(entries, options["daily_budget"])
+        self.report("After", daily_load(entries))
+        self.stdout.write(f"Moved {len(changed)} entries")
+
+        if not options["dry_run"]:
+            with transaction.atomic():
+                ImportQue.objects.bulk_update(changed, ["minimum_info_timestamp"], batch_size=500)
+
+    def simulate(self, count: int, daily_budget: int) -> None:
+        """Schedule a synthetic catalog with both methods and show how the load is spread out"""
+        now = datetime.now().astimezone()
+        rng = random.Random(0)
+        # Most entries are updated yearly with a small number of recently aired entries updated monthly
+        catalog = [
+            (media_id, now - timedelta(days=rng.randrange(365)), 30 if rng.random() < 0.05 else 365)
+            for media_id in range(1, count + 1)
+        ]
+
+        start = time.perf_counter()
+        looped = [loop_next_due(*entry, now) for entry in catalog]
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        closed_form = [next_due(*entry, now) for entry in catalog]
+        closed_form_seconds = time.perf_counter() - start
+
+        if looped != closed_form:
+            self.stderr.write("The closed form schedule does not match the original schedule")
+        self.stdout.write(f"Original schedule: {loop_seconds:.3f}s, closed form schedule: {closed_form_seconds:.3f}s")
+
+        # The new schedule uses its own random object but has to pick the same offsets
+        self.stdout.write(f"Offsets match: {all(yearly_offset(i) == loop_offset(i) for i, _, _ in catalog[:100])}")
+
+        entries = [
+            ImportQue(type="anime", key=media_id, minimum_info_timestamp=due, note="Yearly update")
+            for (media_id, _, _), due in zip(catalog, closed_form)
+        ]
+        self.report("Before", daily_load(entries))
+        changed = rebalance(entries, daily_budget, now)
+        self.report("After", daily_load(entries))
+        delays = [(x.minimum_info_timestamp - due).days for x, due in zip(entries, closed_form)]  # type: ignore
+        self.stdout.write(f"Moved {len(changed)} entries, longest delay {max(delays, default=0)} days")
+
+    def report(self, label: str, load: dict[date, int]) -> None:
+        today = datetime.now().astimezone().date()
+        upcoming = [count for day, count in load.items() if day >= today]
+        if not upcoming:
+            self.stdout.write(f"{label}: nothing scheduled")
+            return
+        self.stdout.write(
+            f"{label}: {len(upcoming)} days, max {max(upcoming)} per day, mean {statistics.mean(upcoming):.1f} per day"
+        )
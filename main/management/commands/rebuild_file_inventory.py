@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from common.constants import FILE_INVENTORY
+
+
+class Command(BaseCommand):
+    help = (
+        "Scan the downloaded files and make the file inventory match them, "
+        "needed once for files from before the inventory and after changing files without ExtendedPath"
+    )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        start = time.perf_counter()
+        indexed, hashed, removed = FILE_INVENTORY.rebuild()
+        self.stdout.write(
+            f"{indexed:,} files indexed, {hashed:,} hashed and {removed:,} removed "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
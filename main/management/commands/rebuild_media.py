@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Iterator, Literal, Optional
+
+    from django.core.management.base import CommandParser
+
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from common.anime_typed_dict import AnimeDataClass
+from common.constants import BASE_DIR, DOWNLOADED_FILES_DIR
+from common.manga_typed_dict import MangaDataClass
+from common.myanimelist_media import (
+    MyAnimeListAnime,
+    MyAnimeListManga,
+    MyAnimeListMedia,
+)
+from main.models import (
+    AnimeRelatedAnime,
+    AnimeStudios,
+    MangaPictures,
+    MangaRelatedManga,
+    Studio,
+)
+
+MEDIA_CLASSES = {"anime": MyAnimeListAnime, "manga": MyAnimeListManga}
+DATA_CLASSES = {"anime": AnimeDataClass, "manga": MangaDataClass}
+
+# Every entry that has been written is added to this file so an interrupted rebuild can be resumed
+PROGRESS_FILE = BASE_DIR / "rebuild_media_progress.txt"
+
+# Number of entries each worker process parses at once
+CHUNK_SIZE = 64
+
+
+@dataclass
+class ParsedMedia:
+    media_type: Literal["anime", "manga"]
+    media_id: int
+    data: AnimeDataClass | MangaDataClass
+    userrecs: Optional[list[tuple[int, int]]]
+    info_timestamp: datetime
+    sparse: bool
+    fingerprint: str
+
+
+def cached_media(media_type: Literal["anime", "manga"], media_id: int) -> MyAnimeListMedia:
+    """Create a MyAnimeListMedia object without loading anything from the database"""
+    media_class = MEDIA_CLASSES[media_type]
+    return media_class(media_id, False, media_class.MODEL(id=media_id))  # type: ignore - MODEL matches the class
+
+
+def parse_cached_media(tasks: list[tuple[Literal["anime", "manga"], int]]) -> list[ParsedMedia]:
+    """Parse the downloaded files for a list of entries, this runs inside of the worker processes"""
+    output: list[ParsedMedia] = []
+    for media_type, media_id in tasks:
+        media = cached_media(media_type, media_id)
+        json_path = media.json_file_path()
+        html_path = media.userrecs_html_file_path()
+
+        # Read the file directly so the parsed JSON is not cached on the path object
+        raw_json = json.loads(json_path.read_bytes())
+        # Files for entries that do not exist only contain an error message
+        if raw_json.get("error"):
+            continue
+        data = DATA_CLASSES[media_type](**raw_json)
+
+        userrecs = None
+        sparse = False
+        files = [json_path]
+        if len(data.recommendations) == 10:
+            if html_path.exists():
+                userrecs = MyAnimeListMedia.parse_userrecs_html(html_path)
+                files.append(html_path)
+            # Without the HTML file the recommendations can't be fully imported
+            else:
+                sparse = True
+
+        fingerprint = MyAnimeListMedia.content_fingerprint(raw_json, userrecs)
+        info_timestamp = min(x.aware_mtime() for x in files)
+        output.append(ParsedMedia(media_type, media_id, data, userrecs, info_timestamp, sparse, fingerprint))
+    return output
+
+
+class Command(BaseCommand):
+    help = "Rebuild every anime and manga entry from the files in the download cache without using the network"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--workers", type=int, default=None, help="Number of processes used for parsing")
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of entries written per transaction")
+        parser.add_argument("--fresh", action="store_true", help="Ignore the progress from an earlier rebuild")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options["fresh"]:
+            PROGRESS_FILE.delete()
+
+        finished = self.finished_entries()
+        tasks = [task for task in self.scan_cache() if task not in finished]
+        self.stdout.write(f"Found {len(tasks)} entries to rebuild, skipping {len(finished)} finished entries")
+
+        # Foreign keys are checked once at the end instead of for every row
+        # Relationships and recommendations can point to entries that are written in a later batch
+        with connection.constraint_checks_disabled():
+            entries = rows = 0
+            start = time.perf_counter()
+            batch: list[ParsedMedia] = []
+            for parsed in self.parse_all(tasks, options["workers"]):
+                batch.append(parsed)
+                if len(batch) >= options["batch_size"]:
+                    rows += self.write_batch(batch)
+                    entries += len(batch)
+                    self.report(entries, len(tasks), rows, start)
+                    batch = []
+            if batch:
+                rows += self.write_batch(batch)
+                entries += len(batch)
+                self.report(entries, len(tasks), rows, start)
+
+            self.delete_dangling_rows()
+
+        connection.check_constraints()
+        PROGRESS_FILE.delete()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {entries} entries and {rows} rows"))
+
+    def scan_cache(self) -> list[tuple[Literal["anime", "manga"], int]]:
+        tasks: list[tuple[Literal["anime", "manga"], int]] = []
+        for media_type in MEDIA_CLASSES:
+            for path in (DOWNLOADED_FILES_DIR / "v2" / media_type).glob("*.json"):
+                if path.stem.isdigit():
+                    tasks.append((media_type, int(path.stem)))  # type: ignore - media_type is a key of MEDIA_CLASSES
+        return sorted(tasks)
+
+    def finished_entries(self) -> set[tuple[str, int]]:
+        if not PROGRESS_FILE.exists():
+            return set()
+        finished: set[tuple[str, int]] = set()
+        for line in PROGRESS_FILE.read_text().splitlines():
+            media_type, media_id = line.split(" ")
+            finished.add((media_type, int(media_id)))
+        return finished
+
+    def parse_all(
+        self, tasks: list[tuple[Literal["anime", "manga"], int]], workers: Optional[int]
+    ) -> Iterator[ParsedMedia]:
+        """Parse entries in a process pool while keeping the number of unwritten results bounded"""
+        chunks = [tasks[i : i + CHUNK_SIZE] for i in range(0, len(tasks), CHUNK_SIZE)]
+        workers = workers or os.cpu_count() or 1
+        # django.setup is required when the worker processes are spawned instead of forked
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+            in_flight: deque[Future[list[ParsedMedia]]] = deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(parse_cached_media, chunk))
+                if len(in_flight) >= workers * 2:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+    def report(self, entries: int, total: int, rows: int, start: float) -> None:
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{entries}/{total} entries, {rows} rows, {rows / elapsed:.0f} rows/sec")
+
+    def write_batch(self, batch: list[ParsedMedia]) -> int:
+        rows = 0
+        with transaction.atomic():
+            for media_type, media_class in MEDIA_CLASSES.items():
+                entries = [x for x in batch if x.media_type == media_type]
+                if entries:
+                    rows += self.write_entries(media_class, entries)
+
+        # Only record progress once the batch has been committed
+        with PROGRESS_FILE.open("a") as progress:
+            progress.writelines(f"{x.media_type} {x.media_id}\n" for x in batch)
+        return rows
+
+    def write_entries(self, media_class: type[MyAnimeListMedia], entries: list[ParsedMedia]) -> int:
+        ids = [x.media_id for x in entries]
+        existing_ids = set(media_class.MODEL.objects.filter(id__in=ids).values_list("id", flat=True))
+        now = datetime.now().astimezone()
+
+        medias: list[tuple[MyAnimeListMedia, ParsedMedia]] = []
+        for entry in entries:
+            media = cached_media(entry.media_type, entry.media_id)
+            media.assign_fields(entry.data)
+            media.db_object.sparse = entry.sparse
+            media.db_object.info_timestamp = entry.info_timestamp
+            media.db_object.info_modified_timestamp = now
+            media.db_object.content_fingerprint = entry.fingerprint
+            medias.append((media, entry))
+
+        # Update existing entries in place so user lists that point to them are kept
+        fields = [f.name for f in media_class.MODEL._meta.concrete_fields if not f.primary_key]
+        media_class.MODEL.objects.bulk_create([m.db_object for m, _ in medias if m.media_id not in existing_ids])  # type: ignore
+        media_class.MODEL.objects.bulk_update([m.db_object for m, _ in medias if m.media_id in existing_ids], fields)  # type: ignore
+        rows = len(medias)
+
+        synonyms = [
+            media_class.SYNONYMS_MODEL(media_id=m.media_id, synonym=x)
+            for m, e in medias
+            for x in e.data.alternative_titles.synonyms
+        ]
+        rows += self.replace_rows(media_class.SYNONYMS_MODEL, ids, synonyms)
+
+        genres = [(m.media_id, x) for m, e in medias for x in e.data.genres or []]
+        media_class.GENRES_LIST_MODEL.objects.bulk_create(
+            [media_class.GENRES_LIST_MODEL(id=x.id_, name=x.name) for _, x in genres], ignore_conflicts=True  # type: ignore
+        )
+        rows += self.replace_rows(
+            media_class.GENRES_MODEL, ids, [media_class.GENRES_MODEL(media_id=i, genre_id=x.id_) for i, x in genres]
+        )
+
+        # Matches import_pictures which only imports manga pictures
+        if media_class.PICTURES_MODEL == MangaPictures:
+            pictures = [
+                MangaPictures(media_id=m.media_id, large=m.image_cleaner(x.large), medium=m.image_cleaner(x.medium))
+                for m, e in medias
+                for x in e.data.pictures
+            ]
+            rows += self.replace_rows(MangaPictures, ids, pictures)
+
+        recs: list[Any] = []
+        related: list[Any] = []
+        for media, entry in medias:
+            # Sparse entries never have their recommendations or relationships imported
+            if entry.sparse:
+                continue
+
+            if entry.userrecs is not None:
+                pairs = entry.userrecs
+            else:
+                pairs = [(x.node.id_, x.num_recommendations) for x in entry.data.recommendations]
+            recs += [
+                media_class.REC_MODEL(media_id=media.media_id, recommended_media_id=i, recommendations=count)
+                for i, count in pairs
+            ]
+
+            if isinstance(entry.data, AnimeDataClass):
+                related += [
+                    AnimeRelatedAnime(
+                        media_id=media.media_id,
+                        related_media_id=x.node.id_,
+                        relationship=x.relation_type_formatted,
+                    )
+                    for x in entry.data.related_anime
+                ]
+            elif isinstance(entry.data, MangaDataClass):
+                related += [
+                    MangaRelatedManga(
+                        media_id=media.media_id,
+                        related_media_id=x.node.id_,
+                        relationship=x.relation_type_formatted,
+                    )
+                    for x in entry.data.related_manga
+                ]
+
+        full_ids = [x.media_id for x in entries if not x.sparse]
+        rows += self.replace_rows(media_class.REC_MODEL, full_ids, recs)
+        rows += self.replace_rows(
+            AnimeRelatedAnime if media_class is MyAnimeListAnime else MangaRelatedManga, full_ids, related
+        )
+
+        if media_class is MyAnimeListAnime:
+            studios = [(m.media_id, x) for m, e in medias if isinstance(e.data, AnimeDataClass) for x in e.data.studios]
+            Studio.objects.bulk_create([Studio(id=x.id_, name=x.name) for _, x in studios], ignore_conflicts=True)
+            rows += self.replace_rows(
+                AnimeStudios, ids, [AnimeStudios(media_id=i, studio_id=x.id_) for i, x in studios]
+            )
+
+        return rows
+
+    def replace_rows(self, model: Any, media_ids: Iterable[int], rows: list[Any]) -> int:
+        """Delete the old rows for a list of entries and insert the new ones"""
+        model.objects.filter(media_id__in=list(media_ids)).delete()
+        model.objects.bulk_create(rows, ignore_conflicts=True)
+        return len(rows)
+
+    def delete_dangling_rows(self) -> None:
+        """Remove relationships and recommendations that point to entries that do not exist"""
+        for media_class in MEDIA_CLASSES.values():
+            existing = media_class.MODEL.objects.values("id")
+            dangling = media_class.REC_MODEL.objects.exclude(recommended_media_id__in=existing).delete()[0]
+            if dangling:
+                self.stdout.write(f"Deleted {dangling} {media_class.MEDIA_TYPE} recommendations to missing entries")
+
+        for model, target in [(AnimeRelatedAnime, MyAnimeListAnime), (MangaRelatedManga, MyAnimeListManga)]:
+            dangling = model.objects.exclude(related_media_id__in=target.MODEL.objects.values("id")).delete()[0]
+            if dangling:
+                self.stdout.write(f"Deleted {dangling} {target.MEDIA_TYPE} relationships to missing entries")
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from django.core.management.base import CommandParser
+    from django.db.models import QuerySet
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, F, Max, OuterRef
+
+from common.refresh_scheduler import bulk_queue_earlier
+from main.models import (
+    AnimeRecs,
+    AnimeRelatedAnime,
+    ImportQue,
+    MangaRecs,
+    MangaRelatedManga,
+)
+
+# Some entries on MAL only show relationships in one direction for some reason
+# Backdate the import queue by one hour to avoid forever downloading 2 pages
+# Technically this can cause missing information but the likelyhood is very low
+BACKDATE = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = "Find relationships and recommendations that do not match on both entries and queue the older entry"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--dry-run", action="store_true", help="Show the counts without queueing anything")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        entries: list[ImportQue] = []
+        for media_type, model in [("anime", AnimeRelatedAnime), ("manga", MangaRelatedManga)]:
+            reverse = model.objects.filter(media_id=OuterRef("related_media_id"), related_media_id=OuterRef("media_id"))
+            outdated = self.outdated_targets(model.objects.filter(~Exists(reverse)), "related_media")
+            self.stdout.write(f"{media_type} relationships: {len(outdated)} entries to update")
+            entries += self.queue_entries(media_type, outdated, "Relationships")
+
+        for media_type, model in [("anime", AnimeRecs), ("manga", MangaRecs)]:
+            reverse = model.objects.filter(
+                media_id=OuterRef("recommended_media_id"),
+                recommended_media_id=OuterRef("media_id"),
+                recommendations=OuterRef("recommendations"),
+            )
+            outdated = self.outdated_targets(model.objects.filter(~Exists(reverse)), "recommended_media")
+            self.stdout.write(f"{media_type} recommendations: {len(outdated)} entries to update")
+            entries += self.queue_entries(media_type, outdated, "Recommendations")
+
+        if options["dry_run"]:
+            self.stdout.write(f"Found {len(entries)} entries, nothing was queued")
+        else:
+            # Entries that are already queued sooner, like a user's list, keep their place in the queue
+            with transaction.atomic():
+                changed = bulk_queue_earlier(entries)
+            self.stdout.write(self.style.SUCCESS(f"Queued or moved up {changed} of {len(entries)} entries"))
+
+    def outdated_targets(self, mismatched: QuerySet[Any], target: str) -> dict[int, tuple[Any, int]]:
+        """Find the fully imported targets of mismatched rows that are older than the entry the row came from\n
+        Returns the newest timestamp and id of the entry that points to each target"""
+        rows = (
+            mismatched.filter(
+                **{f"{target}__sparse": False, f"{target}__info_timestamp__lt": F("media__info_timestamp")}
+            )
+            .values(f"{target}_id")
+            .annotate(newest=Max("media__info_timestamp"), source=Max("media_id"))
+        )
+        return {row[f"{target}_id"]: (row["newest"], row["source"]) for row in rows}
+
+    def queue_entries(self, media_type: str, outdated: dict[int, tuple[Any, int]], reason: str) -> list[ImportQue]:
+        return [
+            ImportQue(
+                type=media_type,
+                key=media_id,
+                minimum_info_timestamp=newest - BACKDATE,
+                minimum_modified_timestamp=None,
+                note=f"{reason}: {media_type} {source}",
+            )
+            for media_id, (newest, source) in outdated.items()
+        ]
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from django.core.management.base import CommandParser
+
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+
+import common.extended_re as re
+from common.extended_path import ExtendedPath
+
+LIST_REGEX = re.compile(r"^/v2/users/(?P<username>[^/]+)/(?P<type>anime|manga)list$")
+MEDIA_REGEX = re.compile(r"^/v2/(?P<type>anime|manga)/(?P<media_id>\d+)$")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve user lists and media the same way the MyAnimeList API does\n
+    Lists are read from {fixtures}/users/{username}/{type}list.json which contains every entry on the list\n
+    Media is read from {fixtures}/{type}/{media_id}.json"""
+
+    fixtures: ExtendedPath
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if match := re.search(LIST_REGEX, url.path):
+            path = self.fixtures / "users" / match.group("username") / f"{match.group('type')}list.json"
+            if not path.exists():
+                return self.respond(404, {"error": "not_found", "message": ""})
+            self.respond(200, self.list_page(json.loads(path.read_bytes()), query))
+        elif match := re.search(MEDIA_REGEX, url.path):
+            path = self.fixtures / match.group("type") / f"{match.group('media_id')}.json"
+            if not path.exists():
+                return self.respond(404, {"error": "not_found", "message": ""})
+            self.respond(200, json.loads(path.read_bytes()))
+        else:
+            self.respond(404, {"error": "not_found", "message": ""})
+
+    def list_page(self, entries: list[dict[str, Any]], query: dict[str, str]) -> dict[str, Any]:
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 100))
+        if query.get("sort") == "list_updated_at":
+            entries = sorted(entries, key=lambda x: x["list_status"]["updated_at"], reverse=True)
+
+        page: dict[str, Any] = {"data": entries[offset : offset + limit], "paging": {}}
+        if offset + limit < len(entries):
+            page["paging"]["next"] = f"{self.path.split('?')[0]}?offset={offset + limit}&limit={limit}"
+        return page
+
+    def respond(self, status: int, content: dict[str, Any]) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Command(BaseCommand):
+    help = "Run a local stand in for the MyAnimeList API, use it by setting MAL_API_DOMAIN to the printed address"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("fixtures", type=str, help="Folder with the users, anime, and manga to serve")
+        parser.add_argument("--port", type=int, default=8765)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        StubHandler.fixtures = ExtendedPath(options["fixtures"])
+        server = ThreadingHTTPServer(("127.0.0.1", options["port"]), StubHandler)
+        self.stdout.write(f"MAL_API_DOMAIN=http://127.0.0.1:{options['port']}")
+        server.serve_forever()
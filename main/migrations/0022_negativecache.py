@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-19 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_alter_anime_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NegativeCache',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('type', models.CharField(max_length=255)),
+                ('key', models.CharField(max_length=255)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('reason', models.CharField(max_length=255)),
+                ('expires_at', models.DateTimeField()),
+                ('fetches_avoided', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'negative_cache',
+                'constraints': [models.UniqueConstraint(fields=('type', 'key'), name='NegativeCache_type_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-19 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_negativecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anime',
+            name='content_fingerprint',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='anime',
+            name='unchanged_fetches',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='manga',
+            name='content_fingerprint',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='manga',
+            name='unchanged_fetches',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
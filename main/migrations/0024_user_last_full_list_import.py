@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-19 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_media_content_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_full_anime_list_import',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='last_full_manga_list_import',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.6 on 2026-10-19 04:36
+
+from django.db import migrations, models
+
+
+def assign_lanes(apps, schema_editor):
+    # Users in the queue were added by someone requesting recommendations and media notes start with "User list"
+    ImportQue = apps.get_model('main', 'ImportQue')
+    ImportQue.objects.filter(type='user').update(lane=0)
+    ImportQue.objects.filter(note__startswith='User list').update(lane=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0024_user_last_full_list_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importque',
+            name='lane',
+            field=models.PositiveSmallIntegerField(default=2),
+        ),
+        migrations.RunPython(assign_lanes, migrations.RunPython.noop),
+    ]
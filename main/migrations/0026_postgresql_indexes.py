@@ -0,0 +1,39 @@
+# Generated by Django 4.0.6 on 2026-10-19 09:12
+
+from django.db import migrations
+
+# SQLite already handles these queries well enough with the unique constraints, so these indexes are PostgreSQL only
+# Covering indexes let the recommendation query read the user's list and the recommendations without the tables
+# The partial index only holds the interactive and user media lanes which are small but checked on every batch
+POSTGRESQL_INDEXES = {
+    'user_anime_user_status_covering': 'ON user_anime (user_id, status) INCLUDE (media_id, score)',
+    'user_manga_user_status_covering': 'ON user_manga (user_id, status) INCLUDE (media_id, score)',
+    'anime_recs_media_covering': 'ON anime_recs (media_id) INCLUDE (recommended_media_id, recommendations)',
+    'manga_recs_media_covering': 'ON manga_recs (media_id) INCLUDE (recommended_media_id, recommendations)',
+    'import_que_front_lanes': 'ON import_que (lane, minimum_info_timestamp, minimum_modified_timestamp) WHERE lane < 2',
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in POSTGRESQL_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} {definition}')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in POSTGRESQL_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0025_importque_lane'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -11,12 +11,12 @@ from django.db import models
 from common.model_helper import GetOrNew
 from common.model_templates import ModelWithIdAndTimestamp
 
-from .functions import lazy_db_table, lazy_fk, lazy_unique
+from .functions import LazyModel, LazyModelBase, lazy_db_table, lazy_fk, lazy_unique
 
 # Media
 if True:
 
-    class Media(ModelWithIdAndTimestamp, GetOrNew):  # type: ignore - Composing abstract models always throws type errors
+    class Media(ModelWithIdAndTimestamp, GetOrNew, metaclass=LazyModelBase):  # type: ignore - Composing abstract models always throws type errors
         class Meta:  # type: ignore - Meta class always throws type errors
             abstract = True
 
@@ -47,6 +47,10 @@ if True:
         statistics_status_dropped = models.PositiveSmallIntegerField(null=True)
         statistics_status_plan_to_watch = models.PositiveSmallIntegerField(null=True)
         statistics_num_list_users = models.PositiveSmallIntegerField(null=True)
+        # Hash of the downloaded information used to skip imports when nothing changed
+        content_fingerprint = models.CharField(max_length=64, null=True)
+        # Number of downloads in a row that did not change, used to slow down updates for entries that never change
+        unchanged_fetches = models.PositiveSmallIntegerField(default=0)
 
         def __str__(self) -> str:
             return f"{self.title} ({self.id})"
@@ -81,7 +85,7 @@ if True:
 # Pictures
 if True:
 
-    class AnimePictures(models.Model):
+    class AnimePictures(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -91,7 +95,7 @@ if True:
         medium = models.CharField(max_length=255)
         large = models.CharField(max_length=255)
 
-    class MangaPictures(models.Model):
+    class MangaPictures(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -105,7 +109,7 @@ if True:
 # Alternative Title
 if True:
 
-    class AnimeAlternativeTitles(models.Model):
+    class AnimeAlternativeTitles(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -114,7 +118,7 @@ if True:
         media = models.ForeignKey(Anime, on_delete=models.CASCADE)
         title = models.CharField(max_length=255)
 
-    class MangaAlternativeTitles(models.Model):
+    class MangaAlternativeTitles(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -127,7 +131,7 @@ if True:
 # Related entries
 if True:
 
-    class RelatedMedia(models.Model):
+    class RelatedMedia(LazyModel):
         class Meta:  # type: ignore - Meta class always throws type errors
             abstract = True
 
@@ -185,7 +189,7 @@ if True:
 # Recs
 if True:
 
-    class AnimeRecs(models.Model):
+    class AnimeRecs(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta class always throws type errors
@@ -197,7 +201,7 @@ if True:
         recommended_media = lazy_fk(Anime)
         recommendations = models.PositiveSmallIntegerField()
 
-    class MangaRecs(models.Model):
+    class MangaRecs(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta class always throws type errors
@@ -213,7 +217,7 @@ if True:
 # Synonyms
 if True:
 
-    class AnimeSynonyms(models.Model):
+    class AnimeSynonyms(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -222,7 +226,7 @@ if True:
         media = models.ForeignKey(Anime, on_delete=models.CASCADE)
         synonym = models.CharField(max_length=255)
 
-    class MangaSynonyms(models.Model):
+    class MangaSynonyms(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -235,7 +239,7 @@ if True:
 # Studios
 if True:
     # This is sharedb etween anime and manga
-    class Studio(models.Model):
+    class Studio(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -244,7 +248,7 @@ if True:
         id = models.PositiveSmallIntegerField(primary_key=True)
         name = models.CharField(max_length=255)
 
-    class AnimeStudios(models.Model):
+    class AnimeStudios(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -257,7 +261,7 @@ if True:
 # Genres
 if True:
     # The genre values between anime and manga are different
-    class AnimeGenreList(models.Model):
+    class AnimeGenreList(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -267,7 +271,7 @@ if True:
         name = models.CharField(max_length=255)
 
     # The genre values between anime and manga are different
-    class MangaGenreList(models.Model):
+    class MangaGenreList(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -276,7 +280,7 @@ if True:
         id = models.PositiveSmallIntegerField(primary_key=True)
         name = models.CharField(max_length=255)
 
-    class AnimeGenres(models.Model):
+    class AnimeGenres(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -285,7 +289,7 @@ if True:
         media = models.ForeignKey(Anime, on_delete=models.CASCADE)
         genre = models.ForeignKey(AnimeGenreList, on_delete=models.CASCADE)
 
-    class MangaGenres(models.Model):
+    class MangaGenres(LazyModel):
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -298,7 +302,7 @@ if True:
 # User
 if True:
 
-    class User(ModelWithIdAndTimestamp, GetOrNew):  # type: ignore - Composing abstract models always throws type errors
+    class User(ModelWithIdAndTimestamp, GetOrNew, metaclass=LazyModelBase):  # type: ignore - Composing abstract models always throws type errors
         objects: QuerySet[Self]
 
         class Meta:  # type: ignore - Meta always throws type errors
@@ -314,6 +318,9 @@ if True:
         manga_list_private = models.BooleanField()
         last_successful_anime_list_import = models.DateTimeField(null=True)
         last_successful_manga_list_import = models.DateTimeField(null=True)
+        # Incremental imports can't see removed entries so a full import is still done every so often
+        last_full_anime_list_import = models.DateTimeField(null=True)
+        last_full_manga_list_import = models.DateTimeField(null=True)
 
         def user_anime(self) -> QuerySet[UserAnime]:
             return UserAnime.objects.filter(user=self, media__sparse=False)
@@ -324,7 +331,7 @@ if True:
         def __str__(self) -> str:
             return self.name
 
-    class UserMedia(GetOrNew):
+    class UserMedia(GetOrNew, metaclass=LazyModelBase):
         class Meta:  # type: ignore - Meta class always throws type errors
             abstract = True
 
@@ -361,16 +368,43 @@ if True:
         num_chapters_read = models.PositiveSmallIntegerField()
 
 
-class ImportQue(models.Model):
+class ImportQue(LazyModel):
     objects: QuerySet[Self]
 
     class Meta:  # type: ignore - Meta class always throws type errors
         db_table = lazy_db_table()
         constraints = lazy_unique("type", "key")
 
+    # Lanes are scheduled separately so users waiting on a page are not stuck behind background updates
+    LANE_INTERACTIVE = 0  # Users that just requested recommendations
+    LANE_USER_MEDIA = 1  # Media on the list of a user that is being imported
+    LANE_BACKGROUND = 2  # Scheduled updates and everything else
+
     id = models.AutoField(primary_key=True)
     type = models.CharField(max_length=255, null=False)
     key = models.CharField(max_length=255, null=False)
     minimum_info_timestamp = models.DateTimeField(null=True)
     minimum_modified_timestamp = models.DateTimeField(null=True)
     note = models.CharField(max_length=255, null=True)
+    lane = models.PositiveSmallIntegerField(default=LANE_BACKGROUND)
+
+
+class NegativeCache(LazyModel):
+    """Entries that returned an error when downloading, these are not downloaded again until expires_at"""
+
+    objects: QuerySet[Self]
+
+    class Meta:  # type: ignore - Meta class always throws type errors
+        db_table = lazy_db_table()
+        constraints = lazy_unique("type", "key")
+
+    id = models.AutoField(primary_key=True)
+    type = models.CharField(max_length=255, null=False)
+    key = models.CharField(max_length=255, null=False)
+    status = models.PositiveSmallIntegerField()
+    reason = models.CharField(max_length=255)
+    expires_at = models.DateTimeField()
+    fetches_avoided = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.type} {self.key} ({self.status} {self.reason})"
@@ -5,44 +5,63 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from typing import Any
 
-import inspect
-
 from django.db import models
+from django.db.models.base import ModelBase
 
 import common.extended_re as re
 
+# The lazy functions only leave placeholders, the real names are filled in by LazyModelBase once the class name is known
+# This used to be done with stack inspection which was slow enough to add about a second to every process start
+LAZY_PREFIX = "__lazy__"
 
-# This is kinda sketch because it relies on stack inspection
-def lazy_db_table() -> str:
-
-    # Trying to add a little bit of safety to this sketchy code
-    # This part of the stack should always be Meta
-    if inspect.stack()[1][3] != "Meta":
-        raise ValueError("sketchy_lazy_namer has lived up to it's name and somethign went wrong")
 
-    original_class_name = inspect.stack()[2][3]
-    # Regex is beautiful, this converts CamelCase to snake_case
-    snake_case_class_name = re.sub(r"(?<!^)(?=[A-Z])", "_", original_class_name).lower()
-    return snake_case_class_name
+def lazy_db_table() -> str:
+    return LAZY_PREFIX
 
 
-# This is kinda sketch because it relies on stack inspection
 def lazy_unique(*fields: str) -> list[models.UniqueConstraint]:
-    # Trying to add a little bit of safety to this sketchy code
-    # This part of the stack should always be Meta
-    if inspect.stack()[1][3] != "Meta":
-        raise ValueError("sketchy_lazy_namer has lived up to it's name and somethign went wrong")
+    return [models.UniqueConstraint(fields=fields, name=f"{LAZY_PREFIX}{'_'.join(fields)}")]
 
-    return [models.UniqueConstraint(fields=fields, name=f"{inspect.stack()[2][3]}_{'_'.join(fields)}")]
 
-
-# This is extra sketch because it relies on stack inspection and it has no extra checks
 # TODO: Types on these variables, need to figure out what values are normally accepted
 def lazy_fk(fk_model: Any, on_delete: Any = models.CASCADE) -> models.ForeignKey[Any]:
-
     # The stated return type does not match with the actual value so ignore the type error
-    key_name = inspect.stack()[1][4][0].strip().split(" =")[0]  # type: ignore
-    main_model = inspect.stack()[1][3]
-    related_name = f"{main_model}_{fk_model.__name__}_{key_name}"
+    return models.ForeignKey(fk_model, on_delete=models.CASCADE, related_name=f"{LAZY_PREFIX}{fk_model.__name__}")
 
-    return models.ForeignKey(fk_model, on_delete=models.CASCADE, related_name=related_name)
+
+def snake_case(name: str) -> str:
+    # Regex is beautiful, this converts CamelCase to snake_case
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+
+class LazyModelBase(ModelBase):
+    """Replaces the placeholders left by the lazy functions before Django reads the class\n
+    Tables are named after the class in snake_case, unique constraints are named ClassName_field_field\n
+    and foreign keys get a related_name of ClassName_RelatedModel_attribute"""
+
+    def __new__(cls, name: str, bases: tuple[type, ...], attrs: dict[str, Any], **kwargs: Any) -> Any:
+        meta = attrs.get("Meta")
+        if meta is not None:
+            if getattr(meta, "db_table", None) == LAZY_PREFIX:
+                meta.db_table = snake_case(name)
+            if hasattr(meta, "constraints"):
+                meta.constraints = [
+                    models.UniqueConstraint(fields=x.fields, name=f"{name}_{x.name.removeprefix(LAZY_PREFIX)}")
+                    if x.name.startswith(LAZY_PREFIX)
+                    else x
+                    for x in meta.constraints
+                ]
+
+        for key, value in attrs.items():
+            if isinstance(value, models.ForeignKey) and str(value.remote_field.related_name).startswith(LAZY_PREFIX):
+                related_model = value.remote_field.related_name.removeprefix(LAZY_PREFIX)
+                # The field keeps its own copy for migrations
+                value.remote_field.related_name = value._related_name = f"{name}_{related_model}_{key}"
+
+        return super().__new__(cls, name, bases, attrs, **kwargs)
+
+
+class LazyModel(models.Model, metaclass=LazyModelBase):
+    # Required to be able to subclass models.Model
+    class Meta:  # type: ignore - Meta class always throws type errors
+        abstract = True
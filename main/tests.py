@@ -1,3 +1,1150 @@
-from django.test import TestCase
+import asyncio
+import gc
+import io
+import json
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import unittest
+import weakref
+from datetime import datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from http.server import ThreadingHTTPServer
+from typing import Any, Optional
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from common import file_inventory
+from common.constants import FILE_INVENTORY
+from common.document_cache import DocumentCache
+from common.extended_path import ExtendedPath
+from common.file_inventory import FileEntry, FileInventory, content_hash
+from common.import_pipeline import ImportJob, ImportPipeline
+from common.import_profile import STATEMENTS, imported_modules, total_import_time
+from common.import_scheduler import WeightedFairScheduler, due_entries
+from common.metrics import Metric
+from common.myanimelist_media import MyAnimeListAnime
+from common.myanimelist_user import MyAnimeListUser
+from common.read_snapshot import publish_snapshot
+from common.refresh_scheduler import bulk_queue_earlier, bulk_upsert
+from common.sql_dialect import PostgreSQLDialect, SqlDialect, SQLiteDialect, dialect_for
+from main.forms import NameForm
+from main.management.commands import rebuild_media
+from main.management.commands.stub_mal_api import StubHandler
+from main.models import (
+    Anime,
+    AnimeRecs,
+    AnimeRelatedAnime,
+    ImportQue,
+    NegativeCache,
+    User,
+    UserAnime,
+)
+from main.views import limit_concurrency, recommendation_sql
+
+# Modules only needed when an import runs, web processes should never load them
+SCRAPING_MODULES = {
+    "bs4",
+    "lxml",
+    "pydantic",
+    "common.extended_bs4",
+    "common.myanimelist_media",
+    "common.import_pipeline",
+    "common.downloader",
+}
+
+
+def setUpModule() -> None:
+    # The file inventory is kept in a temporary database instead of next to the real download folder
+    folder = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(folder.cleanup)
+    for name, value in [
+        ("database", os.path.join(folder.name, "file_inventory.sqlite3")),
+        ("local", threading.local()),
+        ("_complete", False),
+    ]:
+        patcher = mock.patch.object(FILE_INVENTORY, name, value)
+        patcher.start()
+        unittest.addModuleCleanup(patcher.stop)
+
+
+class WebColdStartTests(SimpleTestCase):
+    # About 0.4s when this was written, model definitions using stack inspection took it over a second
+    IMPORT_BUDGET_SECONDS = 0.8
+
+    def test_web_does_not_import_scraping_stack(self) -> None:
+        self.assertFalse(imported_modules(STATEMENTS["web"]) & SCRAPING_MODULES)
+
+    def test_web_import_time_within_budget(self) -> None:
+        # The fastest of a few runs so a busy machine does not fail the test
+        fastest = min(total_import_time(STATEMENTS["web"]) for _ in range(3))
+        self.assertLess(fastest, self.IMPORT_BUDGET_SECONDS)
+
+
+def resident_memory() -> int:
+    """Bytes of memory the process is using right now, only available on Linux"""
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class InstanceCacheTests(TestCase):
+    IMPORTS = 10_000
+    # Stands in for the parsed json and other data an import keeps on the instance
+    PAYLOAD_BYTES = 16 * 1024
+    # Every instance being kept would be about 160MB
+    GROWTH_BUDGET_BYTES = 20 * 1024 * 1024
+
+    def simulate_import(self, media_id: int) -> MyAnimeListAnime:
+        media = MyAnimeListAnime(media_id, False, db_object=Anime(id=media_id))
+        media.json_url()
+        media.json_file_path()
+        media.userrecs_html_url()
+        media.userrecs_html_file_path()
+        media.payload = bytearray(self.PAYLOAD_BYTES)  # type: ignore - Only used to take up memory
+        return media
+
+    def test_results_are_cached_per_instance(self) -> None:
+        media = self.simulate_import(1)
+        self.assertIs(media.json_file_path(), media.json_file_path())
+        self.assertIsNot(media.json_file_path(), self.simulate_import(1).json_file_path())
+
+    def test_instances_are_released(self) -> None:
+        media = weakref.ref(self.simulate_import(1))
+        user = MyAnimeListUser("instance_cache_test")
+        user.anime_json_path(0)
+        user.changes_json_path("manga", 1000)
+        user = weakref.ref(user)
+        gc.collect()
+        self.assertIsNone(media())
+        self.assertIsNone(user())
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "Resident memory is read from /proc")
+    def test_memory_is_flat_over_many_imports(self) -> None:
+        # Warm up first so memory used by imports and allocator pools is not counted
+        for media_id in range(1, 1001):
+            self.simulate_import(media_id)
+        gc.collect()
+        start = resident_memory()
+        for media_id in range(1001, self.IMPORTS + 1001):
+            self.simulate_import(media_id)
+        gc.collect()
+        self.assertLess(resident_memory() - start, self.GROWTH_BUDGET_BYTES)
+
+
+# The views run their database work on other threads which can't see the transaction a TestCase never commits
+class ImportStatusPageTests(TransactionTestCase):
+    FORM = {
+        "anime_or_manga": "anime",
+        "minimum_recs": 1,
+        "ignore_recs_over": 100,
+        "number_of_results": 100,
+    }
+
+    def get_page(self, username: str) -> Any:
+        return self.client.get("/recommendations", {"username": username, **self.FORM})
+
+    def get_status(self, username: str, page: Any) -> dict[str, Any]:
+        return self.client.get(f"/import_status/{username}", {"since": page.context["progress_since"]}).json()
+
+    def test_up_to_date_user_is_not_polled(self) -> None:
+        now = timezone.now()
+        User.objects.create(
+            name="uptodate",
+            anime_count=0,
+            anime_list_private=False,
+            manga_list_private=False,
+            info_timestamp=now - timedelta(days=1),
+            info_modified_timestamp=now - timedelta(days=1),
+        )
+        page = self.get_page("uptodate")
+        self.assertFalse(page.context["importing"])
+        self.assertNotContains(page, 'poll_import_status("')
+        self.assertFalse(ImportQue.objects.exists())
+        self.assertTrue(self.get_status("uptodate", page)["done"])
+
+    def test_new_user_is_queued_and_polled(self) -> None:
+        page = self.get_page("newuser")
+        self.assertTrue(page.context["importing"])
+        self.assertContains(page, 'poll_import_status("/import_status/newuser')
+        self.assertEqual(ImportQue.objects.get(type="user", key="newuser").lane, ImportQue.LANE_INTERACTIVE)
+        status = self.get_status("newuser", page)
+        self.assertTrue(status["queued"])
+        self.assertFalse(status["done"])
+
+        # Once the importer is finished with the user the page reloads
+        ImportQue.objects.filter(type="user", key="newuser").delete()
+        self.assertTrue(self.get_status("newuser", page)["done"])
+
+    def test_scheduled_user_is_moved_to_the_interactive_lane(self) -> None:
+        ImportQue.objects.create(
+            type="user", key="scheduled", minimum_info_timestamp=timezone.now() + timedelta(days=30), note="Yearly"
+        )
+        page = self.get_page("scheduled")
+        self.assertTrue(page.context["importing"])
+        entry = ImportQue.objects.get(type="user", key="scheduled")
+        self.assertEqual(entry.lane, ImportQue.LANE_INTERACTIVE)
+        self.assertIn(entry, due_entries())
+
+
+class NegativeCacheTests(TestCase):
+    def failed_import(self, status: int, imported: bool) -> Optional[ImportQue]:
+        now = timezone.now()
+        ImportQue.objects.create(type="anime", key="1", minimum_info_timestamp=now, note="User list: someone", lane=1)
+        expires_at = NegativeCache.objects.create(
+            type="anime", key="1", status=status, reason="error", expires_at=now + timedelta(days=1)
+        ).expires_at
+        media = MyAnimeListAnime(1, False, db_object=Anime(id=1, info_timestamp=now if imported else None))
+        media.apply()
+        entry = ImportQue.objects.filter(type="anime", key="1").first()
+        if entry is not None:
+            self.assertEqual(entry.minimum_info_timestamp, expires_at)
+        return entry
+
+    def test_imported_entry_is_retried_after_error(self) -> None:
+        entry = self.failed_import(503, imported=True)
+        assert entry is not None and entry.note is not None
+        self.assertEqual(entry.lane, ImportQue.LANE_BACKGROUND)
+        self.assertTrue(entry.note.startswith("Retry after error: 503"))
+
+    def test_new_entry_is_retried_after_server_error(self) -> None:
+        self.assertIsNotNone(self.failed_import(503, imported=False))
+
+    def test_missing_new_entry_is_removed(self) -> None:
+        self.assertIsNone(self.failed_import(404, imported=False))
+
+    def test_sparse_entry_is_not_queued(self) -> None:
+        NegativeCache.objects.create(
+            type="anime", key="1", status=503, reason="error", expires_at=timezone.now() + timedelta(days=1)
+        )
+        MyAnimeListAnime(1, True, db_object=Anime(id=1)).apply()
+        self.assertFalse(ImportQue.objects.exists())
+
+
+def anime_json(media_id: int, **changes: Any) -> dict[str, Any]:
+    """The smallest API response an anime can be imported from"""
+    return {
+        "id": media_id,
+        "title": f"Anime {media_id}",
+        "main_picture": None,
+        "alternative_titles": {"synonyms": [], "en": "", "ja": ""},
+        "start_date": "2015-04-01",
+        "end_date": None,
+        "synopsis": "",
+        "mean": 7.5,
+        "rank": 100,
+        "popularity": 100,
+        "num_list_users": 1000,
+        "num_scoring_users": 500,
+        "nsfw": "white",
+        "genres": [],
+        "created_at": "2015-01-01T00:00:00+00:00",
+        "updated_at": "2020-01-01T00:00:00+00:00",
+        "pictures": [],
+        "background": "",
+        "recommendations": [],
+        "media_type": "tv",
+        "status": "finished_airing",
+        "num_episodes": 12,
+        "start_season": None,
+        "source": None,
+        "average_episode_duration": None,
+        "rating": None,
+        "studios": [],
+        "related_anime": [],
+        "statistics": {
+            "status": {"watching": 1, "completed": 2, "on_hold": 3, "dropped": 4, "plan_to_watch": 5},
+            "num_list_users": 15,
+        },
+        **changes,
+    }
+
+
+class DownloadedFilesTestCase(TestCase):
+    """Downloaded files are written to a temporary folder instead of the real download folder"""
+
+    def setUp(self) -> None:
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.downloaded_files = ExtendedPath(folder.name)
+        for module in ["common.myanimelist_media", "common.myanimelist_user"]:
+            patcher = mock.patch(f"{module}.DOWNLOADED_FILES_DIR", self.downloaded_files)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class UnchangedImportTests(DownloadedFilesTestCase):
+    def import_anime(self, **changes: Any) -> Anime:
+        (self.downloaded_files / "v2" / "anime" / "1.json").write_json(anime_json(1, **changes))
+        MyAnimeListAnime(1, False).update(minimum_info_timestamp=timezone.now())
+        return Anime.objects.get(id=1)
+
+    def test_unchanged_download_only_updates_volatile_fields(self) -> None:
+        first = self.import_anime()
+        unchanged = self.import_anime(
+            popularity=50, mean=8.0, statistics=anime_json(1)["statistics"] | {"num_list_users": 20}
+        )
+        self.assertEqual(unchanged.content_fingerprint, first.content_fingerprint)
+        self.assertEqual(unchanged.unchanged_fetches, 1)
+        self.assertEqual((unchanged.popularity, unchanged.mean, unchanged.statistics_num_list_users), (50, 8.0, 20))
+        self.assertGreaterEqual(unchanged.info_timestamp, first.info_timestamp)  # type: ignore - Set by the import
+
+    def test_changed_download_resets_unchanged_fetches(self) -> None:
+        first = self.import_anime()
+        self.import_anime(popularity=50)
+        changed = self.import_anime(title="New title")
+        self.assertNotEqual(changed.content_fingerprint, first.content_fingerprint)
+        self.assertEqual(changed.unchanged_fetches, 0)
+        self.assertEqual(changed.title, "New title")
+
+
+class QueueEarlierTests(TestCase):
+    def test_existing_rows_are_only_moved_earlier(self) -> None:
+        now = timezone.now()
+        ImportQue.objects.create(
+            type="anime",
+            key="1",
+            minimum_info_timestamp=now,
+            minimum_modified_timestamp=now,
+            note="User list: someone",
+            lane=ImportQue.LANE_USER_MEDIA,
+        )
+        ImportQue.objects.create(type="anime", key="2", minimum_info_timestamp=now, note="Yearly update")
+        changed = bulk_queue_earlier(
+            [
+                ImportQue(type="anime", key="1", minimum_info_timestamp=now - timedelta(hours=1), note="Relationships"),
+                ImportQue(type="anime", key="2", minimum_info_timestamp=now + timedelta(days=1), note="Relationships"),
+                ImportQue(type="anime", key="3", minimum_info_timestamp=now, note="Relationships"),
+            ]
+        )
+        self.assertEqual(changed, 2)
+
+        moved = ImportQue.objects.get(key="1")
+        self.assertEqual(moved.minimum_info_timestamp, now - timedelta(hours=1))
+        self.assertEqual(
+            (moved.minimum_modified_timestamp, moved.note, moved.lane),
+            (now, "User list: someone", ImportQue.LANE_USER_MEDIA),
+        )
+        self.assertEqual(ImportQue.objects.get(key="2").minimum_info_timestamp, now)
+        self.assertEqual(ImportQue.objects.get(key="3").note, "Relationships")
+
+
+class DailyBudgetTests(TestCase):
+    @override_settings(IMPORTER_DAILY_UPDATE_BUDGET=2)
+    def test_background_updates_are_moved_to_a_day_under_the_budget(self) -> None:
+        # Noon in local time so moving the update can't change the day by crossing midnight
+        due = datetime.combine(datetime.now().date() + timedelta(days=10), time(12)).astimezone()
+        ImportQue.objects.create(type="anime", key="1", minimum_info_timestamp=due, note="Yearly update")
+        ImportQue.objects.create(type="anime", key="2", minimum_info_timestamp=due, note="Yearly update")
+        # Only scheduled updates count towards the budget
+        ImportQue.objects.create(type="anime", key="3", minimum_info_timestamp=due, note="User list: someone")
+        bulk_upsert(
+            [
+                ImportQue(type="anime", key=x, minimum_info_timestamp=due, note=note)
+                for x, note in (("1", "Yearly update"), ("4", "Monthly update"), ("5", "Relationships"))
+            ]
+        )
+
+        scheduled = dict(ImportQue.objects.values_list("key", "minimum_info_timestamp"))
+        # Rescheduling an entry does not count its old schedule
+        self.assertEqual(scheduled["1"], due)
+        self.assertEqual(scheduled["4"], due + timedelta(days=1))
+        self.assertEqual(scheduled["5"], due)
+
+
+class ConcurrencyLimitTests(SimpleTestCase):
+    def test_limit_is_shared_between_threads_and_event_loops(self) -> None:
+        started = threading.Event()
+        finish = threading.Event()
+
+        @limit_concurrency
+        async def view(request: Any) -> HttpResponse:
+            started.set()
+            # Block this thread's event loop like a slow request does
+            finish.wait(timeout=10)
+            return HttpResponse("ok")
+
+        responses: list[HttpResponse] = []
+        with mock.patch("main.views.REQUEST_LIMIT", threading.BoundedSemaphore(1)):
+            # Each WSGI request runs on its own thread with its own event loop
+            slow = threading.Thread(target=lambda: responses.append(asyncio.run(view(None))))
+            slow.start()
+            self.assertTrue(started.wait(timeout=10))
+            self.assertEqual(asyncio.run(view(None)).status_code, 503)
+            finish.set()
+            slow.join()
+            self.assertEqual(responses[0].status_code, 200)
+            self.assertEqual(asyncio.run(view(None)).status_code, 200)
+
+
+class MetricTests(SimpleTestCase):
+    def test_metrics_must_render_their_samples(self) -> None:
+        class Unrendered(Metric):
+            TYPE = "gauge"
+
+        with self.assertRaises(TypeError):
+            Unrendered("mwl_test_unrendered", "A metric without samples")  # type: ignore - Checking it is abstract
+
+
+class ReadSnapshotTests(SimpleTestCase):
+    def test_snapshot_is_a_readable_consistent_copy(self) -> None:
+        with tempfile.TemporaryDirectory() as folder:
+            source = ExtendedPath(folder, "primary.sqlite3")
+            primary = sqlite3.connect(source, isolation_level=None)
+            # Committed rows that are still only in the WAL have to be copied as well
+            primary.execute("PRAGMA journal_mode = wal")
+            primary.execute("PRAGMA wal_autocheckpoint = 0")
+            primary.execute("CREATE TABLE entries (id INTEGER PRIMARY KEY, value TEXT)")
+            primary.executemany("INSERT INTO entries (value) VALUES (?)", [(str(x),) for x in range(1000)])
+            # Rows from a transaction that is still open must not be copied
+            primary.execute("BEGIN")
+            primary.execute("INSERT INTO entries (value) VALUES ('uncommitted')")
+
+            path = publish_snapshot(ExtendedPath(folder, "snapshot.sqlite3"), source)
+            primary.execute("ROLLBACK")
+            primary.close()
+
+            # Opened the same way web processes open it
+            snapshot = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+            try:
+                self.assertEqual(snapshot.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+                self.assertEqual(snapshot.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+                self.assertEqual(snapshot.execute("SELECT COUNT(*), MAX(id) FROM entries").fetchone(), (1000, 1000))
+            finally:
+                snapshot.close()
+            self.assertFalse(os.path.exists(f"{path}-wal"))
+
+
+def create_anime(media_id: int) -> Anime:
+    now = timezone.now()
+    return Anime.objects.create(
+        id=media_id,
+        title=f"Anime {media_id}",
+        alternative_titles_en="",
+        alternative_titles_ja="",
+        main_picture_medium="",
+        num_list_users=0,
+        num_scoring_users=0,
+        nsfw="white",
+        created_at=now,
+        updated_at=now,
+        media_type="tv",
+        status="finished_airing",
+        sparse=False,
+        num_episodes=12,
+        broadcast_day_of_the_week="",
+        info_timestamp=now,
+        info_modified_timestamp=now,
+    )
+
+
+class RecommendationSqlTests(TestCase):
+    """The ranking has to be the same on every supported database, run with MWL_DATABASE_ENGINE=postgresql as well"""
+
+    FORM = {
+        "anime_or_manga": "anime",
+        "use_watching": "on",
+        "use_completed": "on",
+        "use_on_hold": "on",
+        "use_dropped": "on",
+        "use_plan_to_watch": "on",
+        "do_not_return_not_on_list": "on",
+        "minimum_recs": 1,
+        "ignore_recs_over": 100,
+        "number_of_results": 100,
+    }
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        now = timezone.now()
+        cls.user = User.objects.create(
+            name="ranked",
+            anime_list_private=False,
+            manga_list_private=False,
+            average_anime_score=7.5,
+            info_timestamp=now,
+            info_modified_timestamp=now,
+        )
+        anime = {x: create_anime(x) for x in (1, 2, 3, 10, 11, 12)}
+        # Status 1 is watching, 2 is completed and 4 is dropped
+        for media_id, status, score in ((1, 2, 8), (2, 1, 0), (3, 4, 4)):
+            UserAnime.objects.create(
+                user=cls.user, media=anime[media_id], status=status, score=score, updated_at=now, is_rewatching=False
+            )
+        # 3 -> 11 is over ignore_recs_over so it counts as 100, 1 -> 3 is on the user's list as dropped
+        for media_id, recommended_media_id, recommendations in (
+            (1, 10, 5),
+            (2, 10, 3),
+            (1, 11, 7),
+            (3, 11, 150),
+            (2, 12, 2),
+            (1, 3, 4),
+        ):
+            AnimeRecs.objects.create(
+                media=anime[media_id], recommended_media=anime[recommended_media_id], recommendations=recommendations
+            )
+
+    def ranked(self, dialect: Optional[SqlDialect] = None, **changes: Any) -> list[tuple[Any, ...]]:
+        """Recommended id, score, status and the sorted ids of the media that recommended it for every result"""
+        form = NameForm({"username": self.user.name, **self.FORM, **changes})
+        self.assertTrue(form.is_valid(), form.errors)
+        with connection.cursor() as cursor:
+            cursor.execute(recommendation_sql(form, MyAnimeListUser(self.user.name), dialect))
+            rows = cursor.fetchall()
+        return [
+            (media_id, score, status, sorted(int(x) for x in rec_ids.split("\x1f")))
+            for media_id, score, status, rec_ids, _ in rows
+        ]
+
+    def assert_rankings(self, dialect: Optional[SqlDialect] = None) -> None:
+        self.assertEqual(
+            self.ranked(dialect),
+            [(11, 107, None, [1, 3]), (10, 8, None, [1, 2]), (12, 2, None, [2])],
+        )
+        # Unscored entries use the user's average score
+        self.assertEqual(
+            self.ranked(dialect, score_compensation="on"),
+            [(11, 156, None, [1, 3]), (10, 62.5, None, [1, 2]), (12, 15, None, [2])],
+        )
+        self.assertEqual(
+            self.ranked(dialect, do_not_return_dropped="on"),
+            [(11, 107, None, [1, 3]), (10, 8, None, [1, 2]), (3, 4, 4, [1]), (12, 2, None, [2])],
+        )
+        self.assertEqual(self.ranked(dialect, minimum_recs=4), [(11, 107, None, [1, 3]), (10, 5, None, [1])])
+
+    def test_ranking(self) -> None:
+        self.assert_rankings()
+
+    def test_dialects_must_join_groups(self) -> None:
+        with self.assertRaises(TypeError):
+            SqlDialect()  # type: ignore - Checking it is abstract
+
+    @unittest.skipUnless(connection.vendor == "sqlite", "Only runs on SQLite")
+    def test_ranking_on_sqlite(self) -> None:
+        self.assertIsInstance(dialect_for(), SQLiteDialect)
+        self.assert_rankings(SQLiteDialect())
+
+    @unittest.skipUnless(os.environ.get("MWL_DATABASE_ENGINE") == "postgresql", "MWL_DATABASE_ENGINE is not postgresql")
+    def test_ranking_on_postgresql(self) -> None:
+        self.assertIsInstance(dialect_for(), PostgreSQLDialect)
+        self.assert_rankings(PostgreSQLDialect())
+
+
+def list_entry(media_id: int, score: int, updated_at: str) -> dict[str, Any]:
+    list_status = {"status": "completed", "score": score, "num_episodes_watched": 12, "is_rewatching": False}
+    return {"node": {"id": media_id}, "list_status": list_status | {"updated_at": updated_at}}
+
+
+class StubApiImportTests(DownloadedFilesTestCase):
+    """Imports a user's lists from the stub_mal_api command instead of MyAnimeList"""
+
+    LAST_IMPORT = datetime(2021, 1, 1, tzinfo=dt_timezone.utc)
+
+    def setUp(self) -> None:
+        super().setUp()
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.fixtures = ExtendedPath(folder.name)
+        # Anime 1 has not changed since the last import so incremental imports never see its new score
+        (self.fixtures / "users" / "tester" / "animelist.json").write_json(
+            [
+                list_entry(1, 7, "2020-01-01T00:00:00+00:00"),
+                list_entry(2, 9, "2022-01-01T00:00:00+00:00"),
+                list_entry(3, 0, "2022-01-02T00:00:00+00:00"),
+            ]
+        )
+
+        handler = type("Handler", (StubHandler,), {"fixtures": self.fixtures, "log_message": lambda *args: None})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        patcher = mock.patch.object(MyAnimeListUser, "API_DOMAIN", f"http://127.0.0.1:{server.server_port}")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        anime = {x: create_anime(x) for x in (1, 2, 3)}
+        now = timezone.now()
+        self.user = User.objects.create(
+            name="tester",
+            anime_list_private=False,
+            manga_list_private=False,
+            info_timestamp=self.LAST_IMPORT,
+            info_modified_timestamp=self.LAST_IMPORT,
+            last_successful_anime_list_import=self.LAST_IMPORT,
+            last_successful_manga_list_import=self.LAST_IMPORT,
+            last_full_anime_list_import=now,
+            last_full_manga_list_import=now,
+        )
+        UserAnime.objects.create(
+            user=self.user, media=anime[1], status=2, score=5, updated_at=self.LAST_IMPORT, is_rewatching=False
+        )
+        ImportQue.objects.create(type="user", key="tester")
+
+    def import_user(self) -> MyAnimeListUser:
+        user = MyAnimeListUser("tester")
+        user.import_all(minimum_info_timestamp=timezone.now())
+        return user
+
+    def scores(self) -> dict[int, int]:
+        return dict(UserAnime.objects.filter(user=self.user).values_list("media_id", "score"))
+
+    def test_incremental_import_merges_changes(self) -> None:
+        (self.fixtures / "users" / "tester" / "mangalist.json").write_json([])
+        self.import_user()
+
+        self.assertEqual(self.scores(), {1: 5, 2: 9, 3: 0})
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual((user.anime_count, user.average_anime_score), (3, 7))
+        self.assertGreater(user.last_successful_anime_list_import, self.LAST_IMPORT)  # type: ignore - Set by the import
+        self.assertEqual(user.last_full_anime_list_import, self.user.last_full_anime_list_import)
+        self.assertFalse(ImportQue.objects.filter(type="user", key="tester").exists())
+
+    def test_list_error_falls_back_to_full_import(self) -> None:
+        # There is no manga list so the stub returns an error like it does for private lists
+        self.import_user()
+
+        self.assertEqual(self.scores(), {1: 7, 2: 9, 3: 0})
+        user = User.objects.get(id=self.user.id)
+        self.assertTrue(user.manga_list_private)
+        self.assertGreater(user.last_full_anime_list_import, self.user.last_full_anime_list_import)  # type: ignore
+        self.assertFalse(ImportQue.objects.filter(type="user", key="tester").exists())
+
+    def test_old_full_import_falls_back_to_full_import(self) -> None:
+        (self.fixtures / "users" / "tester" / "mangalist.json").write_json([])
+        last_full_import = timezone.now() - MyAnimeListUser.FULL_IMPORT_INTERVAL - timedelta(days=1)
+        User.objects.filter(id=self.user.id).update(last_full_anime_list_import=last_full_import)
+        self.import_user()
+
+        # A full import sees the new score of the entry that did not change since the last import
+        self.assertEqual(self.scores(), {1: 7, 2: 9, 3: 0})
+        self.assertGreater(User.objects.get(id=self.user.id).last_full_anime_list_import, last_full_import)
+
+    def test_unsaved_entries_are_counted_and_retried_with_a_full_import(self) -> None:
+        (self.fixtures / "users" / "tester" / "mangalist.json").write_json([])
+        # Anime 4 has not been imported so its entry can't be saved yet
+        entries = json.loads((self.fixtures / "users" / "tester" / "animelist.json").read_bytes())
+        (self.fixtures / "users" / "tester" / "animelist.json").write_json(
+            entries + [list_entry(4, 6, "2022-01-03T00:00:00+00:00")]
+        )
+        self.import_user()
+
+        self.assertEqual(self.scores(), {1: 5, 2: 9, 3: 0})
+        self.assertEqual(User.objects.get(id=self.user.id).anime_count, 4)
+        self.assertTrue(ImportQue.objects.filter(type="anime", key="4").exists())
+        # The missing entry is only saved by a full import once its media is imported
+        self.assertFalse(MyAnimeListUser("tester").incremental_import_possible())
+
+
+class FileInventoryTests(SimpleTestCase):
+    def setUp(self) -> None:
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.root = ExtendedPath(folder.name) / "files"
+        self.inventory = FileInventory(self.root, os.path.join(folder.name, "inventory.sqlite3"))
+        patcher = mock.patch.object(file_inventory, "INVENTORIES", [self.inventory])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_writes_are_recorded_and_deletes_are_forgotten(self) -> None:
+        path = self.root / "users" / "someone" / "animelist-offset=0.json"
+        path.write("{}")
+        entry = file_inventory.lookup(path)
+        assert entry is not None
+        self.assertEqual((entry.size, entry.hash), (2, content_hash(b"{}")))
+        # A file whose name starts with the folder's name is not inside the folder
+        (self.root / "users" / "someone.json").write("[]")
+
+        (self.root / "users" / "someone").delete()
+        self.inventory.rebuild()
+        self.assertIsNone(self.inventory.entry("users/someone/animelist-offset=0.json"))
+        self.assertIsNotNone(self.inventory.entry("users/someone.json"))
+
+    def test_files_are_found_with_stat_until_the_first_rebuild(self) -> None:
+        (self.root / "old.json").write("{}")
+        self.inventory.forget("old.json")
+        entry = self.inventory.entry("old.json")
+        assert entry is not None
+        self.assertIsNone(entry.hash)
+
+        # After a rebuild the index is trusted, files changed without ExtendedPath need another rebuild
+        self.assertEqual(self.inventory.rebuild(), (1, 1, 0))
+        with open(self.root / "untracked.json", "w") as file:
+            file.write("{}")
+        self.assertIsNone(self.inventory.entry("untracked.json"))
+        self.assertIsNotNone(self.inventory.entry("old.json"))
+
+    def test_count_modified_since_only_counts_the_folder(self) -> None:
+        since = timezone.now()
+        old = int((since - timedelta(days=1)).timestamp() * 1_000_000_000)
+        new = int((since + timedelta(seconds=1)).timestamp() * 1_000_000_000)
+        for key, mtime_ns in [
+            ("users/a/1.json", new),
+            ("users/a/2.json", new),
+            ("users/a/3.json", old),
+            ("users/a/4.html", new),
+            ("users/a/nested/5.json", new),
+            ("users/ab/6.json", new),
+        ]:
+            self.inventory.record(key, FileEntry(mtime_ns, 2, None))
+
+        self.assertEqual(self.inventory.count_modified_since(self.root / "users" / "a", since, ".json"), 2)
+        self.assertEqual(self.inventory.count_modified_since(self.root / "users" / "a", since), 3)
+        with self.assertRaises(ValueError):
+            self.inventory.count_modified_since(self.root.parent, since)
+
+
+class FakeMedia:
+    """Stands in for MyAnimeListMedia in the import pipeline and records which stage handled it in which thread"""
+
+    MEDIA_TYPE = "anime"
+    sparse_import = False
+
+    def __init__(self, media_id: int, events: list[tuple[str, int, str]], fail_in: str = "") -> None:
+        self.media_id = media_id
+        self.events = events
+        self.fail_in = fail_in
+
+    def event(self, stage: str) -> None:
+        if stage == self.fail_in:
+            raise RuntimeError(f"{stage} failed for {self.media_id}")
+        self.events.append((stage, self.media_id, threading.current_thread().name))
+
+    def needs_import(self, *args: Any) -> bool:
+        return True
+
+    def prefetch(self, *args: Any) -> list[Any]:
+        self.event("fetch")
+        return []
+
+    def json_file_is_valid(self) -> bool:
+        return True
+
+    def json_file_parsed(self) -> None:
+        self.event("parse")
+
+    def userrecs_on_html(self) -> bool:
+        return False
+
+    def apply(self, *args: Any, **kwargs: Any) -> None:
+        self.event("apply")
+
+    def import_que_entry(self) -> None:
+        return None
+
+    def negative_cache_entry(self) -> None:
+        return None
+
+
+class ImportPipelineTests(TestCase):
+    def run_pipeline(self, count: int, fail_in: str = "", fail_id: int = -1) -> list[tuple[str, int, str]]:
+        events: list[tuple[str, int, str]] = []
+        jobs = [
+            ImportJob(FakeMedia(x, events, fail_in if x == fail_id else ""))  # type: ignore - Only the used methods
+            for x in range(count)
+        ]
+        ImportPipeline(batch_size=2, queue_size=1).run(jobs)
+        return events
+
+    def test_every_entry_goes_through_the_stages_in_order(self) -> None:
+        with mock.patch.object(
+            ImportPipeline, "apply_batch", autospec=True, side_effect=ImportPipeline.apply_batch
+        ) as apply_batch:
+            events = self.run_pipeline(5)
+
+        for media_id in range(5):
+            stages = [stage for stage, x, _ in events if x == media_id]
+            self.assertEqual(stages, ["fetch", "parse", "apply"])
+        self.assertEqual([x for stage, x, _ in events if stage == "apply"], [0, 1, 2, 3, 4])
+        self.assertEqual([len(call.args[1]) for call in apply_batch.call_args_list], [2, 2, 1])
+        # Only the apply stage runs in the calling thread so database writes use its connection
+        threads = {stage: {thread for x, _, thread in events if x == stage} for stage in ("fetch", "parse", "apply")}
+        self.assertEqual(threads["apply"], {threading.current_thread().name})
+        self.assertTrue(threads["fetch"].isdisjoint(threads["apply"]))
+        self.assertTrue(threads["parse"].isdisjoint(threads["apply"]))
+
+    def test_fetch_errors_are_raised_and_stop_the_pipeline(self) -> None:
+        with self.assertRaisesRegex(RuntimeError, "fetch failed for 2"):
+            self.run_pipeline(10, fail_in="fetch", fail_id=2)
+
+    def test_apply_errors_are_raised_and_stop_fetching(self) -> None:
+        events: list[tuple[str, int, str]] = []
+        jobs = [ImportJob(FakeMedia(x, events, "apply" if x == 0 else "")) for x in range(100)]  # type: ignore
+        with self.assertRaisesRegex(RuntimeError, "apply failed for 0"):
+            ImportPipeline(batch_size=1, queue_size=1).run(jobs)
+        self.assertLess(len([x for x in events if x[0] == "fetch"]), 100)
+
+
+class DownloadErrorTests(DownloadedFilesTestCase):
+    @mock.patch("common.myanimelist_media.time")
+    @mock.patch("common.myanimelist_media.download", return_value=(404, b'{"error": "not_found"}'))
+    def test_fetch_stage_leaves_negative_cache_writes_to_the_apply_stage(self, *mocks: Any) -> None:
+        pipeline = ImportPipeline()
+        fetched: queue.Queue[Any] = queue.Queue()
+
+        pipeline.fetch_stage([ImportJob(MyAnimeListAnime(1, False))], fetched)
+        self.assertFalse(NegativeCache.objects.exists())
+        pipeline.apply_batch([fetched.get()])
+        self.assertEqual(NegativeCache.objects.get(type="anime", key="1").status, 404)
+
+        # Downloads skipped because of the error are counted by the apply stage as well
+        pipeline.fetch_stage([ImportJob(MyAnimeListAnime(1, False))], fetched)
+        self.assertEqual(NegativeCache.objects.get(type="anime", key="1").fetches_avoided, 0)
+        pipeline.apply_batch([fetched.get()])
+        self.assertEqual(NegativeCache.objects.get(type="anime", key="1").fetches_avoided, 1)
+
+
+def userrecs_html(recommendations: dict[int, int]) -> str:
+    """The parts of a userrecs.html page that are parsed, one row for every recommended entry"""
+    rows = "".join(
+        f"""<tr><td><div class='picSurround'><a href="https://myanimelist.net/anime/{media_id}/Title">x</a></div></td>
+        <td>{"<div class='spaceit_pad detail-user-recs-text'>Because</div>" * count}</td></tr>"""
+        for media_id, count in recommendations.items()
+    )
+    return f"<html><body><table>{rows}</table></body></html>"
+
+
+class UserrecsSidecarTests(SimpleTestCase):
+    def setUp(self) -> None:
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.html_path = ExtendedPath(folder.name) / "anime" / "1" / "userrecs.html"
+        self.html_path.write(userrecs_html({5: 2, 6: 1}))
+
+    def parse(self, expect_html_parsed: bool) -> list[tuple[int, int]]:
+        with mock.patch.object(
+            ExtendedPath, "parsed_html", autospec=True, side_effect=ExtendedPath.parsed_html
+        ) as html:
+            recommendations = MyAnimeListAnime.parse_userrecs_html(self.html_path)
+        self.assertEqual(html.called, expect_html_parsed)
+        return recommendations
+
+    def test_sidecar_is_written_and_used_while_the_html_is_unchanged(self) -> None:
+        self.assertEqual(self.parse(expect_html_parsed=True), [(5, 2), (6, 1)])
+        sidecar = json.loads(self.html_path.with_suffix(".json").read_bytes())
+        self.assertEqual(
+            (sidecar["version"], sidecar["size"]),
+            (MyAnimeListAnime.USERRECS_SIDECAR_VERSION, self.html_path.stat().st_size),
+        )
+        self.assertEqual(self.parse(expect_html_parsed=False), [(5, 2), (6, 1)])
+
+    def test_changed_html_is_parsed_again(self) -> None:
+        self.parse(expect_html_parsed=True)
+        self.html_path.write(userrecs_html({7: 3}))
+        self.assertEqual(self.parse(expect_html_parsed=True), [(7, 3)])
+        self.assertEqual(self.parse(expect_html_parsed=False), [(7, 3)])
+
+    def test_new_sidecar_version_is_parsed_again(self) -> None:
+        self.parse(expect_html_parsed=True)
+        with mock.patch.object(
+            MyAnimeListAnime, "USERRECS_SIDECAR_VERSION", MyAnimeListAnime.USERRECS_SIDECAR_VERSION + 1
+        ):
+            self.assertEqual(self.parse(expect_html_parsed=True), [(5, 2), (6, 1)])
+
+
+class RebuildMediaTests(DownloadedFilesTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for name, value in [
+            ("DOWNLOADED_FILES_DIR", self.downloaded_files),
+            ("PROGRESS_FILE", self.downloaded_files / "rebuild_media_progress.txt"),
+        ]:
+            patcher = mock.patch.object(rebuild_media, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        node = {"id": 2, "title": "Anime 2", "main_picture": None}
+        folder = self.downloaded_files / "v2" / "anime"
+        folder.joinpath("1.json").write_json(
+            anime_json(
+                1,
+                recommendations=[{"node": node, "num_recommendations": 3}],
+                related_anime=[{"node": node, "relation_type": "sequel", "relation_type_formatted": "Sequel"}],
+            )
+        )
+        folder.joinpath("2.json").write_json(anime_json(2, title="Rebuilt"))
+        folder.joinpath("3.json").write_json({"error": "not_found"})
+
+    def rebuild(self, *args: str) -> None:
+        call_command("rebuild_media", "--workers", "1", *args, stdout=io.StringIO())
+
+    def test_entries_are_rebuilt_from_the_downloaded_files(self) -> None:
+        create_anime(2)
+        self.rebuild()
+        self.assertEqual(
+            list(Anime.objects.order_by("id").values_list("id", "title")), [(1, "Anime 1"), (2, "Rebuilt")]
+        )
+        self.assertEqual(
+            list(AnimeRecs.objects.values_list("media_id", "recommended_media_id", "recommendations")), [(1, 2, 3)]
+        )
+        self.assertEqual(list(AnimeRelatedAnime.objects.values_list("media_id", "related_media_id")), [(1, 2)])
+        self.assertFalse(rebuild_media.PROGRESS_FILE.exists())
+
+    def test_interrupted_rebuild_is_resumed(self) -> None:
+        rebuild_media.PROGRESS_FILE.write_text("anime 1\n")
+        self.rebuild()
+        self.assertEqual(list(Anime.objects.values_list("id", flat=True)), [2])
+
+        rebuild_media.PROGRESS_FILE.write_text("anime 1\n")
+        self.rebuild("--fresh")
+        self.assertEqual(list(Anime.objects.order_by("id").values_list("id", flat=True)), [1, 2])
+
+
+class UserListColumnsTests(DownloadedFilesTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        now = timezone.now()
+        User.objects.create(
+            name="tester",
+            anime_list_private=False,
+            manga_list_private=False,
+            info_timestamp=now,
+            info_modified_timestamp=now,
+        )
+        self.user = MyAnimeListUser("tester")
+        create_anime(1)
+        Anime.objects.filter(id=create_anime(2).id).update(sparse=True)
+
+        updated_at = "2022-01-01T00:00:00+00:00"
+        pages = [[list_entry(1, 8, updated_at), list_entry(2, 0, updated_at)], [list_entry(3, 6, updated_at)]]
+        for offset, page in zip((0, 1000), pages):
+            paging = {"next": "more"} if offset == 0 else {}
+            self.user.lazy_json_path("anime", offset).write_json({"data": page, "paging": paging})
+        # Left over from when the list was longer, it comes after the last page so it is not read
+        self.user.lazy_json_path("anime", 2000).write_json({"data": [list_entry(4, 10, updated_at)], "paging": {}})
+
+    def test_pages_are_read_into_columns(self) -> None:
+        columns = self.user.read_user_list("anime")
+        self.assertEqual(list(columns.media_ids), [1, 2, 3])
+        self.assertEqual(list(columns.statuses), [2, 2, 2])
+        self.assertEqual(list(columns.scores), [8, 0, 6])
+        self.assertEqual(list(columns.progress), [12, 12, 12])
+        # Entries without a score are left out of the average
+        self.assertEqual(columns.average_score(), 7)
+        self.assertEqual(self.user.existing_medias("anime", columns.media_ids), ({1}, {2}))
+
+    def test_entries_are_saved_or_queued_based_on_the_imported_media(self) -> None:
+        columns = self.user.update_single_user_list("anime", UserAnime)
+        # Sparse entries are saved and queued, entries that have not been imported are only queued
+        self.assertEqual(
+            dict(UserAnime.objects.filter(user=self.user.model).values_list("media_id", "score")), {1: 8, 2: 0}
+        )
+        self.assertEqual(set(ImportQue.objects.filter(type="anime").values_list("key", flat=True)), {"2", "3"})
+        self.assertEqual((len(columns), columns.unsaved_entries, columns.changed_rows), (3, 1, 2))
+
+
+class SyncRowsTests(TestCase):
+    def setUp(self) -> None:
+        now = timezone.now()
+        User.objects.create(
+            name="tester",
+            anime_list_private=False,
+            manga_list_private=False,
+            info_timestamp=now,
+            info_modified_timestamp=now,
+        )
+        self.user = MyAnimeListUser("tester")
+        for media_id in (1, 2, 3, 4):
+            create_anime(media_id)
+        self.saved = {x: self.user_anime(x, score=5) for x in (1, 2, 3)}
+        UserAnime.objects.bulk_create(self.saved.values())
+        self.ids = dict(UserAnime.objects.values_list("media_id", "id"))
+
+    def user_anime(self, media_id: int, score: int) -> UserAnime:
+        return UserAnime(
+            user=self.user.model,
+            media_id=media_id,
+            status=2,
+            score=score,
+            updated_at=datetime(2022, 1, 1, tzinfo=dt_timezone.utc),
+            num_episodes_watched=12,
+            is_rewatching=False,
+        )
+
+    def saved_rows(self) -> dict[int, tuple[int, int]]:
+        return {x: (i, score) for x, i, score in UserAnime.objects.values_list("media_id", "id", "score")}
+
+    def test_only_changed_rows_are_written(self) -> None:
+        rows = [self.saved[1], self.user_anime(2, score=9), self.user_anime(4, score=7)]
+        self.assertEqual(self.user.sync_rows(UserAnime, rows), 3)
+
+        # Entry 1 is unchanged, 2 is updated in place, 3 was removed from the list, and 4 is new
+        saved = self.saved_rows()
+        self.assertEqual(sorted(saved), [1, 2, 4])
+        self.assertEqual(saved[1], (self.ids[1], 5))
+        self.assertEqual(saved[2], (self.ids[2], 9))
+        self.assertEqual(saved[4][1], 7)
+
+        # The same list a second time does not change anything
+        rows = [self.saved[1], self.user_anime(2, score=9), self.user_anime(4, score=7)]
+        self.assertEqual(self.user.sync_rows(UserAnime, rows), 0)
+
+    def test_merged_rows_do_not_remove_missing_rows(self) -> None:
+        self.assertEqual(self.user.sync_rows(UserAnime, [self.user_anime(2, score=9)], remove_missing=False), 1)
+        self.assertEqual({x: score for x, (_, score) in self.saved_rows().items()}, {1: 5, 2: 9, 3: 5})
+
+
+class ListPageDownloadTests(DownloadedFilesTestCase):
+    """List pages are downloaded from a fake download function that knows the list has 3 pages"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        now = timezone.now()
+        User.objects.create(
+            name="tester",
+            anime_list_private=False,
+            manga_list_private=False,
+            info_timestamp=now,
+            info_modified_timestamp=now,
+        )
+        self.user = MyAnimeListUser("tester")
+        self.requested: list[int] = []
+        # The second and third pages are only released once both are being downloaded at the same time
+        self.both_downloading = threading.Barrier(2, timeout=5)
+
+    def download(self, url: str, *args: Any, fail_offset: int = -1, **kwargs: Any) -> tuple[int, bytes]:
+        offset = int(re.search(r"offset=(\d+)", url)[1])  # type: ignore - Every list URL has an offset
+        self.requested.append(offset)
+        if offset in (1000, 2000):
+            self.both_downloading.wait()
+        if offset == fail_offset:
+            raise OSError("Connection reset")
+        paging = {"next": "more"} if offset < 2000 else {}
+        return (
+            200,
+            json.dumps({"data": [list_entry(offset + 1, 7, "2022-01-01T00:00:00+00:00")], "paging": paging}).encode(),
+        )
+
+    def download_list(self, fail_offset: int = -1) -> None:
+        def download(*args: Any, **kwargs: Any) -> tuple[int, bytes]:
+            return self.download(*args, fail_offset=fail_offset, **kwargs)
+
+        with mock.patch("common.downloader.download", download):
+            self.user.download_list(self.user.anime_json_path, self.user.anime_json_url)
+
+    def test_pages_after_the_first_are_downloaded_at_the_same_time(self) -> None:
+        # Left over from when the list was longer
+        for offset in range(3000, 10000, 1000):
+            self.user.anime_json_path(offset).write_json({"data": [], "paging": {"next": "more"}})
+        self.download_list()
+
+        # The first page is needed to know if there are more pages
+        self.assertEqual(self.requested[0], 0)
+        self.assertEqual(
+            [x["node"]["id"] for page in self.user.list_pages("anime") for x in page["data"]], [1, 1001, 2001]
+        )
+        # Pages downloaded ahead of time are deleted along with the old pages
+        offsets = range(3000, 10000, 1000)
+        self.assertFalse([x for x in offsets if self.user.anime_json_path(x).exists()])
+
+    def test_failed_page_stops_the_download(self) -> None:
+        with self.assertRaises(OSError):
+            self.download_list(fail_offset=1000)
+        self.assertTrue(self.user.anime_json_path(0).exists())
+        self.assertFalse(self.user.anime_json_path(1000).exists())
+
+
+class WeightedFairSchedulerTests(SimpleTestCase):
+    LANES = {ImportQue.LANE_INTERACTIVE, ImportQue.LANE_USER_MEDIA, ImportQue.LANE_BACKGROUND}
+
+    def turns(self, scheduler: WeightedFairScheduler, ready: set[int], count: int) -> dict[int, int]:
+        lanes = [scheduler.next_lane(ready) for _ in range(count)]
+        return {lane: lanes.count(lane) for lane in sorted(ready)}
+
+    def test_turns_are_shared_by_weight(self) -> None:
+        scheduler = WeightedFairScheduler({0: 8, 1: 4, 2: 1})
+        self.assertEqual(self.turns(scheduler, self.LANES, 13), {0: 8, 1: 4, 2: 1})
+        self.assertEqual(self.turns(scheduler, self.LANES, 26), {0: 16, 1: 8, 2: 2})
+        self.assertIsNone(scheduler.next_lane(set()))
+
+    def test_idle_lanes_do_not_save_up_turns(self) -> None:
+        scheduler = WeightedFairScheduler({0: 8, 1: 4, 2: 1})
+        self.assertEqual(self.turns(scheduler, {ImportQue.LANE_BACKGROUND}, 10), {ImportQue.LANE_BACKGROUND: 10})
+        # The background lane was the only lane with work, it still gets its share once the others have work again
+        # Without this the other lanes would have 10 turns of catching up to do before the background lane goes again
+        lanes = [scheduler.next_lane(self.LANES) for _ in range(15)]
+        self.assertIn(ImportQue.LANE_BACKGROUND, lanes)
+
+
+class LazyModelNamingTests(TestCase):
+    def test_names_are_filled_in_from_the_class_name(self) -> None:
+        self.assertEqual(AnimeRecs._meta.db_table, "anime_recs")
+        self.assertEqual([x.name for x in AnimeRecs._meta.constraints], ["AnimeRecs_media_recommended_media"])
+        # Both foreign keys point to Anime so the attribute name keeps their related names apart
+        self.assertEqual(
+            [AnimeRecs._meta.get_field(x).remote_field.related_name for x in ("media", "recommended_media")],
+            ["AnimeRecs_Anime_media", "AnimeRecs_Anime_recommended_media"],
+        )
+        self.assertEqual(UserAnime._meta.get_field("user").remote_field.related_name, "UserAnime_User_user")
+
+    def test_names_match_the_migrations(self) -> None:
+        call_command("makemigrations", "main", "--check", "--dry-run", stdout=io.StringIO())
+
+
+class DocumentCacheTests(SimpleTestCase):
+    def setUp(self) -> None:
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = ExtendedPath(folder.name)
+        # Room for two of the 4 byte files
+        self.cache = DocumentCache(max_bytes=10)
+        self.parsed: list[bytes] = []
+
+    def file(self, name: str, content: bytes = b"1234") -> ExtendedPath:
+        path = self.folder / name
+        with open(path, "wb") as file:
+            file.write(content)
+        return path
+
+    def parse(self, content: bytes) -> bytes:
+        self.parsed.append(content)
+        return content
+
+    def get(self, path: ExtendedPath) -> bytes:
+        return self.cache.get(path, "raw", self.parse)
+
+    def test_least_recently_used_files_are_evicted(self) -> None:
+        a, b, c = self.file("a"), self.file("b"), self.file("c")
+        self.get(a)
+        self.get(b)
+        self.get(a)
+        self.get(c)
+        # b was used least recently so it was evicted to make room for c
+        self.get(a)
+        self.get(b)
+        self.assertEqual(len(self.parsed), 4)
+        self.assertEqual(
+            {x: self.cache.stats()[x] for x in ("hits", "misses", "evictions", "entries", "bytes")},
+            {"hits": 2, "misses": 4, "evictions": 2, "entries": 2, "bytes": 8},
+        )
+
+        # Files bigger than the whole cache are never cached
+        big = self.file("big", b"x" * 11)
+        self.assertEqual((self.get(big), self.get(big)), (b"x" * 11, b"x" * 11))
+        self.assertEqual(len(self.parsed), 6)
+
+    def test_changed_files_are_parsed_again(self) -> None:
+        path = self.file("a")
+        self.get(path)
+        # Same size but a new modification time
+        self.file("a", b"abcd")
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        self.assertEqual(self.get(path), b"abcd")
+        # Same modification time but a new size
+        self.file("a", b"abcde")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        self.assertEqual(self.get(path), b"abcde")
+        self.assertEqual(self.get(path), b"abcde")
+        self.assertEqual(len(self.parsed), 3)
+
+        self.cache.invalidate(path)
+        self.get(path)
+        self.assertEqual(len(self.parsed), 4)
@@ -10,4 +10,5 @@ urlpatterns = [
     path("json_response", views.json_response, name="json_response"),
     path("update/<str:username>", views.update, name="update"),
     path("delete/<str:username>", views.delete, name="delete"),
+    path("import_status/<str:username>", views.import_status, name="import_status"),
 ]
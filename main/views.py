@@ -1,15 +1,23 @@
-import subprocess
+import asyncio
+import functools
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from subprocess import PIPE
-from typing import Optional
+from typing import Any, Awaitable, Callable, Optional
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
 from django.db.models.query import prefetch_related_objects
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import redirect, render
 from django.utils.http import urlencode
 
+from common.database_router import read_from_primary
 from common.myanimelist_user import MyAnimeListUser
+from common.sql_dialect import SqlDialect, dialect_for
 from main.models import Anime, AnimeRecs, ImportQue, UserAnime
 
 from .forms import NameForm
@@ -30,58 +38,92 @@ DO_NOT_RETURN_CROSSREF = {
     "do_not_return_plan_to_watch": "5",
 }
 
+# Database work from the async views runs on a bounded pool so slow requests can't start an unlimited number of threads
+DATABASE_EXECUTOR = ThreadPoolExecutor(max_workers=settings.VIEW_EXECUTOR_WORKERS, thread_name_prefix="views")
+# Requests over this limit are turned away right away instead of waiting in a growing backlog
+# Under WSGI every request runs on its own thread and event loop, so this has to be a thread safe semaphore
+REQUEST_LIMIT = threading.BoundedSemaphore(settings.VIEW_MAX_CONCURRENT_REQUESTS)
+
+
+def run_sync(function: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """Run a blocking function on the database executor"""
+
+    @functools.wraps(function)
+    def with_connection_cleanup(*args: Any, **kwargs: Any) -> Any:
+        # Executor threads live longer than a request so clean up connections the way a request would
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(with_connection_cleanup, thread_sensitive=False, executor=DATABASE_EXECUTOR)
+
+
+def limit_concurrency(view: Callable[..., Awaitable[HttpResponse]]) -> Callable[..., Awaitable[HttpResponse]]:
+    """Return a 503 when too many requests are already being handled by this process"""
+
+    @functools.wraps(view)
+    async def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        # Never wait for a slot, waiting would block the thread and the event loop
+        if not REQUEST_LIMIT.acquire(blocking=False):
+            return HttpResponse("Too many requests, try again soon", status=503, headers={"Retry-After": "5"})
+        try:
+            return await view(request, *args, **kwargs)
+        finally:
+            REQUEST_LIMIT.release()
+
+    return wrapper
+
 
 def index(request: HttpRequest) -> HttpResponse:
     form = NameForm()
     return render(request, "main/index.html", {"form": form})
 
 
-def status_in(form: NameForm, media_type: str) -> str:
-    use_values = [value for key, value in USE_CROSSREF.items() if form.cleaned_data.get(key) == True]
-    return f"""user_{media_type}.status IN ("{'", "'.join(use_values)}'")"""
+def status_in(form: NameForm, media_type: str, dialect: SqlDialect) -> str:
+    use_values = [int(value) for key, value in USE_CROSSREF.items() if form.cleaned_data.get(key) == True]
+    return dialect.in_list(f"user_{media_type}.status", use_values)
 
 
-def do_not_return_in(form: NameForm, media_type: str) -> str:
-    do_not_return_values = [v for k, v in DO_NOT_RETURN_CROSSREF.items() if not form.cleaned_data.get(k)]
+def do_not_return_in(form: NameForm, media_type: str, dialect: SqlDialect) -> str:
+    do_not_return_values = [int(v) for k, v in DO_NOT_RETURN_CROSSREF.items() if not form.cleaned_data.get(k)]
     # If anime/manga with a specific status are set to not be returned use a more complex query
     if do_not_return_values:
-        return_string = '", "'.join(do_not_return_values)
+        not_in = dialect.not_in_list(f"rec_user_{media_type}.status", do_not_return_values)
         if form.cleaned_data.get("do_not_return_not_on_list"):
-            return (
-                f'AND (rec_user_{media_type}.status IS NULL or rec_user_{media_type}.status NOT IN ("{return_string}"))'
-            )
+            return f"AND (rec_user_{media_type}.status IS NULL or {not_in})"
         else:
-            return f'AND (rec_user_{media_type}.status NOT IN ("{return_string}"))'
+            return f"AND ({not_in})"
 
     # If all anime/manga are to be returned a simpler query can be used
     else:
         return ""
 
 
-def select_score_rec(form: NameForm, media_type: str, user: MyAnimeListUser) -> str:
+def select_score_rec(form: NameForm, media_type: str, user: MyAnimeListUser, dialect: SqlDialect) -> str:
     recs_to_truncate = form.cleaned_data["ignore_recs_over"]
-    # TODO: Technically not every query needs the IIF statement
+    # TODO: Technically not every query needs the if statement
     # TODO: Including it just makes things easier to read and write
     # TODO: Find a clean way to split this up better for faster queries
-    select_rec_score_string = f"IIF({media_type}_recs.recommendations > {recs_to_truncate}, {recs_to_truncate}"
-    # If popularity compensation is enabled use an extra math string to compensate
     # If popularity compensation is enabled use an extra math string to compensate
     if form.cleaned_data["popularity_compensation"]:
         math_string = f"({media_type}.popularity + rec_{media_type}.popularity)"
-        select_rec_score_string += f".0 * {math_string}, {media_type}_recs.recommendations * {math_string}"
+        truncated = f"{recs_to_truncate}.0 * {math_string}"
+        untruncated = f"{media_type}_recs.recommendations * {math_string}"
     else:
-        select_rec_score_string += f", {media_type}_recs.recommendations"
+        truncated = f"{recs_to_truncate}"
+        untruncated = f"{media_type}_recs.recommendations"
 
     # If score compensation is enabled add it to the equation
     if form.cleaned_data["score_compensation"]:
         # If there is no score given for an anime just use the average score for compensation
-        select_rec_score_string += (
-            f" * IIF(user_{media_type}.score = 0, {user.model.average_anime_score}, user_{media_type}.score)"
+        score = dialect.if_else(
+            f"user_{media_type}.score = 0", f"{user.model.average_anime_score}", f"user_{media_type}.score"
         )
+        untruncated += f" * {score}"
 
-    # Close up the string
-    select_rec_score_string += ")"
-    return select_rec_score_string
+    return dialect.if_else(f"{media_type}_recs.recommendations > {recs_to_truncate}", truncated, untruncated)
 
 
 def recs_string(form: NameForm, media_type: str) -> str:
@@ -93,29 +135,25 @@ def recs_string(form: NameForm, media_type: str) -> str:
 
 def join_media_if_needed(form: NameForm, media_type: str) -> str:
     if form.cleaned_data["popularity_compensation"]:
-        return f"""INNER JOIN {media_type} ON ({media_type}.id = user_{media_type}.media_id) INNER JOIN {media_type} rec_anime ON (rec_{media_type}.id = {media_type}_recs.media_id)"""
+        return f"""INNER JOIN {media_type} ON ({media_type}.id = user_{media_type}.media_id) INNER JOIN {media_type} rec_{media_type} ON (rec_{media_type}.id = {media_type}_recs.media_id)"""
     else:
         return ""
 
 
-def json_response(request: HttpRequest) -> HttpResponse:
-    form = NameForm(request.GET)
-    # TODO: Make this an actual 404-like page
-    if not form.is_valid():
-        return HttpResponse("Invalid form")
-
-    command: list[str] = ["out"]  # Start of command to run external programm
+def recommendation_sql(form: NameForm, user: MyAnimeListUser, dialect: Optional[SqlDialect] = None) -> str:
     media_type = form.cleaned_data["anime_or_manga"]
-    user = MyAnimeListUser(form.cleaned_data["username"])
+    dialect = dialect or dialect_for()
 
     # Building the SQL query by hand to make it as fast as possible
     # This is by far the slowest part of the website so it needs to be as fast as possible
+    # The status of the recommended media is in the GROUP BY because PostgreSQL requires every selected column to be
+    # The order also falls back on the id so every database returns ties in the same order
     sql_command = f"""SELECT
                         {media_type}_recs.recommended_media_id,
-                        SUM({select_score_rec(form, media_type, user)}) AS rec_score,
+                        SUM({select_score_rec(form, media_type, user, dialect)}) AS rec_score,
                         rec_user_{media_type}.status,
-                        GROUP_CONCAT({media_type}_recs.media_id, CHAR(0x1F)) AS rec_ids,
-                        GROUP_CONCAT({media_type}_recs.recommendations, CHAR(0x1F)) AS rec_counts
+                        {dialect.group_concat(f"{media_type}_recs.media_id")} AS rec_ids,
+                        {dialect.group_concat(f"{media_type}_recs.recommendations")} AS rec_counts
 
                     -- Start with all entries on the user's list
                     FROM user_{media_type}
@@ -129,57 +167,117 @@ def json_response(request: HttpRequest) -> HttpResponse:
                     LEFT JOIN user_{media_type} rec_user_{media_type} ON ({media_type}_recs.recommended_media_id = rec_user_{media_type}.media_id AND rec_user_{media_type}.user_id = {user.model.id})
 
                     -- Only the specific media type for this user
-                    WHERE ({status_in(form, media_type)} AND user_{media_type}.user_id = {user.model.id} {do_not_return_in(form, media_type)})
+                    WHERE ({status_in(form, media_type, dialect)} AND user_{media_type}.user_id = {user.model.id} {do_not_return_in(form, media_type, dialect)})
                     
-                    GROUP BY {media_type}_recs.recommended_media_id
-                    ORDER BY rec_score DESC
+                    GROUP BY {media_type}_recs.recommended_media_id, rec_user_{media_type}.status
+                    ORDER BY rec_score DESC, {media_type}_recs.recommended_media_id
                     LIMIT {form.cleaned_data['number_of_results']}
                         """
 
+    return sql_command
+
+
+@limit_concurrency
+async def json_response(request: HttpRequest) -> HttpResponse:
+    form = NameForm(request.GET)
+    # TODO: Make this an actual 404-like page
+    if not form.is_valid():
+        return HttpResponse("Invalid form")
+
+    user = await run_sync(primary_user)(form.cleaned_data["username"])
+    sql_command = recommendation_sql(form, user)
+
     # Add sql command to the command list
     command = ["out", "-sql", sql_command]
 
     command.append("-debug")
     print(sql_command)
-    jsoned = subprocess.run(command, stdout=PIPE, stderr=PIPE).stdout.decode()
+    # The external program does the heavy lifting, waiting on it does not block other requests
+    process = await asyncio.create_subprocess_exec(*command, stdout=PIPE, stderr=PIPE)
+    jsoned = (await process.communicate())[0].decode()
     return HttpResponse(jsoned)
 
 
-# TODO: Special response when dumb user disables all possible entries to use
-def recommendations(request: HttpRequest) -> HttpResponse:
-    form = NameForm(request.GET)
-    # TODO: Make this an actual 404-like page
-    if not form.is_valid():
-        return HttpResponse("Invalid form")
+def queue_interactive_user(username: str, minimum_modified_timestamp: datetime) -> None:
+    """Add a user that is waiting on a page to the front lane of the import queue"""
+    entry, created = ImportQue.objects.get_or_create(
+        type="user",
+        key=username,
+        defaults={"minimum_modified_timestamp": minimum_modified_timestamp, "lane": ImportQue.LANE_INTERACTIVE},
+    )
+    # A scheduled update that is not due yet is moved up like queue_update does, the page is waiting on it now
+    if not created:
+        entry.lane = ImportQue.LANE_INTERACTIVE
+        if entry.minimum_modified_timestamp is None or entry.minimum_modified_timestamp > minimum_modified_timestamp:
+            entry.minimum_modified_timestamp = minimum_modified_timestamp
+        entry.save(update_fields=["lane", "minimum_modified_timestamp"])
+
+
+def primary_user(username: str) -> MyAnimeListUser:
+    """Look a user up in the primary database, a user imported after the last snapshot would otherwise look new"""
+    with read_from_primary():
+        return MyAnimeListUser(username)
+
+
+def import_progress(username: str, since: datetime) -> dict[str, Any]:
+    # The progress changes every few seconds so it can't come from a snapshot
+    with read_from_primary():
+        return MyAnimeListUser(username).import_progress(since)
 
+
+@limit_concurrency
+async def import_status(request: HttpRequest, username: str) -> HttpResponse:
+    """Progress of a user's import, polled by the recommendations page while the importer works"""
+    try:
+        since = datetime.fromtimestamp(float(request.GET.get("since", 0))).astimezone()
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({"error": "since must be a unix timestamp"}, status=400)
+    progress = await run_sync(import_progress)(username, since)
+    return JsonResponse(progress)
+
+
+def render_recommendations(request: HttpRequest, form: NameForm) -> HttpResponse:
     username = request.GET.get("username")
-    user = MyAnimeListUser(username)
-    if user.model_exists:
-        # If there where missing anime entries last time the user visited the site update information
-        if user.model.user_anime().count() != user.model.anime_count:
-            modified_timestamp = datetime.now().astimezone()
-            user.update_all(minimum_modified_timestamp=modified_timestamp)
-    else:
-        if not ImportQue.objects.filter(type="user", key=username).first():
-            ImportQue.objects.create(
-                type="user", key=username, minimum_modified_timestamp=datetime.now().astimezone() - timedelta(days=365)
-            )
+    progress_since = datetime.now().astimezone()
+    # The page only polls the import status when an import was queued for it, otherwise there is nothing to wait for
+    importing = request.GET.get("redirect") == "update"
+    # Deciding if the user needs an import uses the primary database, a user imported since the last snapshot would
+    # otherwise be queued again every time the page reloads after the import
+    with read_from_primary():
+        user = MyAnimeListUser(username)
+        if user.model_exists:
+            # If there where missing anime entries last time the user visited the site update information
+            # The importer does the update so the page can be shown right away with the information that already exists
+            if user.model.user_anime().count() != user.model.anime_count:
+                queue_interactive_user(username, progress_since)
+                importing = True
+        else:
+            queue_interactive_user(username, progress_since - timedelta(days=365))
+            importing = True
 
     context = {
         "user": user,
         "form": form,
+        "progress_since": progress_since.timestamp(),
+        "importing": importing,
     }
 
-    request.GET.get("username")
+    # The template reads from the database so it is rendered on the database executor as well
     return render(request, "main/recommendations.html", context)
 
 
-def update(request: HttpRequest, username: str) -> HttpResponse:
+# TODO: Special response when dumb user disables all possible entries to use
+@limit_concurrency
+async def recommendations(request: HttpRequest) -> HttpResponse:
     form = NameForm(request.GET)
     # TODO: Make this an actual 404-like page
     if not form.is_valid():
         return HttpResponse("Invalid form")
 
+    return await run_sync(render_recommendations)(request, form)
+
+
+def queue_update(username: str) -> None:
     ImportQue.objects.get_or_create(
         type="user",
         key=username,
@@ -187,16 +285,33 @@ def update(request: HttpRequest, username: str) -> HttpResponse:
             "minimum_modified_timestamp": datetime.now().astimezone()  # Information was just imported, this value was used
         },
     )
-    return redirect(f"/recommendations?{urlencode(form.data, doseq=True)}&redirect=update")
+    # The user is waiting on this update so move it in front of background updates
+    ImportQue.objects.filter(type="user", key=username).update(lane=ImportQue.LANE_INTERACTIVE)
 
 
-def delete(request: HttpRequest, username: str) -> HttpResponse:
+@limit_concurrency
+async def update(request: HttpRequest, username: str) -> HttpResponse:
     form = NameForm(request.GET)
     # TODO: Make this an actual 404-like page
     if not form.is_valid():
         return HttpResponse("Invalid form")
 
-    user = MyAnimeListUser(username)
-    user.model.delete()
+    await run_sync(queue_update)(username)
+    return redirect(f"/recommendations?{urlencode(form.data, doseq=True)}&redirect=update")
+
+
+def delete_user(username: str) -> None:
+    user = primary_user(username)
+    if user.model_exists:
+        user.model.delete()
+
+
+@limit_concurrency
+async def delete(request: HttpRequest, username: str) -> HttpResponse:
+    form = NameForm(request.GET)
+    # TODO: Make this an actual 404-like page
+    if not form.is_valid():
+        return HttpResponse("Invalid form")
 
+    await run_sync(delete_user)(username)
     return redirect(f"/recommendations?{urlencode(form.data, doseq=True)}&redirect=delete")